@@ -4,17 +4,1408 @@
 提供HTTP API返回当前运行的进程列表
 """
 import os
+import re
 import sys
-from flask import Flask, jsonify
+import bisect
+import time
+import fnmatch
+import logging
+import threading
+import uuid
+import json
+import gzip
+import http.client
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit, urlencode
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import WSGIRequestHandler
 import psutil
 import socket
+import struct
+
+try:
+    import zstandard  # 可选：安装后支持 zstd 压缩
+except ImportError:
+    zstandard = None
 
 app = Flask(__name__)
 
+# 使用HTTP/1.1，允许监控服务器复用keep-alive连接
+WSGIRequestHandler.protocol_version = "HTTP/1.1"
+
 # 配置
 AGENT_VERSION = "1.0.0"
 AGENT_PORT = int(os.getenv('AGENT_PORT', 8888))
 AGENT_HOST = os.getenv('AGENT_HOST', '0.0.0.0')
+SAMPLE_INTERVAL = float(os.getenv('AGENT_SAMPLE_INTERVAL', 5))  # 进程采样间隔（秒）
+SCAN_MODE = os.getenv('AGENT_SCAN_MODE', 'incremental')  # incremental / psutil
+DELTA_HISTORY = int(os.getenv('AGENT_DELTA_HISTORY', 64))  # 保留的进程变化代数
+MIN_FRESH_AGE = 0.2  # 按需重新采样的最小间隔（秒），避免复查请求频繁触发全量扫描
+# 推送模式（可选）：配置服务器接入地址后，Agent主动上报进程变化
+PUSH_URL = os.getenv('AGENT_PUSH_URL', '')  # 例如 http://192.168.1.10:8080/api/ingest
+PUSH_TOKEN = os.getenv('AGENT_PUSH_TOKEN', '')
+PUSH_KEEPALIVE = float(os.getenv('AGENT_PUSH_KEEPALIVE', 10))  # 心跳间隔（秒）
+AGENT_ID = os.getenv('AGENT_ID', socket.gethostname())
+# 中继模式（可选）：汇总局域网内其他Agent的进程，监控服务器一次请求获取整个站点
+RELAY_TARGETS = [t.strip() for t in os.getenv('AGENT_RELAY_TARGETS', '').split(',') if t.strip()]  # 例如 10.0.0.2:8888,10.0.0.3
+RELAY_ENABLED = bool(RELAY_TARGETS) or os.getenv('AGENT_RELAY', '') == '1'  # 只接收推送时设置 AGENT_RELAY=1
+RELAY_INTERVAL = float(os.getenv('AGENT_RELAY_INTERVAL', SAMPLE_INTERVAL))  # 轮询局域网Agent的间隔（秒）
+RELAY_TIMEOUT = float(os.getenv('AGENT_RELAY_TIMEOUT', 5))
+RELAY_WORKERS = int(os.getenv('AGENT_RELAY_WORKERS', 16))
+RELAY_PUSH_TIMEOUT = float(os.getenv('AGENT_RELAY_PUSH_TIMEOUT', 30))  # 推送到中继的Agent超过该时间无消息视为离线
+RELAY_TOKEN = os.getenv('AGENT_RELAY_TOKEN', '')  # 局域网Agent推送到中继时的口令
+RESOURCE_WATCH_TTL = float(os.getenv('AGENT_RESOURCE_WATCH_TTL', 300))  # 超过该时间（秒）未被查询的进程不再采集资源指标
+
+logger = logging.getLogger("agent")
+
+# Linux内核 comm 字段最多保留15个字符
+COMM_MAX_LEN = 15
+
+
+# ---------- 运行指标 ----------
+# Agent以单文件部署，这里是服务器端 metrics.py 的精简版（同样的文本格式和缓存方式）
+
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _metric_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _metric_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class _MetricSeries:
+    """单个序列：计数器/仪表只用 value，直方图另有分桶计数；渲染结果缓存到下次更新"""
+
+    __slots__ = ("family", "labels", "value", "counts", "lock", "dirty", "text")
+
+    def __init__(self, family, labels):
+        self.family = family
+        self.labels = labels
+        self.value = 0.0
+        self.counts = [0] * (len(family.buckets) + 1) if family.buckets is not None else None
+        self.lock = threading.Lock()
+        self.dirty = True
+        self.text = ""
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+        self.dirty = True
+
+    def set(self, value):
+        self.value = value
+        self.dirty = True
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.family.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.value += value
+        self.dirty = True
+
+    def render(self):
+        if not self.dirty:
+            return self.text
+        self.dirty = False
+        name, names = self.family.name, self.family.labelnames
+        if self.counts is None:
+            self.text = f"{name}{_metric_labels(names, self.labels)} {_metric_value(self.value)}\n"
+            return self.text
+        with self.lock:
+            counts, total = list(self.counts), self.value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.family.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_metric_labels(names + ('le',), self.labels + (_metric_value(bound),))} {cumulative}\n")
+        labels = _metric_labels(names, self.labels)
+        lines.append(f"{name}_sum{labels} {_metric_value(total)}\n{name}_count{labels} {cumulative}\n")
+        self.text = "".join(lines)
+        return self.text
+
+
+class _MetricFamily:
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self._series = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.labels()
+        METRICS.append(self)
+
+    def labels(self, *values):
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, _MetricSeries(self, tuple(str(v) for v in values)))
+        return series
+
+    def render(self, openmetrics):
+        family = self.name[:-len("_total")] if openmetrics and self.kind == "counter" else self.name
+        body = "".join([series.render() for series in list(self._series.values())])
+        return f"# HELP {family} {self.documentation}\n# TYPE {family} {self.kind}\n{body}"
+
+
+METRICS = []
+SAMPLE_DURATION = _MetricFamily("histogram", "agent_sample_duration_seconds", "遍历一次进程表的耗时（秒）", buckets=METRIC_BUCKETS)
+PROCESS_NAMES = _MetricFamily("gauge", "agent_process_names", "最近一次采样的不同进程名数量")
+HTTP_REQUESTS = _MetricFamily("counter", "agent_http_requests_total", "Agent处理的HTTP请求数", ("endpoint", "code"))
+HTTP_DURATION = _MetricFamily("histogram", "agent_http_request_duration_seconds", "Agent处理HTTP请求的耗时（秒）",
+                              ("endpoint",), METRIC_BUCKETS)
+PUSH_CONNECTIONS = _MetricFamily("counter", "agent_push_connections_total", "推送连接建立次数（含重连）")
+RELAY_POLL_DURATION = _MetricFamily("histogram", "agent_relay_poll_duration_seconds", "中继轮询一个局域网Agent的耗时（秒）",
+                                    ("target",), METRIC_BUCKETS)
+RELAY_POLL_ERRORS = _MetricFamily("counter", "agent_relay_poll_errors_total", "中继轮询局域网Agent失败次数", ("target",))
+RESOURCE_DURATION = _MetricFamily("histogram", "agent_resource_collect_duration_seconds", "采集一次被监控进程资源指标的耗时（秒）",
+                                  buckets=METRIC_BUCKETS)
+RESOURCE_PROCESSES = _MetricFamily("gauge", "agent_resource_processes", "最近一次采集资源指标的进程数")
+
+
+# ---------- 响应编码 ----------
+# 与服务器端 wire.py 相同的紧凑二进制格式：进程名列表以 NUL 分隔整体编码，其余字段为JSON。
+# 调用方在 Accept 中声明时使用紧凑格式，在 Accept-Encoding 中声明时压缩，否则返回普通JSON。
+
+COMPACT_TYPE = "application/x-monitor-compact"
+COMPACT_ACCEPT = f"{COMPACT_TYPE}, application/json;q=0.9"
+COMPACT_MAGIC = b"PMC1"
+COMPACT_LIST_KEYS = frozenset(("processes", "added", "removed"))
+_COMPACT_LENGTH = struct.Struct("<I")
+COMPRESS_MIN_SIZE = 1024  # 小于该字节数的响应不压缩（增量/查询结果通常只有几百字节）
+GZIP_LEVEL = 1  # 响应在每次请求时重新编码，level 1 耗时不到默认级别的一半，体积只大15%左右
+ZSTD_LEVEL = 3
+
+
+def encode_compact(payload):
+    """编码为紧凑格式: MAGIC | u32 头部长度 | 头部JSON [payload, [[路径, 元素数], ...]] | (u32 长度 | 数据)*"""
+    blobs = []
+    lists = []
+
+    def strip(value, path):
+        if not isinstance(value, dict):
+            return value
+        result = {}
+        for key, item in value.items():
+            if key in COMPACT_LIST_KEYS and isinstance(item, (list, tuple)):
+                lists.append([path + [key], len(item)])
+                blobs.append("\0".join(item).encode("utf-8"))
+                result[key] = None
+            else:
+                result[key] = strip(item, path + [key])
+        return result
+
+    header = json.dumps([strip(payload, []), lists], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    parts = [COMPACT_MAGIC, _COMPACT_LENGTH.pack(len(header)), header]
+    for blob in blobs:
+        parts.append(_COMPACT_LENGTH.pack(len(blob)))
+        parts.append(blob)
+    return b"".join(parts)
+
+
+def decode_compact(data):
+    """解码紧凑格式（数据损坏时抛出 ValueError）"""
+    if data[:4] != COMPACT_MAGIC:
+        raise ValueError("不是紧凑格式的数据")
+    try:
+        (header_length,) = _COMPACT_LENGTH.unpack_from(data, 4)
+        offset = 8 + header_length
+        payload, lists = json.loads(data[8:offset])
+        for path, count in lists:
+            (length,) = _COMPACT_LENGTH.unpack_from(data, offset)
+            offset += 4
+            blob = data[offset:offset + length]
+            offset += length
+
+            target = payload
+            for key in path[:-1]:
+                target = target[key]
+            target[path[-1]] = blob.decode("utf-8").split("\0") if count else []
+    except (struct.error, KeyError, IndexError, TypeError) as e:
+        raise ValueError(f"紧凑格式数据损坏: {e}") from e
+    return payload
+
+
+def choose_encoding(accept_encoding):
+    """
+    根据 Accept-Encoding 选择压缩算法
+
+    Returns:
+        str: "zstd" / "gzip"；调用方不支持时返回None
+    """
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.partition("=")
+        if name.strip() == "q" and value.strip().rstrip("0").rstrip(".") in ("", "0"):
+            continue  # q=0 表示拒绝该编码
+        accepted.add(coding.strip().lower())
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def decompress_body(body, encoding):
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding and encoding != "identity":
+        raise ValueError(f"不支持的压缩格式: {encoding}")
+    return body
+
+
+def encode_payload(payload, compact, encoding):
+    """
+    编码响应内容
+
+    Returns:
+        (body, content_type, content_encoding): 响应过小时不压缩，content_encoding 为None
+    """
+    if compact:
+        body, content_type = encode_compact(payload), COMPACT_TYPE
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        content_type = "application/json"
+    if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+        return body, content_type, None
+    return compress_body(body, encoding), content_type, encoding
+
+
+def accepts_compact():
+    return COMPACT_TYPE in request.headers.get("Accept", "")
+
+
+def negotiated_response(payload):
+    """按当前请求的 Accept / Accept-Encoding 编码响应"""
+    body, content_type, encoding = encode_payload(
+        payload, accepts_compact(), choose_encoding(request.headers.get("Accept-Encoding")))
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, content_type=content_type, headers=headers)
+
+
+class PsutilEnumerator:
+    """全量枚举：每次用 psutil 遍历整个进程表"""
+
+    def __init__(self):
+        self._pids = {}  # {name: [pid]}
+
+    def scan(self):
+        """
+        Returns:
+            dict: {进程名: 进程数}
+        """
+        pids = {}
+        for proc in psutil.process_iter(['name']):
+            name = proc.info['name']
+            if name:
+                pids.setdefault(name, []).append(proc.pid)
+        self._pids = pids
+        return {name: len(name_pids) for name, name_pids in pids.items()}
+
+    def pids_of(self, names):
+        """
+        Returns:
+            dict: {进程名: [PID]}，只包含上次扫描中存在的进程名
+        """
+        return {name: list(self._pids[name]) for name in names if name in self._pids}
+
+    def pids(self):
+        return {pid for name_pids in self._pids.values() for pid in name_pids}
+
+
+class IncrementalEnumerator:
+    """
+    增量枚举：记住上次扫描到的PID，只为新出现的PID解析进程名
+
+    Linux 下直接读取 /proc/<pid>/comm（名称被截断到15个字符时
+    与 psutil 一样用 cmdline 补全），其他平台回退到 psutil.Process(pid).name()。
+    PID 在两次扫描之间被回收复用的情况会沿用旧名称，直到该PID消失，
+    在采样间隔（秒级）内这种情况极少发生。
+    """
+
+    def __init__(self, proc_root=None):
+        if proc_root is None and sys.platform.startswith("linux") and os.path.isdir("/proc"):
+            proc_root = "/proc"
+        self.proc_root = proc_root
+        self._names = {}  # {pid: name}
+        self._pids = {}  # {name: {pid}}
+
+    def _list_pids(self):
+        if self.proc_root:
+            return {int(entry) for entry in os.listdir(self.proc_root) if entry.isdigit()}
+        return set(psutil.pids())
+
+    def _read_proc_file(self, pid, filename):
+        with open(f"{self.proc_root}/{pid}/{filename}", "rb") as f:
+            return f.read()
+
+    def _resolve_name(self, pid):
+        """解析单个PID的进程名，进程已退出或无权限时返回None"""
+        if not self.proc_root:
+            try:
+                return psutil.Process(pid).name()
+            except psutil.Error:
+                return None
+
+        try:
+            name = self._read_proc_file(pid, "comm").rstrip(b"\n").decode("utf-8", "replace")
+        except OSError:
+            return None
+
+        if len(name) >= COMM_MAX_LEN:
+            # comm 被截断，尝试从 cmdline 取完整名称（与 psutil 的处理一致）
+            try:
+                cmdline = self._read_proc_file(pid, "cmdline")
+            except OSError:
+                return name
+            if cmdline:
+                exe_name = os.path.basename(cmdline.split(b"\0", 1)[0].decode("utf-8", "replace"))
+                if exe_name.startswith(name):
+                    return exe_name
+        return name
+
+    def scan(self):
+        """
+        Returns:
+            dict: {进程名: 进程数}
+        """
+        pids = self._list_pids()
+        names = self._names
+        name_pids = self._pids
+
+        for pid in names.keys() - pids:
+            name = names.pop(pid)
+            name_pids[name].discard(pid)
+            if not name_pids[name]:
+                del name_pids[name]
+
+        for pid in pids - names.keys():
+            name = self._resolve_name(pid)
+            if name:
+                names[pid] = name
+                name_pids.setdefault(name, set()).add(pid)
+
+        return {name: len(members) for name, members in name_pids.items()}
+
+    def pids_of(self, names):
+        """
+        Returns:
+            dict: {进程名: [PID]}，只包含上次扫描中存在的进程名
+        """
+        return {name: list(self._pids[name]) for name in names if name in self._pids}
+
+    def pids(self):
+        return set(self._names)
+
+
+def create_enumerator(mode):
+    """根据模式创建进程枚举器"""
+    if mode == "psutil":
+        return PsutilEnumerator()
+    return IncrementalEnumerator()
+
+
+class ProcessSampler:
+    """
+    后台进程采样器
+
+    按固定间隔遍历一次进程表，生成 进程名→数量 的快照，
+    API请求直接读取快照，不再每次请求都遍历全部进程。
+
+    进程名集合每变化一次，代数(generation)加1，并记录该代新增/消失的进程名，
+    供增量接口计算差异。epoch 在每次Agent启动时随机生成，用于识别Agent重启。
+    """
+
+    def __init__(self, interval, enumerator, history_size=64):
+        self.interval = interval
+        self.enumerator = enumerator
+        self.epoch = uuid.uuid4().hex[:12]
+        self._history = deque(maxlen=history_size)  # [(generation, added, removed)]
+        self._snapshot = None
+        self._changed = threading.Condition()  # 代数变化时通知推送线程
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()  # 增量枚举器有内部状态，扫描需串行
+        self._observers = []  # 每次采样后调用的函数 (snapshot) -> None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def add_observer(self, observer):
+        """注册采样后的回调（在采样线程中调用，异常只记录）"""
+        self._observers.append(observer)
+
+    def pids_of(self, names):
+        """
+        Returns:
+            dict: {进程名: [PID]}，来自最近一次扫描
+        """
+        with self._scan_lock:
+            return self.enumerator.pids_of(names)
+
+    def current_pids(self):
+        """
+        Returns:
+            set: 最近一次扫描到的全部PID
+        """
+        with self._scan_lock:
+            return self.enumerator.pids()
+
+    def sample(self):
+        """遍历进程表，生成新的快照"""
+        with self._scan_lock:
+            started = time.perf_counter()
+            counts = self.enumerator.scan()
+            SAMPLE_DURATION.labels().observe(time.perf_counter() - started)
+            PROCESS_NAMES.labels().set(len(counts))
+
+            previous = self._snapshot
+            generation = previous["generation"] if previous else 0
+            if previous is None:
+                generation += 1
+            elif previous["counts"].keys() != counts.keys():
+                generation += 1
+                added = sorted(counts.keys() - previous["counts"].keys())
+                removed = sorted(previous["counts"].keys() - counts.keys())
+                self._history.append((generation, added, removed))
+
+            snapshot = {
+                "taken_at": time.time(),
+                "generation": generation,
+                "counts": counts,
+                "names": sorted(counts)
+            }
+            self._snapshot = snapshot  # 整体替换，读取方无需加锁
+
+        if previous is None or previous["generation"] != generation:
+            with self._changed:
+                self._changed.notify_all()
+        for observer in self._observers:
+            try:
+                observer(snapshot)
+            except Exception as e:
+                logger.error(f"采样回调失败: {e}")
+        return snapshot
+
+    def wait_for_change(self, generation, timeout):
+        """等待快照代数不等于 generation，超时后返回当前快照"""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._snapshot is not None and self._snapshot["generation"] != generation,
+                timeout=timeout
+            )
+        return self.get_snapshot()
+
+    def get_changes_since(self, since, generation):
+        """
+        合并 since 之后到 generation 为止的所有变化
+
+        Returns:
+            (added, removed): 净新增/净消失的进程名列表
+            None: 历史记录不足，需要全量同步
+        """
+        changes = [change for change in list(self._history) if since < change[0] <= generation]
+        if len(changes) != generation - since:
+            return None
+
+        added = set()
+        removed = set()
+        for _, change_added, change_removed in changes:
+            for name in change_added:
+                if name in removed:
+                    removed.discard(name)
+                else:
+                    added.add(name)
+            for name in change_removed:
+                if name in added:
+                    added.discard(name)
+                else:
+                    removed.add(name)
+        return sorted(added), sorted(removed)
+
+    def get_snapshot(self):
+        """获取最近的快照（尚无快照时同步采样一次）"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.start()
+            with self._lock:
+                snapshot = self._snapshot or self.sample()
+        return snapshot
+
+    def start(self):
+        """启动后台采样线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name="ProcessSampler", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        """采样循环（在独立线程中运行）"""
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"进程采样失败: {e}")
+            self._stop_event.wait(timeout=self.interval)
+
+    def stop(self):
+        """停止采样"""
+        self._stop_event.set()
+
+
+sampler = ProcessSampler(SAMPLE_INTERVAL, create_enumerator(SCAN_MODE), DELTA_HISTORY)
+
+
+def snapshot_age(snapshot):
+    """快照距今的秒数"""
+    return round(time.time() - snapshot["taken_at"], 3)
+
+
+def _trie_pattern(words):
+    """
+    把一组字面量构建成前缀树形式的正则（同一位置优先匹配最长的字面量）
+
+    例如 ["java", "javac", "jar"] -> ja(?:r|va(?:c)?)
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}  # 字面量结束
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class CompiledRules:
+    """
+    一组规则编译成的组合匹配器，每个字符串只扫描一次
+
+    - 子串: 全部子串构建成一个前缀树正则，以前瞻方式在每个位置找到最长的子串，
+      再按长度查表得到同一位置开始的较短子串
+    - 正则: 合并成一个正则先判断是否可能命中，命中后再逐条确认（合并失败时逐条匹配）
+    - 完整字符串: 字典查找
+    """
+
+    def __init__(self, substrings=None, regexes=None, exacts=None):
+        """
+        Args:
+            substrings: {子串: [规则]}
+            regexes: [(规则, re.Pattern)]
+            exacts: {完整字符串: [规则]}
+        """
+        self._substrings = substrings or {}
+        self._lengths = sorted({len(s) for s in self._substrings})
+        self._trie = re.compile(f"(?=({_trie_pattern(self._substrings)}))") if self._substrings else None
+        self._regexes = regexes or []
+        self._any_regex = None
+        if len(self._regexes) > 1:
+            try:
+                self._any_regex = re.compile("|".join(f"(?:{compiled.pattern})" for _, compiled in self._regexes))
+            except re.error:
+                pass  # 含反向引用等无法合并的正则
+        self._exacts = exacts or {}
+
+    def match(self, text, exact=None):
+        """
+        Returns:
+            set: 命中的规则
+        """
+        matched = set()
+        if exact and exact in self._exacts:
+            matched.update(self._exacts[exact])
+
+        if self._trie is not None:
+            seen = set()
+            for found in self._trie.finditer(text):
+                longest = found.group(1)
+                if longest in seen:
+                    continue
+                seen.add(longest)
+                for length in self._lengths:
+                    if length > len(longest):
+                        break
+                    rules = self._substrings.get(longest[:length])
+                    if rules:
+                        matched.update(rules)
+
+        if self._regexes and (self._any_regex is None or self._any_regex.search(text)):
+            matched.update(rule for rule, compiled in self._regexes if compiled.search(text))
+        return matched
+
+
+class _RuleIndex:
+    """规则 → 匹配对象（进程名或PID）的增量索引：对象增删时只匹配新对象，规则变化时全部重新匹配"""
+
+    def __init__(self):
+        self.compiled = CompiledRules()
+        self.members = {}  # {规则: {对象}}
+        self._matches = {}  # {对象: 命中的规则}，只记录命中了规则的对象
+
+    def rebuild(self, compiled, rules, subjects):
+        """subjects: {对象: (匹配文本, 精确匹配键)}"""
+        self.compiled = compiled
+        self.members = {rule: set() for rule in rules}
+        self._matches = {}
+        for key, (text, exact) in subjects.items():
+            self.add(key, text, exact)
+
+    def add(self, key, text, exact=None):
+        rules = self.compiled.match(text, exact)
+        if rules:
+            self._matches[key] = rules
+            for rule in rules:
+                self.members[rule].add(key)
+
+    def remove(self, key):
+        for rule in self._matches.pop(key, ()):
+            self.members[rule].discard(key)
+
+
+class PatternMatcher:
+    """
+    进程匹配规则（与监控服务器一致）
+
+    - 精确进程名：直接查快照中的进程数
+    - "re:" 正则 / 包含 * ? [ 的通配符：匹配进程名
+    - "cmd:" 子串 / "cmdre:" 正则：匹配完整命令行（参数以空格连接，不受15字符 comm 截断影响）
+    - "exe:" 可执行文件的完整路径（符号链接按解析后的真实路径匹配）
+
+    查询过的全部规则编译成组合匹配器（CompiledRules），并维护 规则→匹配对象 的增量索引：
+    进程名集合变化时只匹配新出现的进程名，命令行规则在每次采样后只为新出现的PID读取命令行并匹配，
+    每个进程名/命令行只扫描一次，而不是每条规则各扫描一次。
+    PID 的命令行按首次读取时缓存（与进程名一样，运行中修改的进程标题不会被发现）。
+    无法编译的规则记为0个进程，错误信息通过 errors 返回。
+    """
+
+    REGEX_PREFIX = "re:"
+    CMDLINE_PREFIX = "cmd:"
+    CMDLINE_REGEX_PREFIX = "cmdre:"
+    EXE_PREFIX = "exe:"
+    GLOB_CHARS = frozenset("*?[")
+    MAX_CACHED_PATTERNS = 4096
+
+    def __init__(self, sampler, proc_root=None):
+        if proc_root is None and sys.platform.startswith("linux") and os.path.isdir("/proc"):
+            proc_root = "/proc"
+        self.sampler = sampler
+        self.proc_root = proc_root
+        self._kinds = {}  # {规则: "exact" / "name" / "command" / "error"}
+        self._errors = {}  # {规则: 编译错误}
+        self._name_rules = {}  # {规则: re.Pattern}
+        self._command_rules = {}  # {规则: ("cmd" / "cmdre" / "exe", 子串/re.Pattern/{路径})}
+        self._names = _RuleIndex()
+        self._names_generation = None  # None 表示规则变化后尚未重建
+        self._commands = {}  # {pid: (命令行, 可执行文件路径)}
+        self._command_index = _RuleIndex()
+        self._commands_synced = False  # False 表示规则变化后尚未重建
+        self._lock = threading.Lock()
+
+    # ---------- 规则 ----------
+
+    def _register(self, pattern):
+        kind = self._kinds.get(pattern)
+        if kind is not None:
+            return kind
+
+        try:
+            if pattern.startswith(self.CMDLINE_PREFIX):
+                value = pattern[len(self.CMDLINE_PREFIX):]
+                if not value:
+                    raise re.error("cmd: 规则不能为空")
+                self._command_rules[pattern] = ("cmd", value)
+                kind = "command"
+            elif pattern.startswith(self.CMDLINE_REGEX_PREFIX):
+                self._command_rules[pattern] = ("cmdre", re.compile(pattern[len(self.CMDLINE_REGEX_PREFIX):]))
+                kind = "command"
+            elif pattern.startswith(self.EXE_PREFIX):
+                # /proc/<pid>/exe 是解析过符号链接的真实路径，配置的路径按原样和解析后两种形式匹配
+                path = pattern[len(self.EXE_PREFIX):]
+                paths = {path, os.path.realpath(path)} if os.path.isabs(path) else {path}
+                self._command_rules[pattern] = ("exe", paths)
+                kind = "command"
+            elif pattern.startswith(self.REGEX_PREFIX):
+                self._name_rules[pattern] = re.compile(pattern[len(self.REGEX_PREFIX):])
+                kind = "name"
+            elif self.GLOB_CHARS.intersection(pattern):
+                self._name_rules[pattern] = re.compile(fnmatch.translate(pattern))
+                kind = "name"
+            else:
+                kind = "exact"
+        except re.error as e:
+            self._errors[pattern] = str(e)
+            kind = "error"
+
+        if kind == "name":
+            self._names_generation = None
+        elif kind == "command":
+            self._commands_synced = False
+        self._kinds[pattern] = kind
+        return kind
+
+    def _reset(self):
+        self._kinds.clear()
+        self._errors.clear()
+        self._name_rules.clear()
+        self._command_rules.clear()
+        self._names_generation = None
+        self._commands_synced = False
+        self._commands.clear()
+
+    # ---------- 增量索引 ----------
+
+    def _sync_names(self, snapshot):
+        """把进程名索引同步到快照（只匹配新出现的进程名）"""
+        generation = snapshot["generation"]
+        if self._names_generation == generation:
+            return
+        changes = None
+        if self._names_generation is not None and self._names_generation < generation:
+            changes = self.sampler.get_changes_since(self._names_generation, generation)
+
+        if changes is None:
+            compiled = CompiledRules(regexes=list(self._name_rules.items()))
+            self._names.rebuild(compiled, self._name_rules, {name: (name, None) for name in snapshot["counts"]})
+        else:
+            added, removed = changes
+            for name in removed:
+                self._names.remove(name)
+            for name in added:
+                self._names.add(name, name)
+        self._names_generation = generation
+
+    def _read_command(self, pid):
+        """
+        Returns:
+            (cmdline, exe): 进程已退出或无权限时返回None（无法读取 exe 时为空字符串）
+        """
+        if not self.proc_root:
+            try:
+                proc = psutil.Process(pid)
+                cmdline = " ".join(proc.cmdline())
+            except psutil.Error:
+                return None
+            try:
+                exe = proc.exe()
+            except psutil.Error:
+                exe = ""
+            return cmdline, exe
+
+        try:
+            with open(f"{self.proc_root}/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().rstrip(b"\0").replace(b"\0", b" ").decode("utf-8", "replace")
+        except OSError:
+            return None
+        try:
+            exe = os.readlink(f"{self.proc_root}/{pid}/exe")
+        except OSError:
+            exe = ""  # 内核线程，或Agent无权限读取其他用户的进程
+        if exe.endswith(" (deleted)"):
+            exe = exe[:-len(" (deleted)")]
+        return cmdline, exe
+
+    def _sync_commands(self, pids):
+        """把命令行索引同步到当前PID集合（只为新出现的PID读取命令行并匹配）"""
+        commands = self._commands
+        for pid in commands.keys() - pids:
+            del commands[pid]
+            self._command_index.remove(pid)
+
+        new_pids = pids - commands.keys()
+        for pid in new_pids:
+            command = self._read_command(pid)
+            if command is not None:
+                commands[pid] = command
+
+        if not self._commands_synced:
+            substrings = {}
+            regexes = []
+            exes = {}
+            for rule, (kind, value) in self._command_rules.items():
+                if kind == "cmd":
+                    substrings.setdefault(value, []).append(rule)
+                elif kind == "cmdre":
+                    regexes.append((rule, value))
+                else:
+                    for path in value:
+                        exes.setdefault(path, []).append(rule)
+            self._command_index.rebuild(CompiledRules(substrings, regexes, exes), self._command_rules,
+                                        {pid: command for pid, command in commands.items()})
+            self._commands_synced = True
+        else:
+            for pid in new_pids:
+                if pid in commands:
+                    self._command_index.add(pid, *commands[pid])
+
+    def on_sample(self, snapshot):
+        """采样回调：有命令行规则时同步新出现/消失的PID"""
+        if not self._command_rules:
+            return
+        with self._lock:
+            self._sync_commands(self.sampler.current_pids())
+
+    def _prepare(self, patterns, snapshot):
+        """登记规则并同步需要用到的索引（调用方持有 _lock）"""
+        if len(self._kinds) + len(patterns) > self.MAX_CACHED_PATTERNS:
+            self._reset()
+        kinds = {pattern: self._register(pattern) for pattern in patterns}
+        used = set(kinds.values())
+        if "name" in used:
+            self._sync_names(snapshot)
+        if "command" in used and not self._commands_synced:
+            self._sync_commands(self.sampler.current_pids())
+        return kinds
+
+    # ---------- 查询 ----------
+
+    def count(self, patterns, snapshot):
+        """
+        统计每条规则在快照中匹配到的进程数
+
+        Returns:
+            (results, errors): {规则: 进程数}, {规则: 错误信息}
+        """
+        counts = snapshot["counts"]
+        results = {}
+        errors = {}
+        with self._lock:
+            kinds = self._prepare(patterns, snapshot)
+            for pattern, kind in kinds.items():
+                if kind == "exact":
+                    results[pattern] = counts.get(pattern, 0)
+                elif kind == "name":
+                    results[pattern] = sum(counts.get(name, 0) for name in self._names.members[pattern])
+                elif kind == "command":
+                    results[pattern] = len(self._command_index.members[pattern])
+                else:
+                    results[pattern] = 0
+                    errors[pattern] = self._errors[pattern]
+        return results, errors
+
+    def match_pids(self, patterns, snapshot):
+        """
+        列出每条规则匹配到的PID（无效规则匹配不到任何进程）
+
+        Returns:
+            dict: {规则: [PID]}
+        """
+        with self._lock:
+            kinds = self._prepare(patterns, snapshot)
+            names = {}
+            matched = {}
+            for pattern, kind in kinds.items():
+                if kind == "exact":
+                    names[pattern] = [pattern]
+                elif kind == "name":
+                    names[pattern] = list(self._names.members[pattern])
+                elif kind == "command":
+                    matched[pattern] = list(self._command_index.members[pattern])
+                else:
+                    matched[pattern] = []
+        pids = self.sampler.pids_of({name for group in names.values() for name in group})
+        for pattern, group in names.items():
+            matched[pattern] = [pid for name in group for pid in pids.get(name, ())]
+        return matched
+
+
+matcher = PatternMatcher(sampler)
+sampler.add_observer(matcher.on_sample)
+
+
+class ResourceCollector:
+    """
+    被监控进程的资源指标：CPU%、RSS、线程数、打开的文件数、运行时长
+
+    只采集调用方查询过的规则匹配到的进程：采样器每次遍历进程表后，
+    对这些PID各进入一次 psutil oneshot() 读取全部指标（同一个 /proc 文件只读一次）。
+    CPU% 由相邻两次采集的CPU时间差除以间隔得到，不像 cpu_percent(interval) 那样阻塞等待；
+    新出现的进程要到下一次采样后才有 CPU%。超过 watch_ttl 秒未被查询的规则不再采集。
+    """
+
+    def __init__(self, sampler, matcher, watch_ttl=300):
+        self.sampler = sampler
+        self.matcher = matcher
+        self.watch_ttl = watch_ttl
+        self._watched = {}  # {规则: 最近一次查询的时间}
+        self._procs = {}  # {pid: (psutil.Process, 上次CPU时间, 上次采集时间)}
+        self._results = {}  # {规则: 汇总}
+        self._lock = threading.Lock()  # 保护 _watched
+        self._collect_lock = threading.Lock()  # 采样线程和请求线程都会采集
+
+    def query(self, patterns):
+        """
+        获取规则的最新资源汇总（新规则立即采集一次）
+
+        Returns:
+            dict: {规则: {"count", "cpu_percent", "rss", "threads", "fds", "uptime"}}
+        """
+        now = time.monotonic()
+        with self._lock:
+            new = [pattern for pattern in patterns if pattern not in self._watched]
+            for pattern in patterns:
+                self._watched[pattern] = now
+        if new:
+            self.collect(self.sampler.get_snapshot(), new)
+        results = self._results
+        return {pattern: results.get(pattern, {"count": 0}) for pattern in patterns}
+
+    def collect(self, snapshot, patterns=None):
+        """
+        采集规则匹配到的进程（patterns 为None时采集全部仍在查询的规则，并清理不再需要的进程）
+        """
+        if patterns is None:
+            deadline = time.monotonic() - self.watch_ttl
+            with self._lock:
+                for pattern in [p for p, last in self._watched.items() if last < deadline]:
+                    del self._watched[pattern]
+                patterns = list(self._watched)
+            full = True
+        else:
+            full = False
+        if not patterns and not self._procs:
+            return
+
+        started = time.perf_counter()
+        matched = self.matcher.match_pids(patterns, snapshot)
+        with self._collect_lock:
+            now = time.monotonic()
+            stats = {}
+            for pids in matched.values():
+                for pid in pids:
+                    if pid not in stats:
+                        stats[pid] = self._read(pid, now)
+
+            # 保留其他线程刚采集的新规则，丢弃已不再查询的规则
+            results = {pattern: result for pattern, result in self._results.items() if pattern in self._watched}
+            for pattern, pids in matched.items():
+                results[pattern] = self._aggregate([stats[pid] for pid in pids if stats[pid] is not None])
+            if full:
+                for pid in self._procs.keys() - stats.keys():
+                    del self._procs[pid]
+                RESOURCE_PROCESSES.labels().set(len(stats))
+            self._results = results  # 整体替换，读取方无需加锁
+        RESOURCE_DURATION.labels().observe(time.perf_counter() - started)
+
+    def _read(self, pid, now):
+        """
+        读取单个进程的指标
+
+        Returns:
+            tuple: (cpu_percent, rss, threads, fds, uptime)，进程已退出或无权限时返回None
+        """
+        cached = self._procs.get(pid)
+        try:
+            proc = cached[0] if cached else psutil.Process(pid)
+            with proc.oneshot():
+                cpu_times = proc.cpu_times()
+                rss = proc.memory_info().rss
+                threads = proc.num_threads()
+                started = proc.create_time()
+                try:
+                    fds = proc.num_fds()
+                except (psutil.AccessDenied, AttributeError):
+                    fds = None  # 其他用户的进程（Agent非root运行时）或非POSIX平台
+        except psutil.Error:
+            self._procs.pop(pid, None)
+            return None
+
+        cpu_total = cpu_times.user + cpu_times.system
+        cpu_percent = None
+        if cached and now > cached[2]:
+            cpu_percent = max(0.0, (cpu_total - cached[1]) / (now - cached[2]) * 100)
+        self._procs[pid] = (proc, cpu_total, now)
+        return cpu_percent, rss, threads, fds, max(0.0, time.time() - started)
+
+    @staticmethod
+    def _aggregate(stats):
+        """
+        汇总同一规则匹配到的全部进程：CPU%/RSS/线程数/文件数为总和，uptime 取最近启动的进程
+        """
+        if not stats:
+            return {"count": 0}
+        cpu = [s[0] for s in stats if s[0] is not None]
+        fds = [s[3] for s in stats if s[3] is not None]
+        return {
+            "count": len(stats),
+            "cpu_percent": round(sum(cpu), 1) if cpu else None,
+            "rss": sum(s[1] for s in stats),
+            "threads": sum(s[2] for s in stats),
+            "fds": sum(fds) if len(fds) == len(stats) else None,
+            "uptime": round(min(s[4] for s in stats), 1)
+        }
+
+
+resources = ResourceCollector(sampler, matcher, RESOURCE_WATCH_TTL)
+sampler.add_observer(resources.collect)
+
+
+class PushClient:
+    """
+    推送模式客户端
+
+    以分块传输(chunked)保持到监控服务器 /api/ingest 的长连接，每行一条JSON消息：
+    连接建立后先发送全量(full)，之后进程集合一变化就发送增量(delta)，
+    空闲时每 keepalive 秒发送一次心跳。连接断开后按指数退避重连并重新全量同步。
+    """
+
+    MAX_BACKOFF = 60
+
+    def __init__(self, url, agent_id, sampler, keepalive=10, token=""):
+        self.url = url
+        self.agent_id = agent_id
+        self.sampler = sampler
+        self.keepalive = keepalive
+        self.token = token
+        self._stop_event = threading.Event()
+
+    def _encode(self, message):
+        message["agent_id"] = self.agent_id
+        return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _full_message(self, snapshot):
+        return self._encode({
+            "type": "full",
+            "hostname": socket.gethostname(),
+            "epoch": self.sampler.epoch,
+            "generation": snapshot["generation"],
+            "processes": snapshot["names"]
+        })
+
+    def _events(self):
+        """生成推送消息流（阻塞等待进程变化）"""
+        snapshot = self.sampler.get_snapshot()
+        generation = snapshot["generation"]
+        yield self._full_message(snapshot)
+
+        while not self._stop_event.is_set():
+            snapshot = self.sampler.wait_for_change(generation, self.keepalive)
+            if snapshot["generation"] == generation:
+                yield self._encode({"type": "keepalive", "generation": generation})
+                continue
+
+            changes = self.sampler.get_changes_since(generation, snapshot["generation"])
+            if changes is None:
+                yield self._full_message(snapshot)
+            else:
+                yield self._encode({
+                    "type": "delta",
+                    "epoch": self.sampler.epoch,
+                    "since": generation,
+                    "generation": snapshot["generation"],
+                    "added": changes[0],
+                    "removed": changes[1]
+                })
+            generation = snapshot["generation"]
+
+    def _push_once(self):
+        """建立一次推送连接，直到连接断开"""
+        parts = urlsplit(self.url)
+        if parts.scheme == "https":
+            conn = http.client.HTTPSConnection(parts.hostname, parts.port or 443, timeout=30)
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+
+        headers = {"Content-Type": "application/x-ndjson"}
+        if self.token:
+            headers["X-Agent-Token"] = self.token
+        PUSH_CONNECTIONS.labels().inc()
+
+        try:
+            conn.request("POST", parts.path or "/", body=self._events(), headers=headers, encode_chunked=True)
+            response = conn.getresponse()
+            logger.warning(f"推送连接被服务器关闭: HTTP {response.status} {response.read()[:200]!r}")
+        finally:
+            conn.close()
+
+    def run(self):
+        """推送循环（在独立线程中运行）"""
+        logger.info(f"推送模式已启动: {self.url} (agent_id={self.agent_id})")
+        backoff = 1
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self._push_once()
+            except (OSError, http.client.HTTPException) as e:
+                logger.warning(f"推送连接断开: {e}")
+
+            # 连接保持过一段时间说明服务端正常，重置退避
+            if time.monotonic() - started > self.keepalive * 3:
+                backoff = 1
+            self._stop_event.wait(timeout=backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+    def start(self):
+        """启动推送线程"""
+        thread = threading.Thread(target=self.run, name="PushClient", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """停止推送"""
+        self._stop_event.set()
+
+
+class RelayCollector:
+    """
+    中继模式：汇总局域网内其他Agent的进程集合
+
+    - 轮询: 每 interval 秒并发请求 AGENT_RELAY_TARGETS 中各Agent的增量接口，
+      每个Agent保持一个keep-alive连接和一份进程名镜像
+    - 接收: 局域网Agent也可以把 AGENT_PUSH_URL 指向中继的 /api/ingest，按 agent_id 汇总
+
+    监控服务器通过 /api/relay/batch 一次获取整个站点。站点内容变化时版本号加1，
+    编码后的响应按版本缓存，版本未变时服务器凭ETag得到304。
+    """
+
+    REQUEST_HEADERS = {
+        "Accept": COMPACT_ACCEPT,
+        "Accept-Encoding": "zstd, gzip" if zstandard is not None else "gzip"
+    }
+
+    def __init__(self, targets, interval, timeout=5, workers=16, push_timeout=30):
+        self.targets = [target if ":" in target else f"{target}:8888" for target in targets]
+        self.interval = interval
+        self.timeout = timeout
+        self.push_timeout = push_timeout
+        self.epoch = uuid.uuid4().hex[:12]
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="RelayPoll")
+        self._connections = {}  # {target: HTTPConnection}，同一目标同时只有一个轮询
+        self._mirrors = {}  # {target: {"epoch", "generation", "names"}}
+        self._pushed = {}  # {agent_id: {"epoch", "generation", "names", "last_seen", "connected"}}
+        self._entries = {}  # {目标: {"online", "hostname", "processes"} 或 {"online": False, "error"}}
+        self._version = 0
+        self._encoded = {}  # {(紧凑格式, 压缩算法): (version, (body, content_type, content_encoding))}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def _set_entry(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) != entry:
+                self._entries[key] = entry
+                self._version += 1
+
+    # ---------- 轮询 ----------
+
+    def _request(self, target, path):
+        conn = self._connections.get(target)
+        if conn is None:
+            host, _, port = target.rpartition(":")
+            conn = self._connections[target] = http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+        try:
+            conn.request("GET", path, headers=self.REQUEST_HEADERS)
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._connections.pop(target, None)
+            raise
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status}")
+        body = decompress_body(body, response.getheader("Content-Encoding"))
+        if (response.getheader("Content-Type") or "").startswith(COMPACT_TYPE):
+            return decode_compact(body)
+        return json.loads(body)
+
+    def _poll(self, target):
+        """增量同步一个局域网Agent"""
+        mirror = self._mirrors.get(target)
+        path = "/api/processes/delta"
+        if mirror:
+            path += "?" + urlencode({"since": mirror["generation"], "epoch": mirror["epoch"]})
+
+        started = time.perf_counter()
+        try:
+            data = self._request(target, path)
+            if data.get("status") != "ok":
+                raise ValueError(data.get("error", "Agent返回错误"))
+            mode = data.get("mode")
+            if mode == "full":
+                names = frozenset(data.get("processes", []))
+            elif mirror is not None and mode == "unchanged":
+                names = mirror["names"]
+            elif mirror is not None and mode == "delta":
+                names = (mirror["names"] - frozenset(data.get("removed", []))) | frozenset(data.get("added", []))
+            else:
+                self._mirrors.pop(target, None)
+                raise ValueError(f"增量结果无法应用: mode={mode}")
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            RELAY_POLL_ERRORS.labels(target).inc()
+            if self._entries.get(target, {}).get("online", True):
+                logger.warning(f"中继轮询失败 {target}: {e}")
+            self._set_entry(target, {"online": False, "error": str(e)})
+            return
+        finally:
+            RELAY_POLL_DURATION.labels(target).observe(time.perf_counter() - started)
+
+        self._mirrors[target] = {"epoch": data.get("epoch"), "generation": data.get("generation"), "names": names}
+        self._set_entry(target, {"online": True, "hostname": data.get("hostname"), "processes": sorted(names)})
+
+    def poll_all(self):
+        """轮询全部局域网Agent，并把推送超时的Agent标记为离线"""
+        if self.targets:
+            wait([self._executor.submit(self._poll, target) for target in self.targets])
+
+        now = time.monotonic()
+        for agent_id, agent in list(self._pushed.items()):
+            if agent["connected"] and now - agent["last_seen"] > self.push_timeout:
+                self._set_entry(agent_id, {"online": False, "error": "推送超时"})
+
+    # ---------- 接收推送 ----------
+
+    def ingest(self, event):
+        """
+        处理局域网Agent推送到中继的一条消息（格式同监控服务器 /api/ingest）
+
+        Returns:
+            str: agent_id
+
+        Raises:
+            ValueError: 消息格式错误或增量无法应用（Agent需要重连并全量同步）
+        """
+        agent_id = event.get("agent_id")
+        event_type = event.get("type")
+        if not agent_id:
+            raise ValueError("缺少 agent_id")
+
+        agent = self._pushed.get(agent_id)
+        now = time.monotonic()
+        if event_type == "full":
+            agent = {
+                "names": frozenset(event.get("processes", [])),
+                "epoch": event.get("epoch"),
+                "generation": event.get("generation"),
+                "hostname": event.get("hostname"),
+                "last_seen": now,
+                "connected": True
+            }
+            logger.info(f"局域网Agent已连接到中继: {agent_id}")
+        elif agent is None or not agent["connected"]:
+            raise ValueError(f"未同步的推送Agent: {agent_id}")
+        elif event_type == "delta":
+            if event.get("epoch") != agent["epoch"] or event.get("since") != agent["generation"]:
+                raise ValueError(f"推送增量无法应用: {agent_id}")
+            names = (agent["names"] - frozenset(event.get("removed", []))) | frozenset(event.get("added", []))
+            agent = dict(agent, names=names, generation=event.get("generation"), last_seen=now)
+        elif event_type == "keepalive":
+            agent["last_seen"] = now
+            if self._entries.get(agent_id, {}).get("online"):
+                return agent_id
+            # 之前被 poll_all 标记为推送超时，恢复为在线
+            logger.info(f"局域网Agent恢复推送: {agent_id}")
+        else:
+            raise ValueError(f"未知的消息类型: {event_type}")
+
+        self._pushed[agent_id] = agent
+        self._set_entry(agent_id, {"online": True, "hostname": agent["hostname"], "processes": sorted(agent["names"])})
+        return agent_id
+
+    def push_disconnected(self, agent_id):
+        agent = self._pushed.get(agent_id)
+        if agent is not None:
+            self._pushed[agent_id] = dict(agent, connected=False)
+            self._set_entry(agent_id, {"online": False, "error": "推送连接断开"})
+            logger.warning(f"局域网Agent与中继断开: {agent_id}")
+
+    # ---------- 汇总 ----------
+
+    def get_batch(self, compact, encoding):
+        """
+        编码整个站点的进程集合（按版本和编码方式缓存）
+
+        Returns:
+            (etag, (body, content_type, content_encoding))
+        """
+        with self._lock:
+            version = self._version
+            cached = self._encoded.get((compact, encoding))
+            if cached is None or cached[0] != version:
+                encoded = encode_payload({
+                    "status": "ok",
+                    "hostname": socket.gethostname(),
+                    "epoch": self.epoch,
+                    "version": version,
+                    "targets": self._entries
+                }, compact, encoding)
+                cached = self._encoded[(compact, encoding)] = (version, encoded)
+        return f'"{self.epoch}-{version}"', cached[1]
+
+    def run(self):
+        """中继轮询循环（在独立线程中运行）"""
+        logger.info(f"中继模式已启动: 轮询 {len(self.targets)} 个Agent，间隔 {self.interval} 秒")
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.poll_all()
+            except Exception as e:
+                logger.error(f"中继轮询异常: {e}")
+            self._stop_event.wait(timeout=max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """启动中继轮询线程"""
+        thread = threading.Thread(target=self.run, name="RelayCollector", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """停止中继轮询"""
+        self._stop_event.set()
+        self._executor.shutdown(wait=False)
+
+
+relay = RelayCollector(RELAY_TARGETS, RELAY_INTERVAL, RELAY_TIMEOUT, RELAY_WORKERS, RELAY_PUSH_TIMEOUT) if RELAY_ENABLED else None
+
+
+@app.before_request
+def _start_timer():
+    request.environ["agent.started"] = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.endpoint or "unknown"
+    started = request.environ.get("agent.started")
+    if started is not None:
+        HTTP_DURATION.labels(endpoint).observe(time.perf_counter() - started)
+    HTTP_REQUESTS.labels(endpoint, response.status_code).inc()
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus/OpenMetrics 指标（Accept 含 application/openmetrics-text 时输出 OpenMetrics）"""
+    openmetrics = "application/openmetrics-text" in request.headers.get("Accept", "")
+    body = "".join([family.render(openmetrics) for family in METRICS])
+    if openmetrics:
+        return Response(body + "# EOF\n", content_type="application/openmetrics-text; version=1.0.0; charset=utf-8")
+    return Response(body, content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.route('/api/health')
@@ -30,30 +1421,26 @@ def health():
 @app.route('/api/processes')
 def get_processes():
     """
-    返回当前运行的所有进程列表
+    返回当前运行的所有进程列表（来自后台采样快照）
 
     返回格式：
     {
         "status": "ok",
         "hostname": "server1",
         "processes": ["nginx", "python3", "mysql"],
-        "count": 3
+        "count": 3,
+        "snapshot_age": 1.2
     }
     """
     try:
-        # 获取所有进程名（去重）
-        process_names = set()
-        for proc in psutil.process_iter(['name']):
-            try:
-                process_names.add(proc.info['name'])
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+        snapshot = sampler.get_snapshot()
 
-        return jsonify({
+        return negotiated_response({
             "status": "ok",
             "hostname": socket.gethostname(),
-            "processes": sorted(list(process_names)),
-            "count": len(process_names)
+            "processes": snapshot["names"],
+            "count": len(snapshot["names"]),
+            "snapshot_age": snapshot_age(snapshot)
         })
 
     except Exception as e:
@@ -63,33 +1450,151 @@ def get_processes():
         }), 500
 
 
+@app.route('/api/processes/delta')
+def get_processes_delta():
+    """
+    增量获取进程列表
+
+    参数：
+        since: 调用方已同步到的代数
+        epoch: 调用方记录的Agent启动标识
+
+    返回格式（mode 为 unchanged / delta / full 之一）：
+    {
+        "status": "ok",
+        "hostname": "server1",
+        "epoch": "3f2a9c1b7d4e",
+        "generation": 42,
+        "mode": "delta",
+        "added": ["java"],
+        "removed": ["nginx"],
+        "snapshot_age": 1.2
+    }
+    mode 为 full 时返回 "processes" 全量列表。
+    """
+    try:
+        snapshot = sampler.get_snapshot()
+        generation = snapshot["generation"]
+        since = request.args.get('since', type=int)
+
+        result = {
+            "status": "ok",
+            "hostname": socket.gethostname(),
+            "epoch": sampler.epoch,
+            "generation": generation,
+            "snapshot_age": snapshot_age(snapshot)
+        }
+
+        changes = None
+        if since is not None and request.args.get('epoch') == sampler.epoch and since <= generation:
+            changes = sampler.get_changes_since(since, generation)
+
+        if changes is None:
+            result["mode"] = "full"
+            result["processes"] = snapshot["names"]
+        elif not changes[0] and not changes[1]:
+            result["mode"] = "unchanged"
+        else:
+            result["mode"] = "delta"
+            result["added"], result["removed"] = changes
+
+        return negotiated_response(result)
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+
+@app.route('/api/query', methods=['POST'])
+def query_processes():
+    """
+    按规则批量查询进程数，只返回调用方关心的进程
+
+    规则写法：精确进程名 / 通配符 / "re:" 进程名正则 / "cmd:" 命令行子串 / "cmdre:" 命令行正则 / "exe:" 可执行文件路径
+
+    请求格式（resources 可选，列出需要资源指标的规则）：
+    {"processes": ["nginx", "python*", "re:^java", "cmd:-jar order-service.jar"], "resources": ["nginx"]}
+
+    返回格式：
+    {
+        "status": "ok",
+        "hostname": "server1",
+        "results": {"nginx": 2, "python*": 3, "re:^java": 0},
+        "errors": {},
+        "features": ["cmdline"],
+        "resources": {
+            "nginx": {"count": 2, "cpu_percent": 3.5, "rss": 52428800, "threads": 2, "fds": 24, "uptime": 86400.0}
+        },
+        "snapshot_age": 1.2
+    }
+    resources 中的 CPU%/RSS/线程数/文件数为匹配进程的总和，uptime 为最近启动的进程的运行秒数，
+    cpu_percent 在规则首次查询后的下一次采样前、fds 在无权限读取时为null。
+    features 含 "cmdline" 表示支持命令行/可执行文件规则（旧版Agent会把它们当作进程名）。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        patterns = data.get("processes")
+        resource_patterns = data.get("resources", [])
+        for field, value in (("processes", patterns), ("resources", resource_patterns)):
+            if not isinstance(value, list) or not all(isinstance(p, str) for p in value):
+                return jsonify({
+                    "status": "error",
+                    "error": f"{field} 必须是字符串列表"
+                }), 400
+
+        snapshot = sampler.get_snapshot()
+        results, errors = matcher.count(patterns, snapshot)
+        result = {
+            "status": "ok",
+            "hostname": socket.gethostname(),
+            "results": results,
+            "errors": errors,
+            "features": ["cmdline"],
+            "snapshot_age": snapshot_age(snapshot)
+        }
+        if resource_patterns:
+            result["resources"] = resources.query(resource_patterns)
+
+        return negotiated_response(result)
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+
 @app.route('/api/process/<process_name>')
 def check_process(process_name):
     """
-    检查特定进程是否运行
+    检查特定进程是否运行（来自后台采样快照）
+
+    可选参数 max_age: 快照早于该秒数时立即重新采样（服务器确认进程停止时使用）
 
     返回格式：
     {
         "status": "ok",
         "process": "nginx",
         "running": true,
-        "count": 2
+        "count": 2,
+        "snapshot_age": 1.2
     }
     """
     try:
-        count = 0
-        for proc in psutil.process_iter(['name']):
-            try:
-                if proc.info['name'] == process_name:
-                    count += 1
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+        snapshot = sampler.get_snapshot()
+        max_age = request.args.get('max_age', type=float)
+        if max_age is not None and snapshot_age(snapshot) > max(max_age, MIN_FRESH_AGE):
+            snapshot = sampler.sample()
+        count = snapshot["counts"].get(process_name, 0)
 
-        return jsonify({
+        return negotiated_response({
             "status": "ok",
             "process": process_name,
             "running": count > 0,
-            "count": count
+            "count": count,
+            "snapshot_age": snapshot_age(snapshot)
         })
 
     except Exception as e:
@@ -99,21 +1604,107 @@ def check_process(process_name):
         }), 500
 
 
+@app.route('/api/relay/batch')
+def relay_batch():
+    """
+    中继模式：返回汇总的整个站点的进程集合（按调用方的 Accept / Accept-Encoding 编码）
+
+    返回格式：
+    {
+        "status": "ok",
+        "hostname": "relay1",
+        "epoch": "3f2a9c1b7d4e",
+        "version": 42,
+        "targets": {
+            "10.0.0.2:8888": {"online": true, "hostname": "web1", "processes": ["nginx", "sshd"]},
+            "db1": {"online": false, "error": "推送连接断开"}
+        }
+    }
+    targets 的键为轮询目标 host:port 或推送到中继的 agent_id。
+    携带 If-None-Match 且站点无变化时返回304。
+    """
+    if relay is None:
+        return jsonify({
+            "status": "error",
+            "error": "未启用中继模式"
+        }), 404
+
+    etag, (body, content_type, encoding) = relay.get_batch(
+        accepts_compact(), choose_encoding(request.headers.get("Accept-Encoding")))
+    headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding"}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, content_type=content_type, headers=headers)
+
+
+@app.route('/api/ingest', methods=['POST'])
+def relay_ingest():
+    """中继模式：接收局域网Agent的推送（协议同监控服务器 /api/ingest）"""
+    if relay is None:
+        return jsonify({"success": False, "error": "未启用中继模式"}), 404
+    if RELAY_TOKEN and request.headers.get("X-Agent-Token") != RELAY_TOKEN:
+        return jsonify({"success": False, "error": "认证失败"}), 403
+
+    agent_id = None
+    try:
+        while True:
+            line = request.stream.readline()
+            if not line:
+                break
+            line = line.strip()
+            if line:
+                agent_id = relay.ingest(json.loads(line))
+
+    except ValueError as e:
+        logger.warning(f"推送消息无效: {e}")
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    except OSError as e:
+        logger.warning(f"推送连接中断: {e}")
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    finally:
+        if agent_id:
+            relay.push_disconnected(agent_id)
+
+    return jsonify({"success": True})
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print(f"进程监控Agent v{AGENT_VERSION}")
     print("=" * 60)
     print(f"主机名: {socket.gethostname()}")
     print(f"监听地址: {AGENT_HOST}:{AGENT_PORT}")
+    print(f"采样间隔: {SAMPLE_INTERVAL} 秒 (枚举模式: {SCAN_MODE})")
+    if PUSH_URL:
+        print(f"推送模式: {PUSH_URL} (agent_id={AGENT_ID}, 心跳 {PUSH_KEEPALIVE} 秒)")
+    if relay is not None:
+        print(f"中继模式: 轮询 {len(relay.targets)} 个Agent (间隔 {RELAY_INTERVAL} 秒)，接收局域网Agent推送")
     print()
     print("API端点:")
     print(f"  - GET /api/health          - 健康检查")
     print(f"  - GET /api/processes       - 获取所有进程")
+    print(f"  - GET /api/processes/delta - 增量获取进程变化")
+    print(f"  - POST /api/query          - 按规则查询进程数（可附带资源指标）")
     print(f"  - GET /api/process/<name>  - 检查特定进程")
+    print(f"  - GET /metrics             - Prometheus 指标")
+    if relay is not None:
+        print(f"  - GET /api/relay/batch     - 中继: 获取整个站点的进程")
+        print(f"  - POST /api/ingest         - 中继: 接收局域网Agent推送")
     print()
     print("按 Ctrl+C 停止服务")
     print("=" * 60)
 
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sampler.start()
+    if PUSH_URL:
+        PushClient(PUSH_URL, AGENT_ID, sampler, PUSH_KEEPALIVE, PUSH_TOKEN).start()
+    if relay is not None:
+        relay.start()
+
     try:
         app.run(
             host=AGENT_HOST,
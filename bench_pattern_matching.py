@@ -0,0 +1,132 @@
+"""
+进程规则匹配性能测试 - 对比逐条规则扫描与组合匹配器 + 增量索引
+在临时目录中构造模拟的 /proc（comm、cmdline、exe），用约1k条混合规则
+（命令行子串/正则、可执行文件路径、进程名通配符/正则）匹配 5k、20k 个进程
+
+用法: python bench_pattern_matching.py [进程数 ...]
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import fnmatch
+import tempfile
+
+from agent import IncrementalEnumerator, ProcessSampler, PatternMatcher
+
+DEFAULT_SIZES = [5000, 20000]
+CHURN_RATIO = 0.01  # 每轮采样之间退出/新建的进程比例
+ROUNDS = 5
+SERVICES = 2000  # 不同的服务（命令行中的 jar 名）
+RULES = {"cmd": 500, "cmdre": 150, "exe": 150, "glob": 100, "re": 100}
+PROGRAMS = [("java", "/usr/lib/jvm/java-17/bin/java"), ("python3", "/usr/bin/python3.11"),
+            ("node", "/usr/bin/node"), ("nginx", "/usr/sbin/nginx"), ("postgres", "/usr/lib/postgresql/15/bin/postgres")]
+
+
+def process_info(pid):
+    name, exe = PROGRAMS[pid % len(PROGRAMS)]
+    service = pid % SERVICES
+    cmdline = [exe, "-Xmx512m", "-jar", f"/opt/apps/service-{service}.jar", f"--server.port={8000 + service}"]
+    return f"{name}{service % 40}", cmdline, f"{exe}-{service % 200}"
+
+
+def write_process(root, pid):
+    """在模拟的 /proc 下创建一个进程目录"""
+    name, cmdline, exe = process_info(pid)
+    proc_dir = os.path.join(root, str(pid))
+    os.mkdir(proc_dir)
+    with open(os.path.join(proc_dir, "comm"), "w") as f:
+        f.write(name + "\n")
+    with open(os.path.join(proc_dir, "cmdline"), "wb") as f:
+        f.write(b"\0".join(arg.encode() for arg in cmdline) + b"\0")
+    os.symlink(exe, os.path.join(proc_dir, "exe"))
+
+
+def build_rules():
+    rules = [f"cmd:service-{i * 3}.jar" for i in range(RULES["cmd"])]
+    rules += [f"cmdre:--server\\.port=8{i:03d}$" for i in range(RULES["cmdre"])]
+    rules += [f"exe:{PROGRAMS[i % len(PROGRAMS)][1]}-{i}" for i in range(RULES["exe"])]
+    rules += [f"{PROGRAMS[i % len(PROGRAMS)][0]}{i % 40}*" for i in range(RULES["glob"])]
+    rules += [f"re:^{PROGRAMS[i % len(PROGRAMS)][0]}{i % 40}$" for i in range(RULES["re"])]
+    return rules
+
+
+def naive_count(rules, processes):
+    """逐条规则扫描全部进程（对照组，命令行已在内存中）"""
+    results = {}
+    for rule in rules:
+        if rule.startswith("cmd:"):
+            needle = rule[4:]
+            results[rule] = sum(1 for _, cmdline, _ in processes if needle in cmdline)
+        elif rule.startswith("cmdre:"):
+            compiled = re.compile(rule[6:])
+            results[rule] = sum(1 for _, cmdline, _ in processes if compiled.search(cmdline))
+        elif rule.startswith("exe:"):
+            results[rule] = sum(1 for _, _, exe in processes if exe == rule[4:])
+        else:
+            compiled = re.compile(rule[3:] if rule.startswith("re:") else fnmatch.translate(rule))
+            results[rule] = sum(1 for name, _, _ in processes if compiled.search(name))
+    return results
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def bench(size, rules):
+    root = tempfile.mkdtemp(prefix="bench_rules_")
+    try:
+        for pid in range(1, size + 1):
+            write_process(root, pid)
+        sampler = ProcessSampler(60, IncrementalEnumerator(proc_root=root))
+        matcher = PatternMatcher(sampler, proc_root=root)
+        sampler.add_observer(matcher.on_sample)
+        snapshot = sampler.sample()
+
+        def current_processes():
+            return [(name, " ".join(cmdline), exe)
+                    for name, cmdline, exe in (process_info(pid) for pid in sampler.current_pids())]
+
+        naive_ms, expected = timed(lambda: naive_count(rules, current_processes()))
+        cold_ms, (results, _) = timed(lambda: matcher.count(rules, snapshot))
+        assert results == expected, "组合匹配结果与逐条扫描不一致"
+
+        next_pid = size + 1
+        warm_total = 0.0
+        for _ in range(ROUNDS):
+            pids = sorted(sampler.current_pids())
+            count = max(1, int(size * CHURN_RATIO))
+            for pid in pids[:count]:
+                shutil.rmtree(os.path.join(root, str(pid)))
+            for pid in range(next_pid, next_pid + count):
+                write_process(root, pid)
+            next_pid += count
+
+            # 稳态：采样回调只匹配新出现的PID，查询直接读取索引
+            ms, (results, _) = timed(lambda: matcher.count(rules, sampler.sample()))
+            warm_total += ms
+            assert results == naive_count(rules, current_processes()), "组合匹配结果与逐条扫描不一致"
+
+        return {"size": size, "naive_ms": naive_ms, "cold_ms": cold_ms, "warm_ms": warm_total / ROUNDS}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    rules = build_rules()
+
+    print("=" * 72)
+    print(f"进程规则匹配性能测试（{len(rules)} 条规则，每轮 {CHURN_RATIO:.0%} 进程变化，取 {ROUNDS} 轮平均）")
+    print("=" * 72)
+    print(f"{'进程数':>8} {'逐条扫描(ms)':>14} {'首次建索引(ms)':>16} {'稳态采样+查询(ms)':>18}")
+    for size in sizes:
+        result = bench(size, rules)
+        print(f"{result['size']:>8} {result['naive_ms']:>14.1f} {result['cold_ms']:>16.1f} {result['warm_ms']:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+进程枚举性能测试 - 对比 psutil 全量遍历与增量 /proc 枚举
+在临时目录中构造模拟的 /proc，分别测试 1k、10k、50k 个进程
+
+用法: python bench_process_scan.py [进程数 ...]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import psutil
+
+from agent import PsutilEnumerator, IncrementalEnumerator
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+CHURN_RATIO = 0.01  # 每轮扫描之间退出/新建的进程比例
+ROUNDS = 5
+PROCESS_NAMES = ["nginx", "python3", "java", "mysqld", "redis-server", "sshd", "bash", "kworker/0:1"]
+
+
+def write_process(root, pid):
+    """在模拟的 /proc 下创建一个进程目录（psutil 需要 stat，增量枚举读取 comm）"""
+    name = PROCESS_NAMES[pid % len(PROCESS_NAMES)]
+    proc_dir = os.path.join(root, str(pid))
+    os.mkdir(proc_dir)
+    with open(os.path.join(proc_dir, "comm"), "w") as f:
+        f.write(name + "\n")
+    # pid (comm) state ppid pgrp session tty_nr tpgid flags ... 第22个字段为 starttime
+    fields = ["S", "1", "1", "1", "0", "-1", "4194560"] + ["0"] * 12 + ["1", "0", "100"] + ["0"] * 30
+    with open(os.path.join(proc_dir, "stat"), "w") as f:
+        f.write(f"{pid} ({name}) {' '.join(fields)}\n")
+
+
+def build_procfs(size):
+    """构造包含 size 个进程的模拟 /proc"""
+    root = tempfile.mkdtemp(prefix="bench_proc_")
+    with open(os.path.join(root, "stat"), "w") as f:
+        f.write(f"cpu  0 0 0 0 0 0 0 0 0 0\nbtime {int(time.time()) - 3600}\n")
+    for pid in range(1, size + 1):
+        write_process(root, pid)
+    return root
+
+
+def churn(root, next_pid, size):
+    """模拟进程变化：删除最早的一批进程，新建同样数量的进程"""
+    count = max(1, int(size * CHURN_RATIO))
+    pids = sorted(int(entry) for entry in os.listdir(root) if entry.isdigit())
+    for pid in pids[:count]:
+        shutil.rmtree(os.path.join(root, str(pid)))
+    for pid in range(next_pid, next_pid + count):
+        write_process(root, pid)
+    return next_pid + count
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def bench(size):
+    root = build_procfs(size)
+    psutil.PROCFS_PATH = root
+    try:
+        full = PsutilEnumerator()
+        incremental = IncrementalEnumerator(proc_root=root)
+
+        cold_ms, cold_counts = timed(incremental.scan)
+        full_ms, full_counts = timed(full.scan)
+        assert cold_counts == full_counts, "两种枚举结果不一致"
+
+        next_pid = size + 1
+        full_total = 0.0
+        warm_total = 0.0
+        for _ in range(ROUNDS):
+            next_pid = churn(root, next_pid, size)
+            ms, full_counts = timed(full.scan)
+            full_total += ms
+            ms, warm_counts = timed(incremental.scan)
+            warm_total += ms
+            assert warm_counts == full_counts, "两种枚举结果不一致"
+
+        return {
+            "size": size,
+            "psutil_ms": full_total / ROUNDS,
+            "incremental_cold_ms": cold_ms,
+            "incremental_warm_ms": warm_total / ROUNDS
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+
+    print("=" * 72)
+    print(f"进程枚举性能测试（每轮 {CHURN_RATIO:.0%} 进程变化，取 {ROUNDS} 轮平均）")
+    print("=" * 72)
+    print(f"{'进程数':>8} {'psutil全量(ms)':>16} {'增量首次(ms)':>14} {'增量稳态(ms)':>14} {'加速比':>8}")
+
+    # psutil 会在进程内缓存 Process 对象，每个规模在独立的子进程中测试
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        with context.Pool(1) as pool:
+            result = pool.apply(bench, (size,))
+        speedup = result["psutil_ms"] / result["incremental_warm_ms"] if result["incremental_warm_ms"] else float("inf")
+        print(f"{result['size']:>8} {result['psutil_ms']:>16.1f} {result['incremental_cold_ms']:>14.1f} "
+              f"{result['incremental_warm_ms']:>14.1f} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Agent通信编码性能测试 - 对比 JSON 与紧凑二进制格式，以及 gzip / zstd 压缩
+模拟 /api/processes/delta 的全量响应，分别测试 100、1k、5k、20k 个不同进程名，
+编码使用Agent的实现，解码使用服务器端 wire.py（压缩后的解压计入解码耗时）
+
+用法: python bench_wire_encoding.py [进程名数 ...]
+"""
+import sys
+import time
+import json
+
+from agent import encode_payload, decompress_body, zstandard
+from wire import decode_compact
+
+DEFAULT_SIZES = [100, 1000, 5000, 20000]
+ROUNDS = 20
+NAME_PREFIXES = ["nginx", "python3", "java", "php-fpm", "kworker/", "celery-worker", "postgres: wal writer", "容器进程"]
+
+
+def build_payload(size):
+    """构造包含 size 个不同进程名的全量响应"""
+    names = sorted(f"{NAME_PREFIXES[i % len(NAME_PREFIXES)]}{i}" for i in range(size))
+    return {
+        "status": "ok",
+        "hostname": "bench-host",
+        "epoch": "3f2a9c1b7d4e",
+        "generation": 42,
+        "snapshot_age": 1.2,
+        "mode": "full",
+        "processes": names
+    }
+
+
+def timed(func):
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = func()
+    return (time.perf_counter() - started) * 1e6 / ROUNDS, result
+
+
+def variants():
+    yield "JSON", False, None
+    yield "JSON+gzip", False, "gzip"
+    if zstandard is not None:
+        yield "JSON+zstd", False, "zstd"
+    yield "紧凑", True, None
+    yield "紧凑+gzip", True, "gzip"
+    if zstandard is not None:
+        yield "紧凑+zstd", True, "zstd"
+
+
+def bench(size):
+    payload = build_payload(size)
+    results = []
+    for label, compact, encoding in variants():
+        encode_us, (body, _, used_encoding) = timed(lambda: encode_payload(payload, compact, encoding))
+        decode = decode_compact if compact else json.loads
+        decode_us, decoded = timed(lambda: decode(decompress_body(body, used_encoding)))
+        assert decoded == payload, f"{label} 解码结果不一致"
+        results.append((label, encode_us, decode_us, len(body)))
+    return results
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+
+    print("=" * 72)
+    print(f"Agent通信编码性能测试（取 {ROUNDS} 次平均，zstd {'可用' if zstandard else '未安装，跳过'}）")
+    print("=" * 72)
+    print(f"{'进程名数':>8} {'编码方式':<12} {'编码(µs)':>10} {'解码(µs)':>10} {'字节数':>10} {'相对JSON':>9}")
+
+    for size in sizes:
+        results = bench(size)
+        baseline = results[0][3]
+        for label, encode_us, decode_us, length in results:
+            print(f"{size:>8} {label:<12} {encode_us:>10.0f} {decode_us:>10.0f} {length:>10} {length / baseline:>8.1%}")
+        print("-" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+状态检查点 - 定期保存监控状态，重启后恢复
+保存进程状态和告警冷却时间，避免重启后第一轮检查漏报或重复告警
+"""
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+
+
+class StateCheckpoint:
+    """
+    监控状态检查点文件
+
+    写入时先写临时文件再 os.replace，进程在任意时刻退出都不会留下半个文件；
+    内容未变化时跳过写入。
+    """
+
+    def __init__(self, path, interval=60, max_age=3600):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age  # 超过该时长的检查点视为过期，不再恢复
+        self._last_saved = 0.0
+        self._last_payload = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def due(self):
+        """距上次保存是否已超过保存间隔"""
+        return time.monotonic() - self._last_saved >= self.interval
+
+    def save(self, state):
+        """
+        保存状态
+
+        Args:
+            state: {"last_state": {...}, "last_alert_time": {...}}
+        """
+        self._last_saved = time.monotonic()
+        payload = json.dumps(state, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        if payload == self._last_payload:
+            return
+
+        data = json.dumps({
+            "version": CHECKPOINT_VERSION,
+            "saved_at": time.time(),
+            "state": state
+        }, ensure_ascii=False, separators=(",", ":"))
+
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._last_payload = payload
+        except OSError as e:
+            logger.error(f"保存状态检查点失败: {e}")
+
+    def load(self):
+        """
+        读取检查点
+
+        Returns:
+            dict: 保存的状态，文件不存在、损坏或已过期时返回None
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取状态检查点失败，忽略: {e}")
+            return None
+
+        if data.get("version") != CHECKPOINT_VERSION:
+            logger.warning(f"状态检查点版本不匹配，忽略: {data.get('version')}")
+            return None
+
+        age = time.time() - data.get("saved_at", 0)
+        if age > self.max_age:
+            logger.info(f"状态检查点已过期 ({int(age)} 秒前保存)，忽略")
+            return None
+
+        return data.get("state")
+
+
+def create_checkpoint(config):
+    """从配置创建状态检查点（未启用时返回None）"""
+    checkpoint_config = config.get("checkpoint", {})
+    if not checkpoint_config.get("enabled", True):
+        return None
+
+    return StateCheckpoint(
+        checkpoint_config.get("path", "data/state.json"),
+        interval=checkpoint_config.get("interval", 60),
+        max_age=checkpoint_config.get("max_age", 3600)
+    )
@@ -0,0 +1,149 @@
+"""
+Agent熔断器 - 跟踪每个Agent的存活状态
+连续失败达到阈值后熔断：暂停请求，按退避间隔用短超时探测，恢复后闭合
+"""
+import time
+import threading
+
+CLOSED = "closed"  # 正常
+OPEN = "open"  # 已熔断，暂停请求
+HALF_OPEN = "half_open"  # 探测中
+
+# record() 返回的事件
+EVENT_OFFLINE = "offline"
+EVENT_RECOVERED = "recovered"
+
+
+class _Circuit:
+    __slots__ = ("state", "failures", "opened", "retry_at", "backoff", "offline_since")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0  # 连续失败次数
+        self.opened = 0  # 熔断后的探测失败次数（用于退避）
+        self.retry_at = 0.0
+        self.backoff = 0.0
+        self.offline_since = None
+
+
+class AgentCircuitBreaker:
+    """
+    按Agent地址的熔断器（线程安全）
+
+    - failure_threshold: 连续失败多少次后熔断并发送离线告警
+    - probe_interval / max_probe_interval: 熔断后探测间隔，每次探测失败翻倍，有上限
+    - max_probes: 同时进行的探测数上限，避免整片网段故障时占满轮询线程
+    - timeout / probe_timeout: 正常请求与探测请求的 (连接超时, 读取超时)
+    """
+
+    def __init__(self, failure_threshold=3, probe_interval=30, max_probe_interval=300, max_probes=4,
+                 timeout=(3, 10), probe_timeout=(1.5, 5)):
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval = probe_interval
+        self.max_probe_interval = max_probe_interval
+        self.max_probes = max(1, max_probes)
+        self.timeout = tuple(timeout)
+        self.probe_timeout = tuple(probe_timeout)
+
+        self._circuits = {}  # {agent_key: _Circuit}
+        self._probing = 0
+        self._lock = threading.Lock()
+
+    def before_request(self, agent_key):
+        """
+        请求前调用，返回超时后必须调用 record() 记录结果（半开状态占用的探测名额在 record 中释放）
+
+        Returns:
+            tuple: 请求超时 (connect, read)；熔断中且未到探测时间时返回None（跳过请求）
+        """
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(agent_key)
+            if circuit is None or circuit.state == CLOSED:
+                return self.timeout
+            if circuit.state == HALF_OPEN or now < circuit.retry_at or self._probing >= self.max_probes:
+                return None
+            circuit.state = HALF_OPEN
+            self._probing += 1
+            return self.probe_timeout
+
+    def record(self, agent_key, success):
+        """
+        记录一次请求结果
+
+        Returns:
+            str: EVENT_OFFLINE（刚熔断）/ EVENT_RECOVERED（熔断后恢复）/ None
+        """
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.setdefault(agent_key, _Circuit())
+            if circuit.state == HALF_OPEN:
+                self._probing -= 1
+
+            if success:
+                recovered = circuit.state != CLOSED
+                circuit.state = CLOSED
+                circuit.failures = 0
+                circuit.opened = 0
+                circuit.offline_since = None
+                return EVENT_RECOVERED if recovered else None
+
+            circuit.failures += 1
+            if circuit.state == CLOSED:
+                if circuit.failures < self.failure_threshold:
+                    return None
+                circuit.offline_since = time.time()
+                event = EVENT_OFFLINE
+            else:
+                event = None
+
+            circuit.state = OPEN
+            circuit.backoff = min(self.probe_interval * 2 ** circuit.opened, self.max_probe_interval)
+            circuit.opened += 1
+            circuit.retry_at = now + circuit.backoff
+            return event
+
+    def forget(self, agent_key):
+        """删除Agent的状态（配置中移除目标、或集群中移交给其他实例时调用）"""
+        with self._lock:
+            circuit = self._circuits.pop(agent_key, None)
+            if circuit is not None and circuit.state == HALF_OPEN:
+                self._probing -= 1
+
+    def get_state(self, agent_key):
+        """
+        Returns:
+            dict: {"state", "failures", "offline_since", "retry_in"}
+        """
+        with self._lock:
+            circuit = self._circuits.get(agent_key)
+            if circuit is None:
+                return {"state": CLOSED, "failures": 0, "offline_since": None, "retry_in": None}
+            return {
+                "state": circuit.state,
+                "failures": circuit.failures,
+                "offline_since": circuit.offline_since,
+                "retry_in": round(max(0.0, circuit.retry_at - time.monotonic()), 1) if circuit.state == OPEN else None
+            }
+
+    def get_stats(self):
+        with self._lock:
+            states = [circuit.state for circuit in self._circuits.values()]
+            return {
+                "agents": len(states),
+                "open": states.count(OPEN),
+                "probing": self._probing
+            }
+
+
+def create_circuit_breaker(config):
+    """从配置创建Agent熔断器"""
+    breaker_config = config.get("circuit_breaker", {})
+    return AgentCircuitBreaker(
+        failure_threshold=breaker_config.get("failure_threshold", 3),
+        probe_interval=breaker_config.get("probe_interval", 30),
+        max_probe_interval=breaker_config.get("max_probe_interval", 300),
+        max_probes=breaker_config.get("max_probes", max(1, config.get("max_concurrency", 32) // 4)),
+        timeout=(breaker_config.get("connect_timeout", 3), breaker_config.get("read_timeout", 10)),
+        probe_timeout=(breaker_config.get("probe_connect_timeout", 1.5), breaker_config.get("read_timeout", 10) / 2)
+    )
@@ -0,0 +1,314 @@
+"""
+多实例集群 - 通过共享的SQLite文件协调多个监控服务实例
+实例定期写入心跳，监控目标按名称一致性哈希分配给存活实例；
+Leader 负责清理失效实例，告警通过共享表去重
+"""
+import os
+import json
+import time
+import uuid
+import bisect
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL,
+    started REAL NOT NULL,
+    push_agents TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    key TEXT PRIMARY KEY,
+    sent_at REAL NOT NULL,
+    owner TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS target_state (
+    key TEXT PRIMARY KEY,
+    running INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+LEADER_LEASE = "leader"
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环（每个实例 virtual_nodes 个虚拟节点）"""
+
+    def __init__(self, nodes, virtual_nodes=64):
+        self.nodes = sorted(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(virtual_nodes))
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, name):
+        """返回负责该名称的节点（环为空时返回None）"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(name)) % len(self._keys)
+        return self._owners[index]
+
+
+class ClusterMembership:
+    """
+    集群成员管理
+
+    - 实例每 heartbeat_interval 秒写入心跳，超过 instance_ttl 未更新视为失效
+    - 所有实例用同一组存活实例构建哈希环，因此对目标归属的判断一致
+    - 推送模式目标由持有该Agent推送连接的实例负责；没有实例持有连接时由哈希环分配（负责报告离线）
+    - 经中继访问的目标按中继地址分配，同一站点由同一实例检查
+    - 状态变化写入共享表，目标转移到其他实例时可以接续上一个实例的进程状态
+    """
+
+    def __init__(self, path, instance_id=None, heartbeat_interval=5, instance_ttl=15, virtual_nodes=64):
+        self.path = path
+        self.instance_id = instance_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.heartbeat_interval = heartbeat_interval
+        self.instance_ttl = instance_ttl
+        self.virtual_nodes = virtual_nodes
+
+        self.is_leader = False
+        self.on_change = None  # 成员或推送连接变化时的回调（由 RemoteMonitor 设置）
+        self.local_push_agents = None  # 返回本实例持有的推送Agent列表的回调
+
+        self._ring = HashRing([self.instance_id], virtual_nodes)
+        self._remote_push = {}  # {agent_id: instance_id}，其他实例持有的推送连接
+        self._staged_states = {}  # 待写入共享表的确认状态
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ---------- 归属 ----------
+
+    def owner_of(self, monitor):
+        """负责该监控目标的实例ID"""
+        if monitor.get("mode") == "push":
+            agent_id = monitor.get("agent_id") or monitor.get("host")
+            local = self.local_push_agents() if self.local_push_agents else ()
+            if agent_id in local:
+                return self.instance_id
+            remote = self._remote_push.get(agent_id)
+            if remote is not None:
+                return remote
+        elif monitor.get("relay"):
+            # 同一中继的目标分配给同一实例，整个站点仍只需一次请求
+            return self._ring.owner(f"relay:{monitor['relay']}")
+        return self._ring.owner(monitor.get("name", "未命名"))
+
+    def owns(self, monitor):
+        return self.owner_of(monitor) == self.instance_id
+
+    # ---------- 共享状态 ----------
+
+    def claim_alert(self, key, window):
+        """
+        跨实例告警去重：window 秒内同一个 key 只有一个实例能领取
+
+        Returns:
+            bool: 本实例是否应发送该告警（共享库不可用时返回True，宁可重复不漏报）
+        """
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    cursor = conn.execute("""
+                        INSERT INTO alerts (key, sent_at, owner) VALUES (?, ?, ?)
+                        ON CONFLICT (key) DO UPDATE SET sent_at = excluded.sent_at, owner = excluded.owner
+                        WHERE alerts.sent_at < ?
+                    """, (key, now, self.instance_id, now - window))
+                    return cursor.rowcount == 1
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"告警去重失败，直接发送: {e}")
+            return True
+
+    def stage_state(self, key, running):
+        """记录确认状态（由心跳线程批量写入共享表）"""
+        with self._lock:
+            self._staged_states[key] = running
+
+    def load_states(self, keys):
+        """
+        读取共享表中的确认状态（接管目标时调用）
+
+        Returns:
+            dict: {key: running}
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            conn = self._connect()
+            try:
+                result = {}
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT key, running FROM target_state WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                    result.update((key, bool(running)) for key, running in rows)
+                return result
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"读取共享状态失败: {e}")
+            return {}
+
+    # ---------- 心跳线程 ----------
+
+    def _tick(self, conn):
+        """一次心跳：写入心跳、刷新成员、续约Leader、写入状态"""
+        now = time.time()
+        push_agents = sorted(self.local_push_agents()) if self.local_push_agents else []
+        with self._lock:
+            staged, self._staged_states = self._staged_states, {}
+
+        with conn:
+            conn.execute("""
+                INSERT INTO instances (id, heartbeat, started, push_agents) VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET heartbeat = excluded.heartbeat, push_agents = excluded.push_agents
+            """, (self.instance_id, now, now, json.dumps(push_agents)))
+
+            if staged:
+                conn.executemany("""
+                    INSERT INTO target_state (key, running, updated) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET running = excluded.running, updated = excluded.updated
+                """, [(key, int(running), now) for key, running in staged.items()])
+
+            # Leader 租约: 过期或本实例持有时续约
+            conn.execute("""
+                INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+                WHERE leases.owner = excluded.owner OR leases.expires < ?
+            """, (LEADER_LEASE, self.instance_id, now + self.instance_ttl, now))
+            leader = conn.execute("SELECT owner FROM leases WHERE name = ?", (LEADER_LEASE,)).fetchone()[0]
+
+            if leader == self.instance_id:
+                conn.execute("DELETE FROM instances WHERE heartbeat < ?", (now - self.instance_ttl * 4,))
+                conn.execute("DELETE FROM alerts WHERE sent_at < ?", (now - 86400,))
+
+            rows = conn.execute(
+                "SELECT id, push_agents FROM instances WHERE heartbeat >= ?", (now - self.instance_ttl,)
+            ).fetchall()
+
+        if leader == self.instance_id and not self.is_leader:
+            logger.info(f"本实例成为集群Leader: {self.instance_id}")
+        self.is_leader = leader == self.instance_id
+
+        members = sorted(instance_id for instance_id, _ in rows)
+        remote_push = {}
+        for instance_id, agents in rows:
+            if instance_id != self.instance_id:
+                for agent_id in json.loads(agents):
+                    remote_push[agent_id] = instance_id
+
+        changed = members != self._ring.nodes or remote_push != self._remote_push
+        if members != self._ring.nodes:
+            logger.info(f"集群成员变化: {members}")
+            self._ring = HashRing(members or [self.instance_id], self.virtual_nodes)
+        self._remote_push = remote_push
+        return changed
+
+    def run(self):
+        """心跳循环（在独立线程中运行）"""
+        conn = self._connect()
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    if self._tick(conn) and self.on_change:
+                        self.on_change()
+                except sqlite3.Error as e:
+                    logger.error(f"集群心跳失败: {e}")
+                except Exception as e:
+                    logger.error(f"集群心跳异常: {e}", exc_info=True)
+                self._stop_event.wait(timeout=self.heartbeat_interval)
+        finally:
+            conn.close()
+
+    def start(self):
+        """同步执行一次心跳后启动心跳线程（启动时即可确定目标归属）"""
+        conn = self._connect()
+        try:
+            self._tick(conn)
+        finally:
+            conn.close()
+        self._thread = threading.Thread(target=self.run, name="ClusterHeartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """退出集群：写入剩余状态，删除心跳并释放Leader租约，其他实例在下一次心跳时接管"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_interval + 1)
+        try:
+            conn = self._connect()
+            try:
+                with self._lock:
+                    staged, self._staged_states = self._staged_states, {}
+                with conn:
+                    conn.executemany("""
+                        INSERT INTO target_state (key, running, updated) VALUES (?, ?, ?)
+                        ON CONFLICT (key) DO UPDATE SET running = excluded.running, updated = excluded.updated
+                    """, [(key, int(running), time.time()) for key, running in staged.items()])
+                    conn.execute("DELETE FROM instances WHERE id = ?", (self.instance_id,))
+                    conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (LEADER_LEASE, self.instance_id))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"退出集群失败: {e}")
+
+    def get_stats(self):
+        return {
+            "instance_id": self.instance_id,
+            "leader": self.is_leader,
+            "members": list(self._ring.nodes)
+        }
+
+
+def create_cluster(config):
+    """从配置创建集群成员管理（未启用时返回None）"""
+    cluster_config = config.get("cluster", {})
+    if not cluster_config.get("enabled", False):
+        return None
+
+    return ClusterMembership(
+        cluster_config.get("store", "data/cluster.db"),
+        instance_id=cluster_config.get("instance_id") or f"{socket.gethostname()}:{config.get('web_port', 8080)}",
+        heartbeat_interval=cluster_config.get("heartbeat_interval", 5),
+        instance_ttl=cluster_config.get("instance_ttl", 15),
+        virtual_nodes=cluster_config.get("virtual_nodes", 64)
+    )
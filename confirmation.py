@@ -0,0 +1,130 @@
+"""
+故障确认与抖动检测 - 每个(监控目标, 进程)一个状态机
+进程需在最近 M 次观测中有 N 次未运行才确认停止；短时间内频繁启停的进程标记为抖动并抑制告警
+"""
+import time
+import threading
+from collections import deque
+
+# observe() 返回的事件
+EVENT_FIRST = "first"  # 首次检测
+EVENT_PENDING = "pending"  # 疑似停止，等待确认
+EVENT_DOWN = "down"  # 确认停止
+EVENT_UP = "up"  # 恢复运行
+
+FLAP_START = "start"
+FLAP_END = "end"
+
+
+class _Series:
+    __slots__ = ("observations", "transitions", "flapping")
+
+    def __init__(self, window):
+        self.observations = deque(maxlen=window)  # 最近的原始观测（确认状态变化后清空）
+        self.transitions = deque()  # 确认状态变化的时间
+        self.flapping = False
+
+
+class ConfirmationTracker:
+    """
+    N-of-M 故障确认 + 抖动检测（线程安全）
+
+    - 确认停止: 最近 confirm_window 次观测中至少 confirm_count 次未运行（且最新一次未运行）
+    - 恢复: 观测到运行即恢复（不需要确认）
+    - 抖动: flap_window 秒内确认状态变化达到 flap_threshold 次进入抖动状态，
+      降到阈值一半以下时退出
+    """
+
+    def __init__(self, confirm_count=2, confirm_window=3, flap_window=600, flap_threshold=4):
+        self.confirm_count = max(1, confirm_count)
+        self.confirm_window = max(self.confirm_count, confirm_window)
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        self._series = {}  # {"monitor:process": _Series}
+        self._lock = threading.Lock()
+
+    def observe(self, key, confirmed, running, now=None):
+        """
+        记录一次观测
+
+        Args:
+            key: "监控目标:进程"
+            confirmed: 当前已确认的状态（None 表示尚无状态）
+            running: 本次观测结果
+
+        Returns:
+            tuple: (新的确认状态, 事件, 抖动变化)，事件为 EVENT_* 或 None，
+                   抖动变化为 FLAP_START / FLAP_END / None
+        """
+        now = now or time.time()
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self.confirm_window)
+            series.observations.append(running)
+
+            if confirmed is None:
+                series.observations.clear()
+                return running, EVENT_FIRST, None
+
+            if running and not confirmed:
+                return self._transition(series, True, EVENT_UP, now)
+
+            if not running and confirmed:
+                misses = sum(1 for observed in series.observations if not observed)
+                if misses >= self.confirm_count:
+                    return self._transition(series, False, EVENT_DOWN, now)
+                return confirmed, EVENT_PENDING, self._update_flapping(series, now)
+
+            return confirmed, None, self._update_flapping(series, now)
+
+    def _transition(self, series, running, event, now):
+        series.observations.clear()
+        series.transitions.append(now)
+        return running, event, self._update_flapping(series, now)
+
+    def _update_flapping(self, series, now):
+        while series.transitions and series.transitions[0] < now - self.flap_window:
+            series.transitions.popleft()
+
+        count = len(series.transitions)
+        if not series.flapping and count >= self.flap_threshold:
+            series.flapping = True
+            return FLAP_START
+        if series.flapping and count < self.flap_threshold / 2:
+            series.flapping = False
+            return FLAP_END
+        return None
+
+    def remaining_misses(self, key):
+        """还需要多少次未运行的观测才能确认停止"""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return self.confirm_count
+            misses = sum(1 for observed in series.observations if not observed)
+            return max(0, self.confirm_count - misses)
+
+    def is_flapping(self, key):
+        with self._lock:
+            series = self._series.get(key)
+            return series is not None and series.flapping
+
+    def forget(self, keys=(), prefixes=()):
+        """删除指定键或前缀（如 "监控目标:"）的状态机（配置中移除目标/进程时调用）"""
+        prefixes = tuple(prefixes)
+        with self._lock:
+            for key in list(self._series):
+                if key in keys or (prefixes and key.startswith(prefixes)):
+                    del self._series[key]
+
+
+def create_confirmation_tracker(config):
+    """从配置创建故障确认状态机"""
+    confirm_config = config.get("confirmation", {})
+    return ConfirmationTracker(
+        confirm_count=confirm_config.get("confirm_count", 2),
+        confirm_window=confirm_config.get("confirm_window", 3),
+        flap_window=confirm_config.get("flap_window", 600),
+        flap_threshold=confirm_config.get("flap_threshold", 4)
+    )
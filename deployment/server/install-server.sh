@@ -40,7 +40,7 @@ echo "[3/5] 安装服务文件..."
 mkdir -p "$INSTALL_DIR"
 
 # 复制所有必要的文件
-cp main.py remote_monitor.py notifier.py heartbeat.py web.py "$INSTALL_DIR/"
+cp main.py remote_monitor.py notifier.py heartbeat.py web.py http_client.py state_store.py uptime.py checkpoint.py scheduler.py confirmation.py circuit_breaker.py cluster.py metrics.py event_hub.py wire.py "$INSTALL_DIR/"
 cp -r templates "$INSTALL_DIR/"
 
 # 复制配置文件（如果不存在）
@@ -54,7 +54,7 @@ if [ ! -f "$INSTALL_DIR/config.json" ]; then
 fi
 
 # 创建logs目录
-mkdir -p "$INSTALL_DIR/logs"
+mkdir -p "$INSTALL_DIR/logs" "$INSTALL_DIR/data"
 
 # 设置权限
 chown -R monitor:monitor "$INSTALL_DIR"
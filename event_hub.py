@@ -0,0 +1,125 @@
+"""
+事件广播 - 把监控状态变化推送给所有 SSE 客户端
+每个事件只序列化一次放入环形缓冲区；客户端线程阻塞在同一个条件变量上，空闲时不占CPU
+"""
+import json
+import uuid
+import itertools
+import threading
+from collections import deque
+
+
+class EventHub:
+    """
+    SSE 广播中心（线程安全）
+
+    - 事件ID为 "epoch:序号"，epoch 每次启动随机生成，客户端断线重连时
+      携带 Last-Event-ID，缓冲区中还有后续事件时直接补发，否则重新发送快照
+    - ring_size: 保留的最近事件数
+    - max_clients: 同时连接的客户端上限
+    """
+
+    def __init__(self, ring_size=1024, max_clients=500):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.max_clients = max_clients
+        self._ring = deque(maxlen=ring_size)  # [(序号, 编码后的事件)]
+        self._last_seq = 0
+        self._clients = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def format(self, event, data, seq=None):
+        """编码一条 SSE 事件"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        event_id = f"id: {self.epoch}:{seq}\n" if seq is not None else ""
+        return f"{event_id}event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+    def publish(self, event, data):
+        """广播一条事件（没有客户端时只写入缓冲区）"""
+        with self._cond:
+            self._last_seq += 1
+            self._ring.append((self._last_seq, self.format(event, data, self._last_seq)))
+            self._cond.notify_all()
+
+    @property
+    def last_seq(self):
+        return self._last_seq
+
+    def parse_event_id(self, event_id):
+        """
+        解析客户端的 Last-Event-ID
+
+        Returns:
+            int: 序号；不是本次启动产生的ID时返回None
+        """
+        epoch, _, seq = (event_id or "").partition(":")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _events_after(self, seq):
+        if seq > self._last_seq:
+            return None
+        if seq == self._last_seq:
+            return []
+        if not self._ring or self._ring[0][0] > seq + 1:
+            return None  # 缓冲区已覆盖，需要重新发送快照
+        return [frame for _, frame in itertools.islice(self._ring, seq + 1 - self._ring[0][0], None)]
+
+    def events_after(self, seq):
+        """
+        Returns:
+            list: seq 之后的事件；None 表示无法补发（需要重新发送快照）
+        """
+        with self._cond:
+            return self._events_after(seq)
+
+    def wait(self, seq, timeout):
+        """
+        等待 seq 之后的事件
+
+        Returns:
+            (events, last_seq): 超时时 events 为空列表；无法补发时为None
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or self._last_seq != seq, timeout)
+            return self._events_after(seq), self._last_seq
+
+    def connect(self):
+        """登记一个客户端，超过上限时返回False"""
+        with self._cond:
+            if self._closed or self._clients >= self.max_clients:
+                return False
+            self._clients += 1
+            return True
+
+    def disconnect(self):
+        with self._cond:
+            self._clients -= 1
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        """服务停止：唤醒所有客户端线程使其退出"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                "clients": self._clients,
+                "events": self._last_seq,
+                "buffered": len(self._ring)
+            }
+
+
+def create_event_hub(config):
+    """从配置创建事件广播中心"""
+    stream_config = config.get("stream", {})
+    return EventHub(
+        ring_size=stream_config.get("ring_size", 1024),
+        max_clients=stream_config.get("max_clients", 500)
+    )
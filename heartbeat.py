@@ -7,8 +7,13 @@ import time
 import logging
 import threading
 
+import metrics
+
 logger = logging.getLogger(__name__)
 
+HEARTBEAT_DURATION = metrics.histogram("monitor_heartbeat_duration_seconds", "发送一次心跳的耗时（秒）")
+HEARTBEAT_RESULTS = metrics.counter("monitor_heartbeats_total", "心跳发送次数", ("result",))
+
 
 class HeartbeatMonitor:
     """心跳监控器"""
@@ -28,6 +33,12 @@ class HeartbeatMonitor:
             logger.warning("Healthchecks.io URL未配置，心跳功能未启用")
             return False
 
+        with HEARTBEAT_DURATION.time():
+            sent = self._ping()
+        HEARTBEAT_RESULTS.labels("ok" if sent else "error").inc()
+        return sent
+
+    def _ping(self):
         try:
             response = requests.get(self.url, timeout=10)
             if response.status_code == 200:
@@ -0,0 +1,192 @@
+"""
+Agent HTTP客户端 - 复用连接的请求层
+按主机维护keep-alive连接池，统计连接复用率
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+import wire
+
+REQUEST_DURATION = metrics.histogram(
+    "monitor_agent_request_duration_seconds", "请求Agent的耗时（秒）", ("agent", "endpoint"))
+REQUEST_ERRORS = metrics.counter(
+    "monitor_agent_request_errors_total", "请求Agent失败次数（连接错误或HTTP 5xx）", ("agent", "endpoint"))
+
+
+class ConnectionStats:
+    """连接统计：请求数 / 新建连接数（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self._per_host = {}  # {"host:port": [requests, new_connections]}
+
+    def record_request(self, host_key):
+        with self._lock:
+            self.requests += 1
+            self._per_host.setdefault(host_key, [0, 0])[0] += 1
+
+    def record_new_connection(self, host_key):
+        with self._lock:
+            self.new_connections += 1
+            self._per_host.setdefault(host_key, [0, 0])[1] += 1
+
+    def forget(self, host_key):
+        with self._lock:
+            self._per_host.pop(host_key, None)
+
+    @staticmethod
+    def _reuse_rate(requests_count, new_count):
+        if requests_count <= 0:
+            return None
+        return round(max(0.0, 1 - new_count / requests_count), 4)
+
+    def snapshot(self, per_host=False):
+        """
+        导出统计数据
+
+        Returns:
+            dict: {"requests": N, "new_connections": M, "reuse_rate": 0.98, ...}
+        """
+        with self._lock:
+            result = {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reuse_rate": self._reuse_rate(self.requests, self.new_connections)
+            }
+            if per_host:
+                result["hosts"] = {
+                    host: {
+                        "requests": req,
+                        "new_connections": new,
+                        "reuse_rate": self._reuse_rate(req, new)
+                    }
+                    for host, (req, new) in self._per_host.items()
+                }
+        return result
+
+
+def _counting_pool_class(base, stats):
+    """生成在新建连接时计数的连接池类"""
+
+    class CountingConnectionPool(base):
+        def _new_conn(self):
+            stats.record_new_connection(f"{self.host}:{self.port}")
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+class _PooledAdapter(HTTPAdapter):
+    """使用计数连接池的HTTPAdapter"""
+
+    def __init__(self, stats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self._stats),
+            "https": _counting_pool_class(HTTPSConnectionPool, self._stats)
+        }
+
+
+class AgentHttpClient:
+    """
+    共享的Agent请求客户端
+
+    - pool_connections: 同时缓存的主机连接池数量（应不小于Agent数量）
+    - pool_maxsize: 每个主机保留的keep-alive连接数
+    - pool_block: 连接池满时是否等待空闲连接（否则临时新建连接）
+    - compact: 是否向Agent声明接受紧凑二进制格式（旧版Agent忽略并返回JSON）
+    """
+
+    def __init__(self, pool_connections=256, pool_maxsize=2, pool_block=False, compact=True):
+        self.stats = ConnectionStats()
+        self.session = requests.Session()
+        if compact:
+            self.session.headers["Accept"] = wire.ACCEPT
+
+        adapter = _PooledAdapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=0  # 重试由调用方决定，避免请求在连接层被放大
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url, **kwargs):
+        """发送GET请求（复用主机连接）"""
+        return self._request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """发送POST请求（复用主机连接）"""
+        return self._request("POST", url, **kwargs)
+
+    def _request(self, method, url, **kwargs):
+        """发送请求，按 Agent/接口 记录耗时和失败次数"""
+        parts = urlsplit(url)
+        host_key = self._host_key(parts)
+        endpoint = self._endpoint(parts.path)
+        self.stats.record_request(host_key)
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            REQUEST_ERRORS.labels(host_key, endpoint).inc()
+            raise
+        finally:
+            REQUEST_DURATION.labels(host_key, endpoint).observe(time.perf_counter() - started)
+
+        if response.status_code >= 500:
+            REQUEST_ERRORS.labels(host_key, endpoint).inc()
+        return response
+
+    def get_stats(self, per_host=False):
+        """获取连接复用统计"""
+        return self.stats.snapshot(per_host=per_host)
+
+    def forget(self, host_key):
+        """删除Agent的请求指标和连接统计（配置中移除Agent时调用）"""
+        REQUEST_DURATION.remove(agent=host_key)
+        REQUEST_ERRORS.remove(agent=host_key)
+        self.stats.forget(host_key)
+
+    def close(self):
+        """关闭所有连接"""
+        self.session.close()
+
+    @staticmethod
+    def _host_key(parts):
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return f"{parts.hostname}:{port}"
+
+    @staticmethod
+    def _endpoint(path):
+        """指标中的接口名（/api/process/<name> 合并为一个，避免序列数随进程名增长）"""
+        endpoint = path[len("/api/"):] if path.startswith("/api/") else path
+        if endpoint.startswith("process/"):
+            return "process"
+        return endpoint
+
+
+def create_agent_client(config):
+    """从配置创建Agent请求客户端"""
+    client_config = config.get("agent_client", {})
+    return AgentHttpClient(
+        pool_connections=client_config.get("pool_connections", 256),
+        pool_maxsize=client_config.get("pool_maxsize", 2),
+        pool_block=client_config.get("pool_block", False),
+        compact=client_config.get("compact", True)
+    )
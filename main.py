@@ -5,6 +5,7 @@
 import json
 import os
 import sys
+import time
 import logging
 import signal
 import threading
@@ -12,6 +13,10 @@ from logging.handlers import RotatingFileHandler
 
 from remote_monitor import create_remote_monitor
 from notifier import create_notifier
+from state_store import create_state_store
+from checkpoint import create_checkpoint
+from cluster import create_cluster
+from uptime import WINDOWS
 from heartbeat import create_heartbeat_monitor
 from web import create_app, set_monitor_instances
 
@@ -67,14 +72,67 @@ def load_config():
         sys.exit(1)
 
 
+class ConfigWatcher:
+    """
+    配置文件监视器 - 定期检查 config.json 的修改时间和大小，
+    文件被外部修改（如手动编辑）后热加载到远程监控器
+    """
+
+    def __init__(self, path, remote_monitor, interval=2):
+        self.path = path
+        self.remote_monitor = remote_monitor
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._signature = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def check(self):
+        """文件有变化时重新加载，返回是否已应用"""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            # 编辑过程中可能读到不完整的文件，保持当前配置，等待下次变化
+            logging.error(f"重新加载配置失败，保持当前配置: {e}")
+            return False
+
+        self.remote_monitor.apply_config(config)
+        return True
+
+    def run(self):
+        """监视循环（在独立线程中运行）"""
+        while not self._stop_event.wait(timeout=self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"配置热加载异常: {e}", exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
+
+
 class MonitorService:
     """监控服务主类"""
 
     def __init__(self):
         self.config = None
         self.notifier = None
+        self.history = None
+        self.cluster = None
         self.remote_monitor = None
         self.heartbeat_monitor = None
+        self.config_watcher = None
         self.threads = []
         self.stop_event = threading.Event()
 
@@ -94,14 +152,35 @@ class MonitorService:
 
         # 创建组件
         self.notifier = create_notifier(self.config)
-        self.remote_monitor = create_remote_monitor(self.config, self.notifier)
+        self.history = create_state_store(self.config)
+        checkpoint = create_checkpoint(self.config)
+        self.cluster = create_cluster(self.config)
+        self.remote_monitor = create_remote_monitor(self.config, self.notifier, self.history, checkpoint, self.cluster)
         self.heartbeat_monitor = create_heartbeat_monitor(self.config)
 
+        # 恢复上次退出前的进程状态和告警冷却，重启期间停止的进程在第一轮检查即可告警
+        if checkpoint is not None:
+            state = checkpoint.load()
+            if state:
+                restored = self.remote_monitor.restore_state(state)
+                logging.info(f"已从检查点恢复 {restored} 个进程状态")
+
+        # 从历史记录恢复可用率窗口（较早的数据按小时聚合，最近1小时按分钟）
+        if self.history is not None:
+            now = time.time()
+            longest = max(span for span, _ in WINDOWS.values())
+            recent = int(now - 3600) // 3600 * 3600
+            rows = self.history.load_buckets(now - longest, recent, 3600)
+            rows += self.history.load_buckets(recent, now + 60, 60)
+            self.remote_monitor.uptime.warm_up(rows)
+            logging.info(f"已从历史记录恢复可用率统计 ({len(rows)} 条记录)")
+
         # 注入到web模块
         set_monitor_instances(
             self.remote_monitor,
             self.notifier,
-            self.heartbeat_monitor
+            self.heartbeat_monitor,
+            self.history
         )
 
         logging.info("服务组件初始化完成")
@@ -111,6 +190,11 @@ class MonitorService:
         # 发送启动通知
         self.notifier.send_startup_notification()
 
+        # 加入集群（同步完成一次心跳，监控线程启动时即可确定本实例负责的目标）
+        if self.cluster is not None:
+            self.cluster.start()
+            logging.info(f"已加入集群: {self.cluster.instance_id}，当前 {len(self.cluster.get_stats()['members'])} 个实例")
+
         # 启动远程监控线程
         monitor_thread = threading.Thread(
             target=self.remote_monitor.run,
@@ -131,6 +215,16 @@ class MonitorService:
         self.threads.append(heartbeat_thread)
         logging.info("心跳监控线程已启动")
 
+        # 启动配置文件监视线程（修改 config.json 后无需重启）
+        self.config_watcher = ConfigWatcher(CONFIG_FILE, self.remote_monitor)
+        watcher_thread = threading.Thread(
+            target=self.config_watcher.run,
+            name="ConfigWatcher",
+            daemon=True
+        )
+        watcher_thread.start()
+        self.threads.append(watcher_thread)
+
         # 启动Web服务（在主线程）
         web_host = self.config.get("web_host", "0.0.0.0")
         web_port = self.config.get("web_port", 8080)
@@ -156,9 +250,22 @@ class MonitorService:
         logging.info("正在停止服务...")
 
         # 停止监控器
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
         self.remote_monitor.stop()
         self.heartbeat_monitor.stop()
 
+        # 退出集群，其他实例在下一次心跳时接管本实例的目标
+        if self.cluster is not None:
+            self.cluster.stop()
+
+        # 发送队列中剩余的告警（有超时上限）
+        self.notifier.stop()
+
+        # 写入队列中剩余的历史记录
+        if self.history is not None:
+            self.history.stop()
+
         # 等待线程退出
         for thread in self.threads:
             thread.join(timeout=5)
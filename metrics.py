@@ -0,0 +1,335 @@
+"""
+运行指标 - Prometheus/OpenMetrics 文本格式的计数器、仪表和直方图
+热路径只对单个序列加锁做一次加法；序列和指标族都缓存渲染好的文本，
+/metrics 只重新渲染上次抓取后有变化的部分，没有变化时直接返回上次的结果
+"""
+import bisect
+import threading
+import time
+
+# 请求耗时的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _ValueSeries:
+    """计数器/仪表的单个序列"""
+
+    __slots__ = ("_family", "_prefix", "_value", "_lock", "_dirty", "_text")
+
+    def __init__(self, family, prefix):
+        self._family = family
+        self._prefix = prefix  # "名称{标签} "
+        self._value = 0.0
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._text = ""
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+        self._dirty = True
+        self._family._dirty = True
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        if value != self._value:
+            self._value = value
+            self._dirty = True
+            self._family._dirty = True
+
+    def get(self):
+        return self._value
+
+    def render(self):
+        # 先清除标记再读取数值：渲染期间的并发更新会重新置位，下次抓取时补上
+        if self._dirty:
+            self._dirty = False
+            self._text = f"{self._prefix}{_format_value(self._value)}\n"
+        return self._text
+
+
+class _Timer:
+    __slots__ = ("_series", "_started")
+
+    def __init__(self, series):
+        self._series = series
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._series.observe(time.perf_counter() - self._started)
+        return False
+
+
+class _HistogramSeries:
+    """直方图的单个序列（固定分桶）"""
+
+    __slots__ = ("_family", "_bounds", "_counts", "_sum", "_lock", "_dirty", "_text",
+                 "_bucket_prefixes", "_sum_prefix", "_count_prefix")
+
+    def __init__(self, family, name, label_names, label_values, bounds):
+        self._family = family
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)  # 最后一个为 +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._text = ""
+
+        bucket_names = label_names + ("le",)
+        self._bucket_prefixes = [
+            f"{name}_bucket{_format_labels(bucket_names, label_values + (_format_value(bound),))} "
+            for bound in bounds + (float("inf"),)
+        ]
+        labels = _format_labels(label_names, label_values)
+        self._sum_prefix = f"{name}_sum{labels} "
+        self._count_prefix = f"{name}_count{labels} "
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+        self._dirty = True
+        self._family._dirty = True
+
+    def time(self):
+        """计时上下文：with histogram.time(): ..."""
+        return _Timer(self)
+
+    def render(self):
+        if self._dirty:
+            self._dirty = False
+            with self._lock:
+                counts = list(self._counts)
+                total = self._sum
+            lines = []
+            cumulative = 0
+            for prefix, count in zip(self._bucket_prefixes, counts):
+                cumulative += count
+                lines.append(f"{prefix}{cumulative}\n")
+            lines.append(f"{self._sum_prefix}{_format_value(total)}\n")
+            lines.append(f"{self._count_prefix}{cumulative}\n")
+            self._text = "".join(lines)
+        return self._text
+
+
+class _Metric:
+    """指标族：按标签值区分的一组序列"""
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}  # {标签值: 序列}
+        self._lock = threading.Lock()
+        self._dirty = True  # 有序列更新或增删，需要重新拼接
+        self._body = ""
+
+    def _new_series(self, values):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """获取（首次时创建）指定标签值的序列"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_series(tuple(str(v) for v in values))
+                    self._dirty = True
+        return child
+
+    def remove(self, *values, **labels):
+        """
+        删除序列（对应的Agent/目标移除时调用）
+
+        remove("a", "/x") 删除指定标签值的序列；remove(agent="a") 按部分标签删除全部匹配的序列
+        """
+        with self._lock:
+            if not labels:
+                if self._children.pop(values, None) is not None:
+                    self._dirty = True
+                return
+            positions = [(self.labelnames.index(name), str(value)) for name, value in labels.items()]
+            for key in [key for key in self._children if all(str(key[i]) == value for i, value in positions)]:
+                del self._children[key]
+                self._dirty = True
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def header(self, openmetrics=False):
+        family = self.family_name(openmetrics)
+        return f"# HELP {family} {self.documentation}\n# TYPE {family} {self.TYPE}\n"
+
+    def body(self):
+        """全部序列的文本（只重新渲染有变化的序列）"""
+        if self._dirty:
+            self._dirty = False
+            self._body = "".join([child.render() for child in list(self._children.values())])
+        return self._body
+
+    def render(self, openmetrics=False):
+        return self.header(openmetrics) + self.body()
+
+    def family_name(self, openmetrics):
+        return self.name
+
+
+class Counter(_Metric):
+    """只增不减的计数器（名称以 _total 结尾）"""
+
+    TYPE = "counter"
+
+    def _new_series(self, values):
+        return _ValueSeries(self, f"{self.name}{_format_labels(self.labelnames, values)} ")
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def family_name(self, openmetrics):
+        # OpenMetrics 中计数器族名不带 _total 后缀
+        if openmetrics and self.name.endswith("_total"):
+            return self.name[:-len("_total")]
+        return self.name
+
+
+class Gauge(_Metric):
+    """可增可减的仪表"""
+
+    TYPE = "gauge"
+
+    def _new_series(self, values):
+        return _ValueSeries(self, f"{self.name}{_format_labels(self.labelnames, values)} ")
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图"""
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _new_series(self, values):
+        return _HistogramSeries(self, self.name, self.labelnames, values, self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class MetricsRegistry:
+    """指标注册表（同名指标重复注册时返回已有的指标）"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._rendered = {}  # {openmetrics: 文本}，任一指标族变化后失效
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+                if not metric.labelnames:
+                    metric.labels()  # 无标签的指标从0开始输出
+                self._rendered = {}
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"指标 {name} 已以不同的类型或标签注册")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self, openmetrics=False):
+        """
+        渲染全部指标
+
+        Args:
+            openmetrics: True 时输出 OpenMetrics 格式（以 # EOF 结尾）
+
+        Returns:
+            str: 文本格式的指标
+        """
+        metrics = list(self._metrics.values())
+        cached = self._rendered.get(openmetrics)
+        if cached is not None and not any(metric.dirty for metric in metrics):
+            return cached
+
+        parts = []
+        for metric in metrics:
+            parts.append(metric.header(openmetrics))
+            parts.append(metric.body())
+        if openmetrics:
+            parts.append("# EOF\n")
+        body = "".join(parts)
+        self._rendered = {openmetrics: body}
+        return body
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def negotiate(accept_header):
+    """
+    根据 Accept 请求头选择输出格式
+
+    Returns:
+        (openmetrics, content_type)
+    """
+    if "application/openmetrics-text" in (accept_header or ""):
+        return True, OPENMETRICS_CONTENT_TYPE
+    return False, CONTENT_TYPE
@@ -1,12 +1,14 @@
 """
 钉钉通知模块 - 简单可靠的推送实现
-支持加签安全设置
+支持加签安全设置，告警通过后台队列异步发送
 """
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import socket
 import time
+import queue
+import random
+import threading
 import hmac
 import hashlib
 import base64
@@ -14,8 +16,276 @@ import urllib.parse
 from datetime import datetime
 import logging
 
+import metrics
+
 logger = logging.getLogger(__name__)
 
+SEND_DURATION = metrics.histogram("monitor_notifier_send_duration_seconds", "发送一次钉钉通知的耗时（秒）")
+SEND_RESULTS = metrics.counter("monitor_notifier_sends_total", "钉钉通知发送次数", ("result",))
+SEND_RETRIES = metrics.counter("monitor_notifier_retries_total", "钉钉通知发送失败后的重试次数")
+
+
+class TokenBucket:
+    """令牌桶限速（线程安全）"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate  # 每秒补充的令牌数
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        取走一个令牌
+
+        Returns:
+            float: 需要等待的秒数（0 表示可立即发送）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(webhook_url, per_minute):
+    """获取Webhook对应的令牌桶（同一Webhook共享限速）"""
+    with _rate_limiters_lock:
+        bucket = _rate_limiters.get(webhook_url)
+        if bucket is None:
+            bucket = TokenBucket(rate=per_minute / 60.0, capacity=per_minute)
+            _rate_limiters[webhook_url] = bucket
+        return bucket
+
+
+class AlertCoalescer:
+    """
+    告警合并
+
+    窗口期内产生的告警合并为一条按监控目标分组的 markdown 汇总，
+    窗口期内只有一条告警时仍按原格式发送。
+    """
+
+    def __init__(self, notifier, window=10, max_items=100):
+        self.notifier = notifier
+        self.window = window
+        self.max_items = max_items  # 单条汇总最多包含的告警数，超出拆分为多条
+        self._pending = []  # [(group, line, message)]
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, group, line, message):
+        """加入一条告警，窗口期结束后统一发送"""
+        with self._lock:
+            self._pending.append((group, line, message))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return True
+
+    def flush(self):
+        """立即发送窗口内积累的告警"""
+        with self._lock:
+            items = self._pending
+            self._pending = []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if len(items) == 1:
+            self.notifier.dispatch(items[0][2])
+            return
+
+        parts = (len(items) + self.max_items - 1) // self.max_items
+        for part in range(parts):
+            chunk = items[part * self.max_items:(part + 1) * self.max_items]
+            title, text = self._build_digest(chunk, len(items), part + 1, parts)
+            self.notifier.dispatch(text, title=title)
+
+    @staticmethod
+    def _build_digest(items, total, part=1, parts=1):
+        """生成按监控目标分组的 markdown 汇总"""
+        groups = {}
+        for group, line, _ in items:
+            groups.setdefault(group, []).append(line)
+
+        title = f"【进程告警汇总】{total} 条"
+        if parts > 1:
+            title += f" ({part}/{parts})"
+        lines = [f"#### {title}", ""]
+        for group, group_lines in groups.items():
+            lines.append(f"**{group}**")
+            lines.append("")
+            lines.extend(f"- {line}" for line in group_lines)
+            lines.append("")
+        lines.append(f"> 时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        return title, "\n".join(lines)
+
+
+class AlertDispatcher:
+    """
+    告警发送队列
+
+    告警先放入有界队列立即返回，由后台工作线程发送，失败后按
+    指数退避+随机抖动重试，不阻塞监控检测。队列满时丢弃新告警并计数。
+    每次发送前从Webhook的令牌桶取令牌，避免触发钉钉限流。
+    停止时在 flush_timeout 内尽量发送完队列中剩余的告警。
+    """
+
+    def __init__(self, notifier, queue_size=1000, workers=1, max_attempts=5,
+                 base_delay=2, max_delay=60, flush_timeout=10, rate_limit=20):
+        self.notifier = notifier
+        self.rate_limiter = get_rate_limiter(notifier.webhook_url, rate_limit) if rate_limit else None
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.flush_timeout = flush_timeout
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._closing = threading.Event()  # 不再接收新告警，发送完队列后退出
+        self._abort = threading.Event()  # 超过 flush_timeout，放弃剩余告警
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"submitted": 0, "sent": 0, "failed": 0, "retried": 0, "dropped": 0, "throttled": 0}
+
+    def _count(self, name, value=1):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    def submit(self, message, title=None):
+        """
+        提交告警（不阻塞）
+
+        Args:
+            message: 消息内容
+            title: 标题，指定时按 markdown 消息发送
+
+        Returns:
+            bool: 是否已进入发送队列
+        """
+        if self._closing.is_set():
+            logger.error(f"告警队列已关闭，丢弃告警: {message[:50]}...")
+            self._count("dropped")
+            return False
+
+        try:
+            self._queue.put_nowait((message, title))
+        except queue.Full:
+            logger.error(f"告警队列已满 ({self._queue.maxsize})，丢弃告警: {message[:50]}...")
+            self._count("dropped")
+            return False
+
+        self._count("submitted")
+        return True
+
+    def _retry_delay(self, attempt):
+        """第 attempt 次失败后的等待时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _wait_for_token(self):
+        """等待令牌桶放行，服务停止超时时返回 False"""
+        if self.rate_limiter is None:
+            return True
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            self._count("throttled")
+            logger.info(f"钉钉发送限速，等待 {delay:.1f} 秒")
+            return not self._abort.wait(timeout=delay)
+        return True
+
+    def _deliver(self, message, title=None):
+        """发送单条告警，失败时重试"""
+        for attempt in range(self.max_attempts):
+            if not self._wait_for_token():
+                break
+
+            if self.notifier.send_once(message, title=title):
+                self._count("sent")
+                return
+
+            if attempt < self.max_attempts - 1:
+                delay = self._retry_delay(attempt)
+                logger.info(f"告警发送失败，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_attempts})")
+                self._count("retried")
+                SEND_RETRIES.inc()
+                if self._abort.wait(timeout=delay):
+                    break
+
+        logger.error(f"告警发送失败，已放弃: {message[:50]}...")
+        self._count("failed")
+
+    def _worker(self):
+        """工作线程：持续从队列取出告警发送"""
+        while True:
+            try:
+                message, title = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._closing.is_set():
+                    return
+                continue
+
+            try:
+                if self._abort.is_set():
+                    self._count("dropped")
+                else:
+                    self._deliver(message, title)
+            except Exception as e:
+                logger.error(f"告警发送异常: {e}", exc_info=True)
+                self._count("failed")
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        """启动工作线程"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"AlertDispatcher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        停止发送：等待队列发送完毕，最多等待 timeout 秒（默认 flush_timeout）
+
+        Returns:
+            int: 未能发送的告警数
+        """
+        timeout = self.flush_timeout if timeout is None else timeout
+        self._closing.set()
+
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+
+        if any(thread.is_alive() for thread in self._threads):
+            self._abort.set()
+            for thread in self._threads:
+                thread.join(timeout=1)
+
+        remaining = self._queue.qsize()
+        if remaining:
+            logger.warning(f"告警队列未发送完毕，丢弃 {remaining} 条告警")
+            self._count("dropped", remaining)
+        return remaining
+
+    def get_metrics(self):
+        """获取队列指标"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["queue_size"] = self._queue.maxsize
+        return metrics
+
 
 class DingTalkNotifier:
     """钉钉机器人通知器"""
@@ -24,23 +294,17 @@ class DingTalkNotifier:
         self.webhook_url = webhook_url
         self.secret = secret  # 加签密钥
         self.hostname = socket.gethostname()
-        # 创建带重试策略的Session
+        # 创建HTTP会话（重试由 send / AlertDispatcher 负责，不在连接层叠加）
         self.session = self._create_session()
+        self.dispatcher = None  # 告警发送队列，未启用时同步发送
+        self.coalescer = None  # 告警合并，未启用时逐条发送
 
     def _create_session(self):
         """创建增强的HTTP会话"""
         session = requests.Session()
 
-        # 配置重试策略
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,  # 1秒、2秒、4秒递增
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["POST"]
-        )
-
         adapter = HTTPAdapter(
-            max_retries=retry_strategy,
+            max_retries=0,
             pool_connections=1,
             pool_maxsize=1
         )
@@ -96,65 +360,108 @@ class DingTalkNotifier:
         logger.debug(f"生成签名URL: timestamp={timestamp}")
         return signed_url
 
-    def send(self, message, retry=3):
+    def is_configured(self):
+        """Webhook是否已配置"""
+        return bool(self.webhook_url) and "YOUR_ACCESS_TOKEN_HERE" not in self.webhook_url
+
+    def send_once(self, message, attempt_label="", title=None):
         """
-        发送钉钉通知
+        发送一次钉钉通知（不重试）
 
         Args:
             message: 消息内容
-            retry: 重试次数（默认3次）
+            attempt_label: 日志中的重试说明
+            title: 标题，指定时按 markdown 消息发送
 
         Returns:
             bool: 发送是否成功
         """
-        if not self.webhook_url or "YOUR_ACCESS_TOKEN_HERE" in self.webhook_url:
+        if not self.is_configured():
             logger.warning("钉钉Webhook未配置，跳过发送")
             return False
 
-        payload = {
-            "msgtype": "text",
-            "text": {
-                "content": message
+        if title:
+            payload = {
+                "msgtype": "markdown",
+                "markdown": {
+                    "title": title,
+                    "text": message
+                }
+            }
+        else:
+            payload = {
+                "msgtype": "text",
+                "text": {
+                    "content": message
+                }
             }
-        }
 
-        for attempt in range(retry):
-            try:
-                # 获取签名URL（如果配置了secret）
-                url = self._get_signed_url()
-
-                response = self.session.post(
-                    url,  # 使用签名URL
-                    json=payload,
-                    timeout=(5, 10),  # (连接超时, 读取超时)
-                    verify=True  # 验证SSL证书
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("errcode") == 0:
-                        logger.info(f"钉钉通知发送成功: {message[:50]}...")
-                        return True
-                    else:
-                        logger.error(f"钉钉API返回错误: {result}")
+        with SEND_DURATION.time():
+            sent = self._post(message, payload, attempt_label)
+        SEND_RESULTS.labels("ok" if sent else "error").inc()
+        return sent
+
+    def _post(self, message, payload, attempt_label):
+        """请求钉钉接口，返回是否发送成功"""
+        try:
+            # 获取签名URL（如果配置了secret）
+            url = self._get_signed_url()
+
+            response = self.session.post(
+                url,  # 使用签名URL
+                json=payload,
+                timeout=(5, 10),  # (连接超时, 读取超时)
+                verify=True  # 验证SSL证书
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("errcode") == 0:
+                    logger.info(f"钉钉通知发送成功: {message[:50]}...")
+                    return True
                 else:
-                    logger.error(f"钉钉请求失败: HTTP {response.status_code}")
+                    logger.error(f"钉钉API返回错误: {result}")
+            else:
+                logger.error(f"钉钉请求失败: HTTP {response.status_code}")
+
+        except requests.exceptions.SSLError as e:
+            logger.error(f"SSL证书验证失败{attempt_label}: {e}")
+            logger.warning("提示: 如果在企业网络环境，可能需要配置代理或信任证书")
+
+        except requests.exceptions.ConnectionError as e:
+            logger.error(f"连接错误{attempt_label}: {e}")
+            logger.warning("提示: 检查网络连接或防火墙设置")
+
+        except requests.exceptions.Timeout as e:
+            logger.error(f"请求超时{attempt_label}: {e}")
+
+        except requests.RequestException as e:
+            logger.error(f"钉钉发送异常{attempt_label}: {e}")
 
-            except requests.exceptions.SSLError as e:
-                logger.error(f"SSL证书验证失败 (尝试 {attempt + 1}/{retry}): {e}")
-                logger.warning("提示: 如果在企业网络环境，可能需要配置代理或信任证书")
+        return False
+
+    def send(self, message, retry=3, title=None):
+        """
+        同步发送钉钉通知（阻塞调用方，用于测试消息等需要立即得到结果的场景）
 
-            except requests.exceptions.ConnectionError as e:
-                logger.error(f"连接错误 (尝试 {attempt + 1}/{retry}): {e}")
-                logger.warning("提示: 检查网络连接或防火墙设置")
+        Args:
+            message: 消息内容
+            retry: 重试次数（默认3次）
+            title: 标题，指定时按 markdown 消息发送
 
-            except requests.exceptions.Timeout as e:
-                logger.error(f"请求超时 (尝试 {attempt + 1}/{retry}): {e}")
+        Returns:
+            bool: 发送是否成功
+        """
+        if not self.is_configured():
+            logger.warning("钉钉Webhook未配置，跳过发送")
+            return False
 
-            except requests.RequestException as e:
-                logger.error(f"钉钉发送异常 (尝试 {attempt + 1}/{retry}): {e}")
+        for attempt in range(retry):
+            if self.send_once(message, attempt_label=f" (尝试 {attempt + 1}/{retry})", title=title):
+                return True
 
             if attempt < retry - 1:
+                SEND_RETRIES.inc()
                 wait_time = (attempt + 1) * 3  # 递增等待: 3秒、6秒、9秒
                 logger.info(f"等待 {wait_time} 秒后重试...")
                 time.sleep(wait_time)
@@ -162,6 +469,57 @@ class DingTalkNotifier:
         logger.error("钉钉通知发送失败，已达到最大重试次数")
         return False
 
+    def dispatch(self, message, title=None):
+        """
+        异步发送：放入告警队列后立即返回（未启用队列时同步发送）
+
+        Returns:
+            bool: 是否已进入队列（或同步发送成功）
+        """
+        if not self.is_configured():
+            logger.warning("钉钉Webhook未配置，跳过发送")
+            return False
+        if self.dispatcher is None:
+            return self.send(message, title=title)
+        return self.dispatcher.submit(message, title)
+
+    def dispatch_alert(self, group, line, message):
+        """
+        发送可合并的告警
+
+        Args:
+            group: 汇总中的分组标题（如监控目标）
+            line: 汇总中的一行
+            message: 单独发送时的完整消息
+        """
+        if self.coalescer is None:
+            return self.dispatch(message)
+        if not self.is_configured():
+            logger.warning("钉钉Webhook未配置，跳过发送")
+            return False
+        return self.coalescer.add(group, line, message)
+
+    def start_dispatcher(self, coalesce_window=0, max_digest_items=100, **options):
+        """启用告警发送队列（coalesce_window > 0 时同时启用告警合并）"""
+        self.dispatcher = AlertDispatcher(self, **options)
+        self.dispatcher.start()
+        if coalesce_window > 0:
+            self.coalescer = AlertCoalescer(self, coalesce_window, max_digest_items)
+        return self.dispatcher
+
+    def stop(self, timeout=None):
+        """停止通知器，在限定时间内发送完队列中的告警"""
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        if self.dispatcher is not None:
+            self.dispatcher.stop(timeout)
+
+    def get_metrics(self):
+        """获取告警队列指标"""
+        if self.dispatcher is None:
+            return {}
+        return self.dispatcher.get_metrics()
+
     def send_process_alert(self, process_name, status="stopped"):
         """发送本地进程告警"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -172,7 +530,7 @@ class DingTalkNotifier:
 状态: {status}
 时间: {timestamp}"""
 
-        return self.send(message)
+        return self.dispatch(message)
 
     def send_process_alert_remote(self, monitor_name, host, process_name, status="stopped"):
         """发送远程进程告警"""
@@ -185,7 +543,37 @@ class DingTalkNotifier:
 状态: {status}
 时间: {timestamp}"""
 
-        return self.send(message)
+        return self.dispatch_alert(f"{monitor_name} ({host})", f"{process_name}: {status}", message)
+
+    def send_resource_alert(self, monitor_name, host, process_name, metric, value, limit, status):
+        """发送进程资源阈值告警/恢复通知"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        message = f"""【资源告警】
+监控目标: {monitor_name}
+主机地址: {host}
+进程: {process_name}
+指标: {metric}
+当前值: {value}
+阈值: {limit}
+状态: {status}
+时间: {timestamp}"""
+
+        return self.dispatch_alert(f"{monitor_name} ({host})", f"{process_name} {metric} {value}: {status}", message)
+
+    def send_agent_alert(self, monitor_name, host, port, status, offline_seconds=None):
+        """发送Agent离线/恢复告警"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        message = f"""【Agent告警】
+监控目标: {monitor_name}
+Agent地址: {host}:{port}
+状态: {status}"""
+        if offline_seconds is not None:
+            message += f"\n离线时长: {offline_seconds // 60} 分 {offline_seconds % 60} 秒"
+        message += f"\n时间: {timestamp}"
+
+        return self.dispatch_alert(f"{monitor_name} ({host})", f"Agent: {status}", message)
 
     def send_startup_notification(self):
         """发送服务启动通知"""
@@ -196,7 +584,7 @@ class DingTalkNotifier:
 状态: 服务已启动
 时间: {timestamp}"""
 
-        return self.send(message)
+        return self.dispatch(message)
 
     def send_test_message(self):
         """发送测试消息"""
@@ -213,4 +601,18 @@ def create_notifier(config):
     notification_config = config.get("notification", {})
     webhook = notification_config.get("dingtalk_webhook", "")
     secret = notification_config.get("dingtalk_secret", "")  # 读取加签密钥
-    return DingTalkNotifier(webhook, secret)
+    notifier = DingTalkNotifier(webhook, secret)
+
+    if notification_config.get("async", True):
+        notifier.start_dispatcher(
+            queue_size=notification_config.get("queue_size", 1000),
+            workers=notification_config.get("workers", 1),
+            max_attempts=notification_config.get("max_attempts", 5),
+            base_delay=notification_config.get("retry_base_delay", 2),
+            max_delay=notification_config.get("retry_max_delay", 60),
+            flush_timeout=notification_config.get("flush_timeout", 10),
+            rate_limit=notification_config.get("rate_limit_per_minute", 20),
+            coalesce_window=notification_config.get("coalesce_window", 10),
+            max_digest_items=notification_config.get("max_digest_items", 100)
+        )
+    return notifier
@@ -3,25 +3,229 @@
 通过HTTP请求各个Agent获取进程状态
 """
 import requests
+import re
 import time
+import fnmatch
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import quote
 from collections import defaultdict
 
+import metrics
+import wire
+from http_client import create_agent_client
+from event_hub import create_event_hub
+from uptime import UptimeRollup
+from scheduler import create_scheduler
+from circuit_breaker import create_circuit_breaker, EVENT_OFFLINE, EVENT_RECOVERED
+from confirmation import (
+    create_confirmation_tracker, EVENT_PENDING, EVENT_FIRST, EVENT_DOWN, EVENT_UP, FLAP_START, FLAP_END
+)
+
 logger = logging.getLogger(__name__)
 
+CHECK_DURATION = metrics.histogram("monitor_check_duration_seconds", "单个监控目标一次检查的耗时（秒）", ("mode",))
+CHECK_RESULTS = metrics.counter(
+    "monitor_checks_total", "检查结果次数（online/offline，熔断或中继不可达时为 skipped）", ("mode", "result"))
+
+# 进程匹配规则：以 "re:" 开头为正则，包含通配符为glob，其余为精确进程名
+REGEX_PREFIX = "re:"
+GLOB_CHARS = frozenset("*?[")
+# 命令行/可执行文件规则（只能由Agent匹配）："cmd:" 命令行子串，"cmdre:" 命令行正则，"exe:" 可执行文件路径
+COMMAND_PREFIXES = ("cmd:", "cmdre:", "exe:")
+
+
+def is_command_pattern(pattern):
+    """是否为需要Agent读取命令行/可执行文件路径的规则"""
+    return pattern.startswith(COMMAND_PREFIXES)
+
+
+def compile_process_pattern(pattern):
+    """
+    编译进程匹配规则
+
+    Returns:
+        re.Pattern: 正则/通配符规则
+        None: 精确进程名
+    """
+    if pattern.startswith(REGEX_PREFIX):
+        return re.compile(pattern[len(REGEX_PREFIX):])
+    if GLOB_CHARS.intersection(pattern):
+        return re.compile(fnmatch.translate(pattern))
+    return None
+
+
+def count_process_matches(patterns, process_counts):
+    """
+    统计每条规则匹配到的进程数
+
+    Args:
+        patterns: 匹配规则列表
+        process_counts: {进程名: 进程数}
+
+    Returns:
+        dict: {规则: 进程数}，只有进程名时无法判断的命令行/可执行文件规则不在结果中
+    """
+    results = {}
+    for pattern in patterns:
+        if is_command_pattern(pattern):
+            continue
+        try:
+            compiled = compile_process_pattern(pattern)
+        except re.error as e:
+            logger.error(f"进程匹配规则无效 {pattern}: {e}")
+            results[pattern] = 0
+            continue
+        if compiled is None:
+            results[pattern] = process_counts.get(pattern, 0)
+        else:
+            results[pattern] = sum(count for name, count in process_counts.items() if compiled.search(name))
+    return results
+
+
+# 资源阈值：{配置键: (显示名称, 比较方向, Agent资源汇总中的字段)}
+RESOURCE_LIMITS = {
+    "cpu_percent": ("CPU", ">", "cpu_percent"),
+    "rss": ("内存(RSS)", ">", "rss"),
+    "threads": ("线程数", ">", "threads"),
+    "fds": ("打开文件数", ">", "fds"),
+    "min_uptime": ("运行时长", "<", "uptime"),
+}
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+SIZE_PATTERN = re.compile(r"([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?)(?:I?B)?")
+
+
+def parse_size(value):
+    """
+    解析字节数（1024进制）: 2147483648 / "2GB" / "512M"
+
+    Raises:
+        ValueError: 格式错误
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    match = SIZE_PATTERN.fullmatch(str(value).strip().upper())
+    if match is None:
+        raise ValueError(f"无法解析的大小: {value}")
+    return float(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def format_resource(key, value):
+    """资源指标的显示文本"""
+    if key == "rss":
+        for unit in ("T", "G", "M", "K"):
+            if value >= SIZE_UNITS[unit]:
+                return f"{value / SIZE_UNITS[unit]:.1f} {unit}B"
+        return f"{int(value)} B"
+    if key == "cpu_percent":
+        return f"{value:.1f}%"
+    if key == "min_uptime":
+        return f"{int(value)} 秒"
+    return str(int(value))
+
+
+def compile_thresholds(thresholds):
+    """
+    解析监控目标的资源阈值
+
+    Args:
+        thresholds: {规则: {"cpu_percent": 90, "rss": "2GB", "threads": 500, "fds": 10000, "min_uptime": 60}}
+
+    Returns:
+        (rules, errors): rules 为 [(规则, 配置键, 阈值)]，errors 为错误信息列表
+    """
+    rules = []
+    errors = []
+    if not isinstance(thresholds, dict):
+        return rules, ["thresholds 必须是 {进程规则: {指标: 阈值}}"]
+    for pattern, limits in thresholds.items():
+        if not isinstance(limits, dict):
+            errors.append(f"{pattern}: 阈值必须是 {{指标: 阈值}}")
+            continue
+        for key, limit in limits.items():
+            if key not in RESOURCE_LIMITS:
+                errors.append(f"{pattern}: 未知的指标 {key}（可用: {', '.join(RESOURCE_LIMITS)}）")
+                continue
+            try:
+                value = parse_size(limit) if key == "rss" else float(limit)
+            except (TypeError, ValueError):
+                errors.append(f"{pattern}: {key} 的阈值无效: {limit}")
+                continue
+            rules.append((pattern, key, value))
+    return rules, errors
+
 
 class RemoteMonitor:
     """远程监控器 - 通过HTTP监控远程Agent"""
 
-    def __init__(self, config, notifier):
+    def __init__(self, config, notifier, history=None, checkpoint=None, cluster=None):
         self.config = config
         self.notifier = notifier
+        self.history = history  # 状态历史存储（可选），只入队不阻塞
+        self.checkpoint = checkpoint  # 状态检查点（可选），重启后恢复 last_state/last_alert_time
+        self.cluster = cluster  # 多实例集群（可选），只检查分配给本实例的目标
+        self.uptime = UptimeRollup()  # 可用率汇总，随每次检查结果增量更新
+        self.confirmation = create_confirmation_tracker(config)  # N-of-M 故障确认 + 抖动检测
+        self.breaker = create_circuit_breaker(config)  # Agent存活跟踪：连续失败后熔断，降频短超时探测
         self.monitors = config.get("monitors", [])
         self.last_state = {}  # {monitor_name: {process: running}}
         self.last_alert_time = defaultdict(float)  # 上次告警时间
         self._stop_event = threading.Event()
+        self._wake_event = threading.Event()  # 配置变更后立即开始新一轮检查
+
+        # 并发轮询：线程池限制同时进行的请求数，last_state/last_alert_time 统一由 _state_lock 保护
+        self.max_concurrency = config.get("max_concurrency", 32)
+        self._executor = None
+        self._state_lock = threading.Lock()
+        self._reprobing = set()  # 正在线程池中复查的推送目标进程 "监控目标:进程"
+
+        # 按目标调度：每个目标独立的检查间隔（monitor.interval，默认 check_interval）
+        self.scheduler = create_scheduler(config)
+        self.check_count = 0  # 累计完成的检查次数
+        self._snapshot_dirty = False  # 有检查完成但快照尚未重建
+        self._snapshot_built_at = 0.0
+
+        # 共享的keep-alive连接池，避免每次轮询都重新建立TCP连接
+        self.http_client = create_agent_client(config)
+
+        # 状态快照：由监控循环在每轮检查后重建，Web层直接读取，不再实时探测Agent
+        self.agent_status = {}  # {monitor_name: {"online": bool, "checked_at": ts}}
+        self.agent_hostnames = {}  # {"host:port": hostname}，来自最近一次成功的轮询
+
+        # 增量同步：每个Agent一份进程名镜像，只拉取变化部分
+        self._process_mirrors = {}  # {"host:port": {"epoch": str, "generation": int, "names": frozenset}}
+        self._delta_unsupported = set()  # 不支持增量接口的旧版Agent
+        self._query_unsupported = set()  # 不支持按规则查询接口的旧版Agent
+        self._resources_unsupported = set()  # 不支持资源指标的旧版Agent
+        self._unchecked_rules = set()  # 已记录过的无法检查的命令行规则 (监控目标, 规则)
+
+        # 资源阈值（仅拉取模式）：Agent随查询返回被监控进程的资源汇总
+        self.resource_stats = {}  # {monitor_name: {规则: 资源汇总}}，来自最近一次检查
+        self.resource_alerts = {}  # {"monitor:规则:指标": {"breached": bool, "notified": bool, "alerted_at": ts}}
+        self._threshold_errors = set()  # 已记录过的阈值配置错误，避免每次检查重复记录
+
+        # 推送模式：Agent通过长连接主动上报进程变化，超过 push_timeout 未收到消息视为离线
+        self.push_timeout = config.get("push_timeout", 30)
+        self._push_agents = {}  # {agent_id: {"names": frozenset, "epoch", "generation", "last_seen", "connected"}}
+
+        # 中继模式：中继Agent汇总一个站点的进程，同一中继的目标在 relay_max_age 秒内共享一次请求
+        self.relay_max_age = config.get("relay_max_age", 5)
+        self._relay_batches = {}  # {relay: {"fetched_at", "etag", "targets"}}，targets 为None表示中继不可达
+        self._relay_locks = defaultdict(threading.Lock)
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()  # 监控循环和推送消息都会触发重建
+        self.events = create_event_hub(config)  # 快照变化时向 /api/stream 的客户端广播变化的目标
+
+        self._owned = None  # 本实例负责的目标名称（未启用集群时为None，表示全部）
+        if cluster is not None:
+            cluster.on_change = self.rebalance
+            cluster.local_push_agents = self._connected_push_agents
+            self._owned = set()
+        self._rebalance_lock = threading.Lock()  # 心跳线程和配置重载都会触发
+        self._config_lock = threading.Lock()  # 串行化 apply_config（Web保存和配置文件监视线程）
+        self._rebuild_snapshot()
 
     def check_agent_health(self, host, port, timeout=5):
         """
@@ -33,7 +237,7 @@ class RemoteMonitor:
         """
         try:
             url = f"http://{host}:{port}/api/health"
-            response = requests.get(url, timeout=timeout)
+            response = self.http_client.get(url, timeout=timeout)
 
             if response.status_code == 200:
                 return response.json()
@@ -49,18 +253,84 @@ class RemoteMonitor:
         """
         获取远程Agent的进程列表
 
+        优先使用增量接口 /api/processes/delta：携带上次同步到的代数，
+        Agent 只返回变化部分，本地镜像合并后得到完整集合。
+        旧版Agent不支持增量接口时自动回退到全量接口。
+
         Returns:
-            list: 进程名列表
+            frozenset: 进程名集合
+            None: 获取失败
+        """
+        agent_key = f"{host}:{port}"
+        if agent_key in self._delta_unsupported:
+            return self._get_full_processes(host, port, timeout)
+
+        mirror = self._process_mirrors.get(agent_key)
+        params = {"since": mirror["generation"], "epoch": mirror["epoch"]} if mirror else None
+
+        try:
+            url = f"http://{host}:{port}/api/processes/delta"
+            response = self.http_client.get(url, params=params, timeout=timeout)
+
+            if response.status_code == 404:
+                logger.info(f"Agent不支持增量接口，使用全量接口: {agent_key}")
+                self._delta_unsupported.add(agent_key)
+                return self._get_full_processes(host, port, timeout)
+
+            if response.status_code != 200:
+                logger.error(f"获取进程列表失败 {host}:{port} - HTTP {response.status_code}")
+                return None
+
+            data = wire.decode_response(response)
+            if data.get("status") != "ok":
+                logger.error(f"Agent返回错误: {data}")
+                return None
+
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"请求Agent失败 {host}:{port} - {e}")
+            return None
+
+        if data.get("hostname"):
+            self.agent_hostnames[agent_key] = data["hostname"]
+
+        mode = data.get("mode")
+        if mode == "full":
+            names = frozenset(data.get("processes", []))
+        elif mirror is not None and mode == "unchanged":
+            names = mirror["names"]
+        elif mirror is not None and mode == "delta":
+            names = (mirror["names"] - frozenset(data.get("removed", []))) | frozenset(data.get("added", []))
+        else:
+            # 没有本地镜像却收到了增量结果，丢弃后下次全量同步
+            logger.error(f"Agent增量结果无法应用 {host}:{port} - mode={mode}")
+            self._process_mirrors.pop(agent_key, None)
+            return None
+
+        self._process_mirrors[agent_key] = {
+            "epoch": data.get("epoch"),
+            "generation": data.get("generation"),
+            "names": names
+        }
+        return names
+
+    def _get_full_processes(self, host, port, timeout=10):
+        """
+        通过全量接口 /api/processes 获取进程列表（兼容旧版Agent）
+
+        Returns:
+            frozenset: 进程名集合
             None: 获取失败
         """
         try:
             url = f"http://{host}:{port}/api/processes"
-            response = requests.get(url, timeout=timeout)
+            response = self.http_client.get(url, timeout=timeout)
 
             if response.status_code == 200:
-                data = response.json()
+                data = wire.decode_response(response)
                 if data.get("status") == "ok":
-                    return data.get("processes", [])
+                    if data.get("hostname"):
+                        self.agent_hostnames[f"{host}:{port}"] = data["hostname"]
+                    return frozenset(data.get("processes", []))
                 else:
                     logger.error(f"Agent返回错误: {data}")
                     return None
@@ -68,27 +338,108 @@ class RemoteMonitor:
                 logger.error(f"获取进程列表失败 {host}:{port} - HTTP {response.status_code}")
                 return None
 
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             logger.error(f"请求Agent失败 {host}:{port} - {e}")
             return None
 
-    def is_process_running(self, process_name, running_processes):
+    def query_remote_processes(self, host, port, patterns, timeout=10):
+        """
+        按规则查询远程Agent的进程数（只传输关心的进程）
+
+        Returns:
+            dict: {规则: 进程数}
+            None: 获取失败
+        """
+        return self.query_remote_resources(host, port, patterns, (), timeout)[0]
+
+    def query_remote_resources(self, host, port, patterns, resource_patterns, timeout=10):
         """
-        检查进程是否在运行进程列表中
+        按规则查询进程数，同时获取 resource_patterns 匹配进程的资源汇总
+
+        Returns:
+            (counts, resources): {规则: 进程数}, {规则: {"count", "cpu_percent", "rss", "threads", "fds", "uptime"}}；
+            获取失败时 counts 为None，不需要或Agent不支持资源指标时 resources 为None
+        """
+        agent_key = f"{host}:{port}"
+        if agent_key in self._query_unsupported:
+            return self._query_by_process_list(host, port, patterns, timeout), None
+
+        body = {"processes": list(patterns)}
+        if resource_patterns:
+            body["resources"] = list(resource_patterns)
+        try:
+            url = f"http://{host}:{port}/api/query"
+            response = self.http_client.post(url, json=body, timeout=timeout)
+
+            if response.status_code in (404, 405):
+                logger.info(f"Agent不支持按规则查询，改为拉取进程列表: {agent_key}")
+                self._query_unsupported.add(agent_key)
+                return self._query_by_process_list(host, port, patterns, timeout), None
+
+            if response.status_code != 200:
+                logger.error(f"查询进程失败 {host}:{port} - HTTP {response.status_code}")
+                return None, None
+
+            data = wire.decode_response(response)
+            if not isinstance(data, dict) or data.get("status") != "ok":
+                logger.error(f"Agent返回错误: {data}")
+                return None, None
+
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"请求Agent失败 {host}:{port} - {e}")
+            return None, None
+
+        if data.get("hostname"):
+            self.agent_hostnames[agent_key] = data["hostname"]
+        for pattern, error in data.get("errors", {}).items():
+            logger.error(f"进程匹配规则无效 {pattern} ({agent_key}): {error}")
+
+        results = data.get("results", {})
+        if "cmdline" not in data.get("features", ()):
+            # 旧版Agent把命令行规则当作进程名匹配，结果不可信
+            results = {pattern: count for pattern, count in results.items() if not is_command_pattern(pattern)}
+
+        resources = data.get("resources") if resource_patterns else None
+        if resource_patterns and resources is None and agent_key not in self._resources_unsupported:
+            logger.warning(f"Agent不支持资源指标，资源阈值不生效（需要升级Agent）: {agent_key}")
+            self._resources_unsupported.add(agent_key)
+        return results, resources
+
+    def _query_by_process_list(self, host, port, patterns, timeout=10):
+        """旧版Agent：拉取进程名集合后在本地匹配（只能区分运行/未运行）"""
+        running_processes = self.get_remote_processes(host, port, timeout)
+        if running_processes is None:
+            return None
+        return count_process_matches(patterns, dict.fromkeys(running_processes, 1))
+
+    def is_process_running(self, process_name, process_counts):
+        """
+        检查进程是否在运行
 
         Args:
-            process_name: 进程名
-            running_processes: 当前运行的进程列表
+            process_name: 进程名或匹配规则
+            process_counts: {规则: 进程数}
 
         Returns:
             bool: 是否运行
         """
-        if not running_processes:
+        if not process_counts:
             return False
-        return process_name in running_processes
+        return process_counts.get(process_name, 0) > 0
+
+    @staticmethod
+    def _monitor_mode(monitor):
+        """指标中的目标类型: pull / push / relay"""
+        if monitor.get("mode") == "push":
+            return "push"
+        return "relay" if monitor.get("relay") else "pull"
 
     def check_monitor(self, monitor):
-        """检查单个监控目标"""
+        """检查单个监控目标（记录检查耗时）"""
+        with CHECK_DURATION.labels(self._monitor_mode(monitor)).time():
+            return self._check_monitor(monitor)
+
+    def _check_monitor(self, monitor):
         monitor_name = monitor.get("name", "未命名")
         host = monitor.get("host")
         port = monitor.get("port", 8888)
@@ -96,84 +447,662 @@ class RemoteMonitor:
 
         logger.debug(f"检查监控目标: {monitor_name} ({host}:{port})")
 
-        # 获取远程进程列表
-        running_processes = self.get_remote_processes(host, port)
+        if monitor.get("mode") == "push":
+            # 推送模式：使用最近一次上报的进程集合，只检查是否超时
+            process_counts = self._get_pushed_counts(monitor)
+        elif monitor.get("relay"):
+            # 中继模式：从中继汇总的站点进程集合中取出该目标
+            targets = self.get_relay_batch(monitor["relay"])
+            if targets is None:
+                # 中继不可达时目标状态未知，不计入目标自身的失败次数（中继离线单独告警）
+                return self._evaluate_monitor(monitor, None, probed=False)
+            process_counts = self._get_relayed_counts(monitor, targets)
+        else:
+            timeout = self.breaker.before_request(f"{host}:{port}")
+            if timeout is None:
+                # Agent已熔断且未到探测时间，不发起请求
+                logger.debug(f"Agent已熔断，跳过检查: {monitor_name} ({host}:{port})")
+                return self._evaluate_monitor(monitor, None, probed=False)
 
-        if running_processes is None:
-            # Agent连接失败
-            logger.warning(f"监控目标离线: {monitor_name} ({host}:{port})")
-            # TODO: 可以发送"监控目标离线"告警
+            # 只查询需要监控的进程（配置了资源阈值时一并获取这些进程的资源汇总）
+            thresholds = monitor.get("thresholds") or {}
+            try:
+                process_counts, resources = self.query_remote_resources(
+                    host, port, processes_to_monitor, list(thresholds) if isinstance(thresholds, dict) else (), timeout)
+            except Exception as e:
+                # 任何异常都记为一次失败，否则探测中的熔断器停在半开状态并一直占用探测名额
+                logger.error(f"处理Agent响应异常 {host}:{port} - {e}", exc_info=True)
+                process_counts, resources = None, None
+            return self._evaluate_monitor(monitor, process_counts, resources=resources)
+
+        return self._evaluate_monitor(monitor, process_counts)
+
+    def _agent_key(self, monitor):
+        """熔断器使用的Agent标识"""
+        if monitor.get("mode") == "push":
+            return f"push:{self._push_agent_id(monitor)}"
+        if monitor.get("relay"):
+            return f"relay:{monitor['relay']}/{self._relay_target_key(monitor)}"
+        return f"{monitor.get('host')}:{monitor.get('port', 8888)}"
+
+    def _breaker_keys(self, monitors):
+        """监控目标使用的熔断器键（目标自身及其所属中继）"""
+        keys = set()
+        for monitor in monitors:
+            keys.add(self._agent_key(monitor))
+            if monitor.get("relay"):
+                keys.add(f"relay:{monitor['relay']}")
+        return keys
+
+    @staticmethod
+    def _agent_addresses(monitors):
+        """监控目标请求的地址 "host:port"（Agent及其所属中继）"""
+        addresses = set()
+        for monitor in monitors:
+            addresses.add(f"{monitor.get('host')}:{monitor.get('port', 8888)}")
+            if monitor.get("relay"):
+                addresses.add(monitor["relay"])
+        return addresses
+
+    @staticmethod
+    def _relay_target_key(monitor):
+        """目标在中继汇总结果中的键：推送到中继的Agent用 agent_id，中继轮询的Agent用 host:port"""
+        return monitor.get("agent_id") or f"{monitor.get('host')}:{monitor.get('port', 8888)}"
+
+    def get_relay_batch(self, relay, max_age=None):
+        """
+        获取中继Agent汇总的整个站点的进程集合
+
+        结果（包括失败）缓存 relay_max_age 秒，同一中继的目标在此期间共享一次请求；
+        请求携带上次的ETag，站点无变化时中继返回304，不再传输进程列表。
+
+        Args:
+            relay: 中继地址 "host:port"
+            max_age: 可接受的缓存时间（秒），默认 relay_max_age；复查时传0强制重新请求
+
+        Returns:
+            dict: {目标: {"online", "hostname", "counts"}}
+            None: 中继不可达（或熔断中）
+        """
+        with self._relay_locks[relay]:
+            cached = self._relay_batches.get(relay)
+            now = time.monotonic()
+            if max_age is None:
+                max_age = self.relay_max_age
+            if cached is not None and now - cached["fetched_at"] < max_age:
+                return cached["targets"]
+
+            relay_key = f"relay:{relay}"
+            timeout = self.breaker.before_request(relay_key)
+            if timeout is None:
+                return None
+
+            offline_since = self.breaker.get_state(relay_key)["offline_since"]
+            try:
+                etag, targets = self._fetch_relay_batch(relay, cached, timeout)
+            except Exception as e:
+                # 同 _check_monitor：保证每次请求都有结果记录到熔断器
+                logger.error(f"处理中继响应异常 {relay} - {e}", exc_info=True)
+                etag, targets = cached.get("etag") if cached else None, None
+            event = self.breaker.record(relay_key, targets is not None)
+            self._relay_batches[relay] = {"fetched_at": time.monotonic(), "etag": etag, "targets": targets}
+
+        if event == EVENT_OFFLINE:
+            logger.error(f"中继连续 {self.breaker.failure_threshold} 次请求失败，判定离线: {relay}")
+            self._send_relay_alert(relay, "离线")
+        elif event == EVENT_RECOVERED:
+            logger.info(f"中继已恢复: {relay}")
+            self._send_relay_alert(relay, "已恢复", int(time.time() - offline_since) if offline_since else None)
+        return targets
+
+    def _fetch_relay_batch(self, relay, cached, timeout):
+        """
+        请求中继的 /api/relay/batch（响应为gzip压缩，由连接池自动解压）
+
+        Returns:
+            (etag, targets): 失败时 targets 为None，保留上次的ETag
+        """
+        previous_etag = cached.get("etag") if cached else None
+        previous_targets = cached.get("targets") if cached else None
+        headers = {"If-None-Match": previous_etag} if previous_etag and previous_targets is not None else None
+
+        try:
+            response = self.http_client.get(f"http://{relay}/api/relay/batch", headers=headers, timeout=timeout)
+            if response.status_code == 304:
+                return previous_etag, previous_targets
+            if response.status_code != 200:
+                logger.error(f"获取中继汇总失败 {relay} - HTTP {response.status_code}")
+                return previous_etag, None
+            data = wire.decode_response(response)
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"请求中继失败 {relay} - {e}")
+            return previous_etag, None
+
+        if not isinstance(data, dict) or data.get("status") != "ok":
+            logger.error(f"中继返回错误: {data}")
+            return previous_etag, None
+
+        targets = {}
+        for key, entry in data.get("targets", {}).items():
+            targets[key] = {
+                "online": bool(entry.get("online")),
+                "hostname": entry.get("hostname"),
+                "counts": dict.fromkeys(entry.get("processes", []), 1)
+            }
+        return response.headers.get("ETag"), targets
+
+    def _get_relayed_counts(self, monitor, targets):
+        """
+        从中继汇总结果中统计目标的进程
+
+        Returns:
+            dict: {规则: 进程数}
+            None: 中继报告该Agent离线或中继未配置该Agent
+        """
+        key = self._relay_target_key(monitor)
+        entry = targets.get(key)
+        if entry is None:
+            logger.error(f"中继 {monitor['relay']} 未汇总该Agent: {key}")
+            return None
+        if not entry["online"]:
+            return None
+        if entry["hostname"]:
+            self.agent_hostnames[f"{monitor.get('host')}:{monitor.get('port', 8888)}"] = entry["hostname"]
+        return count_process_matches(monitor.get("processes", []), entry["counts"])
+
+    def _send_relay_alert(self, relay, status, offline_seconds=None):
+        """发送中继离线/恢复告警（中继离线时站点内的目标不再逐个告警）"""
+        if self.cluster is not None and not self.cluster.claim_alert(f"agent:relay:{relay}:{status}", 60):
             return
+        host, _, port = relay.rpartition(":")
+        self.notifier.send_agent_alert(f"中继 {relay}", host, port, status, offline_seconds)
+
+    def _evaluate_monitor(self, monitor, process_counts, probed=True, resources=None):
+        """
+        根据一次检查结果更新状态并发送告警
+
+        Args:
+            monitor: 监控目标配置
+            process_counts: {规则: 进程数}，None 表示Agent离线
+            probed: 是否实际请求了Agent（熔断期间跳过的检查不计入失败次数）
+            resources: {规则: 资源汇总}，未获取时为None
+
+        Returns:
+            bool: 是否有进程状态发生变化
+        """
+        monitor_name = monitor.get("name", "未命名")
+        host = monitor.get("host")
+        port = monitor.get("port", 8888)
+        processes_to_monitor = monitor.get("processes", [])
+
+        agent_event = None
+        offline_since = None
+        if probed:
+            agent_key = self._agent_key(monitor)
+            if process_counts is not None:
+                offline_since = self.breaker.get_state(agent_key)["offline_since"]
+            agent_event = self.breaker.record(agent_key, process_counts is not None)
+
+        if not probed:
+            result = "skipped"
+        else:
+            result = "offline" if process_counts is None else "online"
+        CHECK_RESULTS.labels(self._monitor_mode(monitor), result).inc()
+
+        checked_at = time.time()
+        with self._state_lock:
+            self.agent_status[monitor_name] = {
+                "online": process_counts is not None,
+                "checked_at": checked_at
+            }
+            if process_counts is None:
+                self.resource_stats.pop(monitor_name, None)
+
+        if process_counts is None:
+            # Agent连接失败（或熔断中）
+            if probed:
+                logger.warning(f"监控目标离线: {monitor_name} ({host}:{port})")
+            if self.history is not None:
+                for process_name in processes_to_monitor:
+                    self.history.record_poll(monitor_name, process_name, None, checked_at)
+            if agent_event == EVENT_OFFLINE:
+                logger.error(f"Agent连续 {self.breaker.failure_threshold} 次检查失败，判定离线: {monitor_name} ({host}:{port})")
+                self._send_agent_alert(monitor, "离线")
+            return False
+
+        if agent_event == EVENT_RECOVERED:
+            duration = int(time.time() - offline_since) if offline_since else None
+            logger.info(f"Agent已恢复: {monitor_name} ({host}:{port})")
+            self._send_agent_alert(monitor, "已恢复", duration)
+
+        # 检查每个需要监控的进程（状态更新在锁内完成，告警在锁外发送）
+        alerts = []
+        suspects = []
+        changed = False
+        with self._state_lock:
+            for process_name in processes_to_monitor:
+                if process_name not in process_counts and is_command_pattern(process_name):
+                    # 推送/中继模式和旧版Agent只上报进程名，命令行规则保持未知状态
+                    if (monitor_name, process_name) not in self._unchecked_rules:
+                        self._unchecked_rules.add((monitor_name, process_name))
+                        logger.warning(f"命令行规则需要拉取模式和新版Agent，暂不检查: [{monitor_name}] {process_name}")
+                    continue
+                is_running = self.is_process_running(process_name, process_counts)
+                event = self._apply_observation(monitor_name, process_name, is_running, checked_at, alerts)
+                if event == EVENT_PENDING:
+                    suspects.append(process_name)
+                elif event is not None:
+                    changed = True
+
+        # 疑似停止的进程立即单独复查，确认后再告警
+        if suspects and monitor.get("mode") == "push":
+            # 推送消息在接收线程中处理，复查放到线程池执行，不阻塞后续消息
+            with self._state_lock:
+                suspects = [p for p in suspects if f"{monitor_name}:{p}" not in self._reprobing]
+                self._reprobing.update(f"{monitor_name}:{p}" for p in suspects)
+            if suspects:
+                self._get_executor().submit(self._reprobe_pushed, monitor, suspects)
+        else:
+            for process_name in suspects:
+                changed = self._reprobe(monitor, process_name, alerts) or changed
+
+        for process_name, status in alerts:
+            self._send_alert_with_cooldown(monitor_name, host, process_name, status)
+
+        if resources is not None:
+            self._evaluate_resources(monitor, resources)
+
+        return changed
+
+    def _evaluate_resources(self, monitor, resources):
+        """
+        按 monitor.thresholds 检查进程资源：越过阈值时告警（受 alert_cooldown 限制），
+        告警过的指标回到阈值内时发送恢复通知。进程未运行或指标暂无数据时保持原状态。
+        """
+        monitor_name = monitor.get("name", "未命名")
+        host = monitor.get("host")
+        rules, errors = compile_thresholds(monitor.get("thresholds") or {})
+        for error in errors:
+            if (monitor_name, error) not in self._threshold_errors:
+                self._threshold_errors.add((monitor_name, error))
+                logger.error(f"资源阈值配置无效 [{monitor_name}]: {error}")
+
+        now = time.time()
+        cooldown = self.config.get("alert_cooldown", 300)
+        alerts = []
+        with self._state_lock:
+            self.resource_stats[monitor_name] = resources
+            for pattern, key, limit in rules:
+                label, direction, field = RESOURCE_LIMITS[key]
+                value = (resources.get(pattern) or {}).get(field)
+                if value is None:
+                    continue
+                breached = value > limit if direction == ">" else value < limit
+                state_key = f"{monitor_name}:{pattern}:{key}"
+                state = self.resource_alerts.setdefault(
+                    state_key, {"breached": False, "notified": False, "alerted_at": 0.0})
+                if breached == state["breached"]:
+                    continue
+
+                state["breached"] = breached
+                if breached:
+                    state["notified"] = now - state["alerted_at"] >= cooldown
+                    if state["notified"]:
+                        state["alerted_at"] = now
+                        alerts.append((pattern, key, value, limit, "触发阈值"))
+                elif state["notified"]:
+                    state["notified"] = False
+                    alerts.append((pattern, key, value, limit, "已恢复"))
+
+        for pattern, key, value, limit, status in alerts:
+            label, direction, _ = RESOURCE_LIMITS[key]
+            alert_key = f"resource:{monitor_name}:{pattern}:{key}:{status}"
+            if self.cluster is not None and not self.cluster.claim_alert(alert_key, cooldown):
+                continue
+            logger.warning(f"进程资源{status} [{monitor_name}] {pattern} {label} {format_resource(key, value)}")
+            self.notifier.send_resource_alert(monitor_name, host, pattern, label, format_resource(key, value),
+                                              f"{direction} {format_resource(key, limit)}", status)
+
+    def _apply_observation(self, monitor_name, process_name, is_running, checked_at, alerts):
+        """
+        把一次观测交给确认状态机，更新已确认状态（调用方持有 _state_lock）
+
+        Returns:
+            str: 状态机事件（EVENT_*），无变化时为None
+        """
+        monitor_key = f"{monitor_name}:{process_name}"
+        was_running = self.last_state.get(monitor_key, None)
+        running, event, flap = self.confirmation.observe(monitor_key, was_running, is_running, checked_at)
+        flapping = self.confirmation.is_flapping(monitor_key)
+
+        if event == EVENT_FIRST:
+            logger.info(f"开始监控 [{monitor_name}] {process_name} (当前: {'运行' if is_running else '未运行'})")
+
+        elif event == EVENT_PENDING:
+            logger.info(f"进程疑似停止 [{monitor_name}] {process_name}，等待确认")
+
+        elif event == EVENT_DOWN:
+            if flapping:
+                logger.info(f"进程停止 [{monitor_name}] {process_name}（频繁启停中，不单独告警）")
+            else:
+                alerts.append((process_name, "已停止"))
 
-        # 检查每个需要监控的进程
-        current_state = {}
-        for process_name in processes_to_monitor:
-            is_running = self.is_process_running(process_name, running_processes)
-            current_state[process_name] = is_running
+        elif event == EVENT_UP:
+            logger.info(f"进程已恢复 [{monitor_name}] {process_name}")
 
-            # 状态机逻辑
-            monitor_key = f"{monitor_name}:{process_name}"
-            was_running = self.last_state.get(monitor_key, None)
+        if flap == FLAP_START:
+            logger.warning(f"进程频繁启停 [{monitor_name}] {process_name}，抑制后续停止告警")
+            alerts.append((process_name, "频繁启停"))
+        elif flap == FLAP_END:
+            logger.info(f"进程已稳定 [{monitor_name}] {process_name}")
+            if not running:
+                alerts.append((process_name, "已停止"))
 
-            if was_running is None:
-                # 首次检测
-                logger.info(f"开始监控 [{monitor_name}] {process_name} (当前: {'运行' if is_running else '未运行'})")
+        if event in (EVENT_FIRST, EVENT_DOWN, EVENT_UP) and self.history is not None:
+            self.history.record_transition(monitor_name, process_name, running, checked_at)
+        if self.history is not None:
+            self.history.record_poll(monitor_name, process_name, is_running, checked_at)
+        self.uptime.record(monitor_name, process_name, is_running, checked_at)
+        if self.cluster is not None and running != was_running:
+            self.cluster.stage_state(monitor_key, running)
+        self.last_state[monitor_key] = running
 
-            elif was_running and not is_running:
-                # 进程从运行变为停止 - 发送告警
-                self._send_alert_with_cooldown(monitor_name, host, process_name)
+        return event
 
-            elif not was_running and is_running:
-                # 进程从停止变为运行
-                logger.info(f"进程已恢复 [{monitor_name}] {process_name}")
+    def _reprobe(self, monitor, process_name, alerts):
+        """
+        对疑似停止的进程快速复查，直到确认停止或恢复（每次只查询这一个进程）
 
-            self.last_state[monitor_key] = is_running
+        Returns:
+            bool: 是否有确认的状态变化
+        """
+        monitor_name = monitor.get("name", "未命名")
+        monitor_key = f"{monitor_name}:{process_name}"
+        delay = self.config.get("confirmation", {}).get("reprobe_delay", 1)
+
+        for _ in range(self.confirmation.remaining_misses(monitor_key)):
+            if self._stop_event.wait(timeout=delay):
+                return False
+
+            is_running = self._probe_again(monitor, process_name)
+            if is_running is None:
+                # Agent无响应，交给下一次常规检查
+                return False
+
+            with self._state_lock:
+                event = self._apply_observation(monitor_name, process_name, is_running, time.time(), alerts)
+            if event != EVENT_PENDING:
+                return event is not None
+        return False
+
+    def _reprobe_pushed(self, monitor, suspects):
+        """推送模式的复查（在线程池中执行）：确认后发送告警并重建快照"""
+        monitor_name = monitor.get("name", "未命名")
+        alerts = []
+        changed = False
+        try:
+            for process_name in suspects:
+                changed = self._reprobe(monitor, process_name, alerts) or changed
+        except Exception as e:
+            logger.error(f"复查进程失败 [{monitor_name}]: {e}", exc_info=True)
+        finally:
+            with self._state_lock:
+                self._reprobing.difference_update(f"{monitor_name}:{p}" for p in suspects)
+
+        for process_name, status in alerts:
+            self._send_alert_with_cooldown(monitor_name, monitor.get("host"), process_name, status)
+        if changed:
+            self._rebuild_snapshot()
+
+    def _probe_again(self, monitor, process_name):
+        """
+        复查单个进程：拉取模式单独请求Agent；推送/中继模式读取最新的进程集合
+        （推送Agent在进程变化时立即上报，复查间隔内没有新的上报即表示仍未运行）
+
+        Returns:
+            bool: 是否运行，None 表示无法获取
+        """
+        if monitor.get("mode") == "push":
+            counts = self._get_pushed_counts(monitor)
+        elif monitor.get("relay"):
+            targets = self.get_relay_batch(monitor["relay"], max_age=0)
+            counts = self._get_relayed_counts(monitor, targets) if targets is not None else None
+        else:
+            return self.probe_process(monitor.get("host"), monitor.get("port", 8888), process_name)
+        return None if counts is None else self.is_process_running(process_name, counts)
+
+    def probe_process(self, host, port, process_name, timeout=5):
+        """
+        单独检查一个进程（精确名称使用 /api/process/<name> 并要求Agent使用新采样）
+
+        Returns:
+            bool: 是否运行，None 表示检查失败
+        """
+        if is_command_pattern(process_name) or compile_process_pattern(process_name) is not None:
+            counts = self.query_remote_processes(host, port, [process_name], timeout)
+            if counts is None or process_name not in counts:
+                return None
+            return counts[process_name] > 0
 
-    def _send_alert_with_cooldown(self, monitor_name, host, process_name):
-        """带冷却期的告警发送"""
+        try:
+            url = f"http://{host}:{port}/api/process/{quote(process_name, safe='')}"
+            response = self.http_client.get(url, params={"max_age": 0.5}, timeout=timeout)
+            if response.status_code != 200:
+                return None
+            data = wire.decode_response(response)
+            if data.get("status") != "ok":
+                return None
+            return bool(data.get("running"))
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"复查进程失败 {host}:{port} {process_name} - {e}")
+            return None
+
+    @staticmethod
+    def _push_agent_id(monitor):
+        """推送模式的Agent标识（未配置 agent_id 时使用 host）"""
+        return monitor.get("agent_id") or monitor.get("host")
+
+    def _get_pushed_counts(self, monitor):
+        """
+        推送模式：根据Agent最近一次上报计算进程数
+
+        Returns:
+            dict: {规则: 进程数}
+            None: 未连接或超过 push_timeout 未收到消息
+        """
+        agent_id = self._push_agent_id(monitor)
+        agent = self._push_agents.get(agent_id)
+        if agent is None or not agent["connected"]:
+            return None
+        if time.monotonic() - agent["last_seen"] > self.push_timeout:
+            logger.warning(f"推送Agent超时未发送心跳: {agent_id}")
+            return None
+        return count_process_matches(monitor.get("processes", []), dict.fromkeys(agent["names"], 1))
+
+    def ingest_push(self, event):
+        """
+        处理Agent推送的一条消息
+
+        消息类型：
+            full: {"type": "full", "agent_id", "hostname", "epoch", "generation", "processes": [...]}
+            delta: {"type": "delta", "agent_id", "epoch", "since", "generation", "added": [...], "removed": [...]}
+            keepalive: {"type": "keepalive", "agent_id", "generation"}
+
+        进程集合变化时立即重新评估绑定该Agent的推送监控目标。
+
+        Returns:
+            str: agent_id
+
+        Raises:
+            ValueError: 消息格式错误或增量无法应用（Agent需要重连并全量同步）
+        """
+        agent_id = event.get("agent_id")
+        event_type = event.get("type")
+        if not agent_id:
+            raise ValueError("缺少 agent_id")
+
+        agent = self._push_agents.get(agent_id)
+        now = time.monotonic()
+
+        if event_type == "full":
+            agent = {
+                "names": frozenset(event.get("processes", [])),
+                "epoch": event.get("epoch"),
+                "generation": event.get("generation"),
+                "last_seen": now,
+                "connected": True
+            }
+            if event.get("hostname"):
+                self.agent_hostnames[f"push:{agent_id}"] = event["hostname"]
+            logger.info(f"推送Agent已连接: {agent_id}")
+        elif agent is None or not agent["connected"]:
+            raise ValueError(f"未同步的推送Agent: {agent_id}")
+        elif event_type == "delta":
+            if event.get("epoch") != agent["epoch"] or event.get("since") != agent["generation"]:
+                raise ValueError(f"推送增量无法应用: {agent_id}")
+            names = (agent["names"] - frozenset(event.get("removed", []))) | frozenset(event.get("added", []))
+            agent = dict(agent, names=names, generation=event.get("generation"), last_seen=now)
+        elif event_type == "keepalive":
+            agent["last_seen"] = now
+            return agent_id
+        else:
+            raise ValueError(f"未知的消息类型: {event_type}")
+
+        self._push_agents[agent_id] = agent
+        if event_type == "full" and self.cluster is not None:
+            self.rebalance()  # 持有推送连接的实例负责该Agent的目标
+
+        changed = False
+        for monitor in self.monitors:
+            if (monitor.get("mode") == "push" and monitor.get("enabled", True)
+                    and self._push_agent_id(monitor) == agent_id):
+                counts = count_process_matches(monitor.get("processes", []), dict.fromkeys(agent["names"], 1))
+                changed = self._evaluate_monitor(monitor, counts) or changed
+        if changed:
+            self._rebuild_snapshot()
+        return agent_id
+
+    def push_disconnected(self, agent_id):
+        """推送连接断开：立即将绑定该Agent的目标视为离线"""
+        agent = self._push_agents.get(agent_id)
+        if agent is None:
+            return
+        self._push_agents[agent_id] = dict(agent, connected=False)
+        logger.warning(f"推送Agent已断开: {agent_id}")
+
+        for monitor in self.monitors:
+            if (monitor.get("mode") == "push" and monitor.get("enabled", True)
+                    and self._push_agent_id(monitor) == agent_id):
+                self._evaluate_monitor(monitor, None)
+        if self.cluster is not None:
+            self.rebalance()
+        else:
+            self._rebuild_snapshot()
+
+    def _send_agent_alert(self, monitor, status, offline_seconds=None):
+        """发送Agent离线/恢复告警（集群模式下多个实例只发送一次）"""
+        agent_key = self._agent_key(monitor)
+        if self.cluster is not None and not self.cluster.claim_alert(f"agent:{agent_key}:{status}", 60):
+            logger.info(f"Agent告警已由其他实例发送: {agent_key} {status}")
+            return
+        self.notifier.send_agent_alert(monitor.get("name", "未命名"), monitor.get("host"),
+                                       monitor.get("port", 8888), status, offline_seconds)
+
+    def _send_alert_with_cooldown(self, monitor_name, host, process_name, status="已停止"):
+        """带冷却期的告警发送（集群模式下同一冷却期内只有一个实例发送）"""
         now = time.time()
         cooldown = self.config.get("alert_cooldown", 300)
         alert_key = f"{monitor_name}:{process_name}"
-        last_alert = self.last_alert_time[alert_key]
+        with self._state_lock:
+            last_alert = self.last_alert_time[alert_key]
+
+        if now - last_alert >= cooldown and self.cluster is not None \
+                and not self.cluster.claim_alert(f"{alert_key}:{status}", cooldown):
+            logger.info(f"告警已由其他实例发送: [{monitor_name}] {process_name} {status}")
+            with self._state_lock:
+                self.last_alert_time[alert_key] = now
+            return
 
         if now - last_alert >= cooldown:
-            logger.warning(f"检测到进程停止 [{monitor_name}] {process_name}")
+            logger.warning(f"检测到进程{status} [{monitor_name}] {process_name}")
 
             # 发送告警
             success = self.notifier.send_process_alert_remote(
                 monitor_name,
                 host,
                 process_name,
-                "已停止"
+                status
             )
 
             if success:
-                self.last_alert_time[alert_key] = now
+                with self._state_lock:
+                    self.last_alert_time[alert_key] = now
             else:
                 logger.error(f"告警发送失败: [{monitor_name}] {process_name}")
         else:
             remaining = int(cooldown - (now - last_alert))
             logger.debug(f"进程 [{monitor_name}] {process_name} 在冷却期内，跳过告警 (剩余 {remaining} 秒)")
 
-    def check_all_monitors(self):
-        """检查所有启用的监控目标"""
-        active_monitors = [m for m in self.monitors if m.get("enabled", True)]
+    def _get_executor(self):
+        """懒加载轮询线程池（调度循环和推送复查都会调用）"""
+        with self._state_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix="MonitorWorker"
+                )
+            return self._executor
 
-        if not active_monitors:
-            logger.warning("没有启用的监控目标")
-            return
+    def _check_monitor_safe(self, monitor):
+        """在线程池中执行单个目标检查，异常只记录不外抛；完成后安排下一次检查"""
+        monitor_name = monitor.get("name", "未命名")
+        changed = False
+        try:
+            changed = self.check_monitor(monitor)
+        except Exception as e:
+            logger.error(f"检查监控目标失败 [{monitor_name}]: {e}", exc_info=True)
+        finally:
+            with self._state_lock:
+                self.check_count += 1
+                online = self.agent_status.get(monitor_name, {}).get("online", False)
+                wake = not self._snapshot_dirty
+                self._snapshot_dirty = True
+            if self.scheduler.complete(monitor_name, online, changed) or wake:
+                self._wake_event.set()
 
-        logger.info(f"开始检查 {len(active_monitors)} 个监控目标...")
+    def _dispatch_due(self):
+        """
+        把已到期的目标提交到线程池（最多 max_concurrency 个并发请求）
 
-        for monitor in active_monitors:
-            try:
-                self.check_monitor(monitor)
-            except Exception as e:
-                monitor_name = monitor.get("name", "未命名")
-                logger.error(f"检查监控目标失败 [{monitor_name}]: {e}", exc_info=True)
+        Returns:
+            int: 本次提交的目标数
+        """
+        monitors = {m.get("name", "未命名"): m for m in self.monitors}
+        executor = self._get_executor()
+        submitted = 0
+        for monitor_name in self.scheduler.pop_due():
+            monitor = monitors.get(monitor_name)
+            if monitor is None:
+                continue
+            executor.submit(self._check_monitor_safe, monitor)
+            submitted += 1
+        return submitted
+
+    def get_scheduler_stats(self):
+        """调度统计（用于 /api/stats）"""
+        stats = self.scheduler.get_stats()
+        stats["checks"] = self.check_count
+        return stats
+
+    def _build_status_list(self):
+        """根据最近一次轮询的结果生成状态列表（不发起网络请求）"""
+        with self._state_lock:
+            last_state = dict(self.last_state)
+            last_alert_time = dict(self.last_alert_time)
+            agent_status = dict(self.agent_status)
+            resource_stats = dict(self.resource_stats)
+            resource_alerts = {key: dict(state) for key, state in self.resource_alerts.items()}
 
-    def get_all_status(self):
-        """获取所有监控目标的状态"""
         status_list = []
 
         for monitor in self.monitors:
@@ -183,21 +1112,33 @@ class RemoteMonitor:
             enabled = monitor.get("enabled", True)
             processes = monitor.get("processes", [])
 
-            # 检查Agent健康状态
-            if enabled:
-                health = self.check_agent_health(host, port, timeout=3)
-                agent_status = "在线" if health else "离线"
-                agent_hostname = health.get("hostname", "unknown") if health else "unknown"
+            # Agent状态取自最近一次轮询；集群模式下其他实例负责的目标只显示归属
+            owner = None
+            if enabled and self._owned is not None and monitor_name not in self._owned:
+                owner = self.cluster.owner_of(monitor)
+                agent_status_text = "其他实例"
+                agent_hostname = "unknown"
+            elif enabled:
+                polled = agent_status.get(monitor_name)
+                if polled is None:
+                    agent_status_text = "未知"
+                else:
+                    agent_status_text = "在线" if polled["online"] else "离线"
+                if monitor.get("mode") == "push":
+                    hostname_key = f"push:{self._push_agent_id(monitor)}"
+                else:
+                    hostname_key = f"{host}:{port}"
+                agent_hostname = self.agent_hostnames.get(hostname_key, "unknown")
             else:
-                agent_status = "已禁用"
+                agent_status_text = "已禁用"
                 agent_hostname = "unknown"
 
             # 获取每个进程的状态
             process_status = []
             for proc in processes:
                 monitor_key = f"{monitor_name}:{proc}"
-                is_running = self.last_state.get(monitor_key, None)
-                last_alert = self.last_alert_time.get(monitor_key, 0)
+                is_running = last_state.get(monitor_key, None)
+                last_alert = last_alert_time.get(monitor_key, 0)
 
                 process_status.append({
                     "name": proc,
@@ -205,40 +1146,336 @@ class RemoteMonitor:
                     "last_alert": datetime.fromtimestamp(last_alert).strftime("%Y-%m-%d %H:%M:%S") if last_alert > 0 else "从未告警"
                 })
 
+            # 配置了资源阈值的进程：最近一次的资源汇总和当前超过的阈值
+            resources = []
+            stats = resource_stats.get(monitor_name, {}) if owner is None else {}
+            thresholds = monitor.get("thresholds")
+            for pattern in (thresholds if isinstance(thresholds, dict) else {}):
+                resources.append(dict(
+                    stats.get(pattern) or {"count": 0},
+                    name=pattern,
+                    breached=[key for key in RESOURCE_LIMITS
+                              if resource_alerts.get(f"{monitor_name}:{pattern}:{key}", {}).get("breached")]
+                ))
+
             status_list.append({
                 "monitor_name": monitor_name,
                 "host": host,
                 "port": port,
                 "enabled": enabled,
-                "agent_status": agent_status,
+                "agent_status": agent_status_text,
                 "agent_hostname": agent_hostname,
                 "processes": process_status,
-                "description": monitor.get("description", "")
+                "resources": resources,
+                "description": monitor.get("description", ""),
+                "owner": owner
             })
 
         return status_list
 
+    def _rebuild_snapshot(self):
+        """
+        重建状态快照
+
+        内容变化时版本号加1（用于ETag），checked_at 每次重建都会刷新，
+        用于判断快照是否过期。快照整体替换，读取方无需加锁。
+        内容变化时只把变化的目标广播给 SSE 客户端。先替换快照再广播，
+        新连接的客户端读取序号后取到的快照不会比该序号旧（最多重复收到一次变化）。
+        """
+        with self._snapshot_lock:
+            now = time.time()
+            status_list = self._build_status_list()
+            previous = self._snapshot
+            changed = previous is None or previous["monitors"] != status_list
+
+            if changed:
+                version = previous["version"] + 1 if previous else 1
+                updated_at = now
+            else:
+                version = previous["version"]
+                updated_at = previous["updated_at"]
+
+            self._snapshot = {
+                "version": version,
+                "updated_at": updated_at,
+                "checked_at": now if self.check_count else None,
+                "monitors": status_list
+            }
+
+            if changed and previous is not None:
+                self._publish_changes(version, previous["monitors"], status_list)
+
+    def _publish_changes(self, version, old_list, new_list):
+        """
+        广播两次快照之间的差异
+
+        事件 update: {"version", "changed": [变化或新增的目标状态], "removed": [目标名], "order": [目标名]}，
+        order 只在目标增删或顺序变化时出现
+        """
+        old_by_name = {m["monitor_name"]: m for m in old_list}
+        new_names = [m["monitor_name"] for m in new_list]
+        kept = set(new_names)
+        event = {
+            "version": version,
+            "changed": [m for m in new_list if old_by_name.get(m["monitor_name"]) != m],
+            "removed": [name for name in old_by_name if name not in kept]
+        }
+        if new_names != [m["monitor_name"] for m in old_list]:
+            event["order"] = new_names
+        self.events.publish("update", event)
+
+    def get_status_snapshot(self):
+        """
+        获取最近一次的状态快照（O(1)，不发起网络请求）
+
+        Returns:
+            dict: {"version": 3, "updated_at": ts, "checked_at": ts, "monitors": [...]}
+        """
+        return self._snapshot
+
+    def get_all_status(self):
+        """获取所有监控目标的状态（来自状态快照）"""
+        return self._snapshot["monitors"]
+
+    def export_state(self):
+        """导出需要跨重启保留的状态（只保留仍在冷却期内的告警时间）"""
+        cooldown = self.config.get("alert_cooldown", 300)
+        now = time.time()
+        with self._state_lock:
+            return {
+                "last_state": dict(self.last_state),
+                "last_alert_time": {
+                    key: ts for key, ts in self.last_alert_time.items()
+                    if now - ts < cooldown
+                }
+            }
+
+    def restore_state(self, state):
+        """
+        恢复检查点中的状态（只恢复当前配置中仍存在的监控目标和进程）
+
+        Returns:
+            int: 恢复的进程状态数
+        """
+        valid_keys = {
+            f"{monitor.get('name', '未命名')}:{process_name}"
+            for monitor in self.monitors
+            for process_name in monitor.get("processes", [])
+        }
+        restored = 0
+        with self._state_lock:
+            for key, running in state.get("last_state", {}).items():
+                if key in valid_keys and isinstance(running, bool):
+                    self.last_state[key] = running
+                    restored += 1
+            for key, ts in state.get("last_alert_time", {}).items():
+                if key in valid_keys:
+                    self.last_alert_time[key] = float(ts)
+        return restored
+
+    def save_checkpoint(self):
+        """保存状态检查点"""
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.export_state())
+
+    # 修改后需要重置该目标进程状态的字段（指向了另一台主机/另一个Agent）
+    TARGET_FIELDS = ("host", "port", "mode", "agent_id", "relay")
+    # 启动时创建、热加载不会应用的配置段（修改后需重启服务）
+    RESTART_SECTIONS = ("confirmation", "circuit_breaker", "agent_client")
+
+    def apply_config(self, new_config):
+        """
+        热加载配置：按名称对比监控目标，增删目标、修改进程列表和检查间隔，
+        未变化的目标保留进程状态和告警冷却
+
+        Web保存和配置文件监视线程都会调用，整个过程串行执行，
+        避免两次对比交错导致调度器、熔断器和进程状态与 self.monitors 不一致。
+
+        Returns:
+            dict: {"added": [...], "removed": [...], "updated": [...]}，无变化时各项为空
+        """
+        with self._config_lock:
+            return self._apply_config(new_config)
+
+    def _apply_config(self, new_config):
+        old_monitors = {m.get("name", "未命名"): m for m in self.monitors}
+        new_monitors = {m.get("name", "未命名"): m for m in new_config.get("monitors", [])}
+
+        added = [name for name in new_monitors if name not in old_monitors]
+        removed = [name for name in old_monitors if name not in new_monitors]
+        updated = [name for name in new_monitors if name in old_monitors and new_monitors[name] != old_monitors[name]]
+        restart_sections = [key for key in self.RESTART_SECTIONS if self.config.get(key) != new_config.get(key)]
+
+        with self._state_lock:
+            # 需要清理的状态键: 已删除目标的全部进程、目标地址变化后的全部进程、从进程列表中移除的进程
+            stale_prefixes = [f"{name}:" for name in removed]
+            stale_keys = set()
+            resource_prefixes = list(stale_prefixes)
+            for name in updated:
+                old, new = old_monitors[name], new_monitors[name]
+                if any(old.get(field) != new.get(field) for field in self.TARGET_FIELDS):
+                    stale_prefixes.append(f"{name}:")
+                    resource_prefixes.append(f"{name}:")
+                else:
+                    kept = set(new.get("processes", []))
+                    stale_keys.update(f"{name}:{p}" for p in old.get("processes", []) if p not in kept)
+                    if old.get("thresholds") != new.get("thresholds"):
+                        resource_prefixes.append(f"{name}:")
+
+            for state in (self.last_state, self.last_alert_time):
+                for key in list(state):
+                    if key in stale_keys or key.startswith(tuple(stale_prefixes)):
+                        del state[key]
+            self.confirmation.forget(stale_keys, stale_prefixes)
+            for key in [key for key in self.resource_alerts if key.startswith(tuple(resource_prefixes))]:
+                del self.resource_alerts[key]
+            for name in removed:
+                self.agent_status.pop(name, None)
+            for prefix in resource_prefixes:
+                self.resource_stats.pop(prefix[:-1], None)
+
+            self.config = new_config
+            self.monitors = new_config.get("monitors", [])
+            self.push_timeout = new_config.get("push_timeout", 30)
+            self.relay_max_age = new_config.get("relay_max_age", 5)
+            relays = {m.get("relay") for m in self.monitors}
+            for relay in [relay for relay in self._relay_batches if relay not in relays]:
+                del self._relay_batches[relay]
+            # 不再使用的Agent/中继清除熔断状态，之后重新添加时不会沿用旧的熔断
+            for key in self._breaker_keys(old_monitors.values()) - self._breaker_keys(self.monitors):
+                self.breaker.forget(key)
+            # 不再使用的Agent删除增量同步的进程名镜像和请求指标
+            addresses = self._agent_addresses(self.monitors)
+            for key in [key for key in list(self._process_mirrors) if key not in addresses]:
+                self._process_mirrors.pop(key, None)
+            for address in self._agent_addresses(old_monitors.values()) - addresses:
+                self.http_client.forget(address)
+            self.scheduler.configure(new_config)
+
+            new_concurrency = new_config.get("max_concurrency", 32)
+            old_executor = None
+            if new_concurrency != self.max_concurrency:
+                self.max_concurrency = new_concurrency
+                old_executor, self._executor = self._executor, None
+
+        if old_executor is not None:
+            # 正在执行的检查继续完成，新一轮使用新线程池
+            old_executor.shutdown(wait=False)
+
+        self._rebuild_snapshot()
+
+        if self.cluster is not None:
+            self.rebalance()
+        elif self.scheduler.sync(self.monitors):
+            self._wake_event.set()
+        if added or removed or updated:
+            logger.info(f"配置已重新加载: 新增 {added}, 删除 {removed}, 修改 {updated}")
+        if restart_sections:
+            logger.warning(f"配置 {', '.join(restart_sections)} 已修改，需重启服务后生效")
+        return {"added": added, "removed": removed, "updated": updated}
+
+    # 检查结果陆续完成时，快照最多每秒重建一次
+    SNAPSHOT_INTERVAL = 1.0
+
+    def _connected_push_agents(self):
+        """本实例持有推送连接的Agent"""
+        return [agent_id for agent_id, agent in list(self._push_agents.items()) if agent["connected"]]
+
+    def rebalance(self):
+        """
+        集群成员或推送连接变化后重新计算本实例负责的目标
+
+        失去的目标清理本地状态；接管的目标从共享表恢复上一个实例确认的进程状态。
+        """
+        if self.cluster is None:
+            return
+
+        with self._rebalance_lock:
+            self._rebalance()
+
+    def _rebalance(self):
+        monitors = [m for m in self.monitors if m.get("enabled", True)]
+        owned = {m.get("name", "未命名") for m in monitors if self.cluster.owns(m)}
+        lost = self._owned - owned
+        gained = owned - self._owned
+
+        gained_keys = [
+            f"{m.get('name', '未命名')}:{p}"
+            for m in monitors if m.get("name", "未命名") in gained
+            for p in m.get("processes", [])
+        ]
+        restored = self.cluster.load_states(gained_keys)
+
+        lost_prefixes = tuple(f"{name}:" for name in lost)
+        with self._state_lock:
+            if lost_prefixes:
+                for state in (self.last_state, self.last_alert_time):
+                    for key in [key for key in state if key.startswith(lost_prefixes)]:
+                        del state[key]
+                for name in lost:
+                    self.agent_status.pop(name, None)
+            self.last_state.update(restored)
+            self._owned = owned
+        if lost_prefixes:
+            self.confirmation.forget(prefixes=lost_prefixes)
+            kept = self._breaker_keys(m for m in monitors if m.get("name", "未命名") in owned)
+            for key in self._breaker_keys(m for m in monitors if m.get("name", "未命名") in lost) - kept:
+                self.breaker.forget(key)
+
+        if lost or gained:
+            logger.info(f"目标分配变化: 本实例负责 {len(owned)} 个目标 (接管 {len(gained)}，移交 {len(lost)})")
+        if self.scheduler.sync([m for m in monitors if m.get("name", "未命名") in owned]):
+            self._wake_event.set()
+        self._rebuild_snapshot()
+
     def run(self):
-        """监控循环（在独立线程中运行）"""
-        check_interval = self.config.get("check_interval", 30)
-        logger.info(f"远程监控已启动，检查间隔 {check_interval} 秒")
+        """调度循环（在独立线程中运行）：按各目标的到期时间提交检查"""
+        if self.cluster is not None:
+            self.rebalance()
+        else:
+            self.scheduler.sync(self.monitors)
+        stats = self.scheduler.get_stats()
+        logger.info(f"远程监控已启动，{stats['targets']} 个目标，默认检查间隔 {self.config.get('check_interval', 30)} 秒")
 
         while not self._stop_event.is_set():
+            self._wake_event.clear()
             try:
-                self.check_all_monitors()
+                self._dispatch_due()
             except Exception as e:
-                logger.error(f"监控检查异常: {e}", exc_info=True)
+                logger.error(f"监控调度异常: {e}", exc_info=True)
+
+            # 快照重建与检查解耦：有新结果时按 SNAPSHOT_INTERVAL 节流
+            timeout = self.scheduler.time_until_next(default=self.config.get("check_interval", 30))
+            if self._snapshot_dirty:
+                since_built = time.monotonic() - self._snapshot_built_at
+                if since_built >= self.SNAPSHOT_INTERVAL:
+                    with self._state_lock:
+                        self._snapshot_dirty = False
+                    self._rebuild_snapshot()
+                    self._snapshot_built_at = time.monotonic()
+                    logger.debug(f"调度状态: {self.get_scheduler_stats()}")
+                else:
+                    timeout = min(timeout, self.SNAPSHOT_INTERVAL - since_built)
+
+            if self.checkpoint is not None and self.checkpoint.due():
+                self.save_checkpoint()
 
-            # 使用wait代替sleep，便于快速退出
-            self._stop_event.wait(timeout=check_interval)
+            # 使用wait代替sleep，便于快速退出和响应配置变更/检查完成
+            self._wake_event.wait(timeout=timeout)
 
         logger.info("远程监控已停止")
 
     def stop(self):
         """停止监控"""
         self._stop_event.set()
+        self._wake_event.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.http_client.close()
+        self.events.close()
+        self.save_checkpoint()
 
 
-def create_remote_monitor(config, notifier):
+def create_remote_monitor(config, notifier, history=None, checkpoint=None, cluster=None):
     """从配置创建远程监控器"""
-    return RemoteMonitor(config, notifier)
+    return RemoteMonitor(config, notifier, history, checkpoint, cluster)
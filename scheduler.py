@@ -0,0 +1,191 @@
+"""
+轮询调度器 - 按监控目标分别安排下一次检查
+每个目标有独立的检查间隔，加随机抖动；离线目标逐步退避，状态变化后短时间内加密检查
+"""
+import heapq
+import random
+import itertools
+import threading
+import time
+
+
+class _Entry:
+    """单个监控目标的调度状态"""
+
+    __slots__ = ("interval", "token", "due", "offline", "confirm", "checked")
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.token = None  # 当前有效的堆元素序号，None 表示正在检查中
+        self.due = None
+        self.offline = 0  # 连续离线次数
+        self.confirm = 0  # 剩余的加密检查次数
+        self.checked = False  # 是否已完成过检查（首次检测不算状态变化）
+
+
+class PollScheduler:
+    """
+    基于最小堆的轮询调度器（线程安全）
+
+    - 新加入的目标在各自的检查间隔内均匀错开，避免同时请求所有Agent
+    - 每次安排下一次检查时加 ±jitter 的随机抖动，防止各目标逐渐同步
+    - Agent离线: 第一次离线后 confirm_interval 秒复查，之后按间隔翻倍退避，最长 max_backoff 秒
+    - 进程状态变化或Agent恢复后: 接下来 confirm_polls 次检查使用 confirm_interval
+    """
+
+    def __init__(self, default_interval=30, jitter=0.1, confirm_interval=5, confirm_polls=2, max_backoff=300):
+        self.default_interval = default_interval
+        self.jitter = jitter
+        self.confirm_interval = confirm_interval
+        self.confirm_polls = confirm_polls
+        self.max_backoff = max_backoff
+
+        self._heap = []  # [(due, token, name)]，被取代的元素在弹出时丢弃
+        self._entries = {}  # {name: _Entry}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        """从配置更新调度参数"""
+        scheduler_config = config.get("scheduler", {})
+        with self._lock:
+            self.default_interval = config.get("check_interval", 30)
+            self.jitter = scheduler_config.get("jitter", 0.1)
+            self.confirm_interval = scheduler_config.get("confirm_interval", 5)
+            self.confirm_polls = scheduler_config.get("confirm_polls", 2)
+            self.max_backoff = scheduler_config.get("max_backoff", 300)
+
+    def _push(self, name, entry, due):
+        entry.token = next(self._seq)
+        entry.due = due
+        heapq.heappush(self._heap, (due, entry.token, name))
+
+    def sync(self, monitors):
+        """
+        按当前启用的监控目标更新调度表
+
+        新目标在各自的间隔内均匀错开；已删除或已禁用的目标不再调度；
+        间隔变短的目标提前到新间隔内。
+
+        Returns:
+            bool: 最早的检查时间是否提前（调用方应唤醒调度循环）
+        """
+        now = time.monotonic()
+        with self._lock:
+            earliest = self._heap[0][0] if self._heap else None
+            active = {}
+            for monitor in monitors:
+                if monitor.get("enabled", True):
+                    active[monitor.get("name", "未命名")] = monitor.get("interval", self.default_interval)
+
+            for name in list(self._entries):
+                if name not in active:
+                    del self._entries[name]
+
+            new_names = [name for name in active if name not in self._entries]
+            for index, name in enumerate(new_names):
+                interval = active[name]
+                entry = _Entry(interval)
+                self._entries[name] = entry
+                self._push(name, entry, now + interval * index / len(new_names))
+
+            for name, interval in active.items():
+                entry = self._entries[name]
+                if entry.interval != interval:
+                    entry.interval = interval
+                    if entry.token is not None and entry.due > now + interval:
+                        self._push(name, entry, now + random.uniform(0, interval))
+
+            return bool(self._heap) and (earliest is None or self._heap[0][0] < earliest)
+
+    def pop_due(self):
+        """
+        取出所有已到期的目标（取出后到 complete() 之前不会再次到期）
+
+        Returns:
+            list: 目标名称
+        """
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, token, name = heapq.heappop(self._heap)
+                entry = self._entries.get(name)
+                if entry is None or entry.token != token:
+                    continue
+                entry.token = None
+                due.append(name)
+        return due
+
+    def complete(self, name, online, changed):
+        """
+        一次检查完成，安排下一次检查
+
+        Args:
+            name: 目标名称
+            online: Agent是否在线
+            changed: 是否有进程状态变化
+
+        Returns:
+            bool: 是否成为最早到期的目标（调用方应唤醒调度循环）
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.token is not None:
+                return False
+
+            interval = entry.interval
+            if not entry.checked:
+                entry.checked = True
+                changed = False
+            if not online:
+                entry.offline += 1
+                entry.confirm = 0
+                if entry.offline == 1:
+                    delay = min(interval, self.confirm_interval)
+                else:
+                    delay = min(interval * 2 ** (entry.offline - 2), max(self.max_backoff, interval))
+            else:
+                if changed or entry.offline:
+                    entry.confirm = self.confirm_polls
+                entry.offline = 0
+                if entry.confirm > 0:
+                    entry.confirm -= 1
+                    delay = min(interval, self.confirm_interval)
+                else:
+                    delay = interval
+
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            due = time.monotonic() + delay
+            self._push(name, entry, due)
+            return self._heap[0][1] == entry.token
+
+    def time_until_next(self, default=1.0):
+        """距离最早到期目标的秒数（没有目标时返回 default）"""
+        with self._lock:
+            while self._heap:
+                due, token, name = self._heap[0]
+                entry = self._entries.get(name)
+                if entry is not None and entry.token == token:
+                    return max(0.0, due - time.monotonic())
+                heapq.heappop(self._heap)
+        return default
+
+    def get_stats(self):
+        """调度统计"""
+        with self._lock:
+            entries = list(self._entries.values())
+            return {
+                "targets": len(entries),
+                "in_flight": sum(1 for e in entries if e.token is None),
+                "backing_off": sum(1 for e in entries if e.offline > 1),
+                "confirming": sum(1 for e in entries if e.confirm > 0),
+                "heap_size": len(self._heap)
+            }
+
+
+def create_scheduler(config):
+    """从配置创建轮询调度器"""
+    scheduler = PollScheduler()
+    scheduler.configure(config)
+    return scheduler
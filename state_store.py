@@ -0,0 +1,302 @@
+"""
+状态历史存储 - 基于SQLite(WAL)的追加写入存储
+记录每个(监控目标, 进程)的每次检查结果和状态变化，支持按时间范围查询
+"""
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    monitor TEXT NOT NULL,
+    process TEXT NOT NULL,
+    UNIQUE (monitor, process)
+);
+CREATE TABLE IF NOT EXISTS polls (
+    series_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    running INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_polls_series_ts ON polls (series_id, ts);
+CREATE TABLE IF NOT EXISTS poll_minutes (
+    series_id INTEGER NOT NULL,
+    minute INTEGER NOT NULL,
+    up INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (series_id, minute)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS transitions (
+    series_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    running INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_transitions_series_ts ON transitions (series_id, ts);
+"""
+
+
+def _to_db(running):
+    """True/False/None -> 1/0/NULL（NULL 表示Agent离线，状态未知）"""
+    return None if running is None else int(bool(running))
+
+
+def _from_db(value):
+    return None if value is None else bool(value)
+
+
+class StateHistoryStore:
+    """
+    状态历史存储
+
+    监控线程只把记录放入内存队列（不阻塞），由后台写线程批量写入；
+    原始检查记录保留 raw_retention_hours 小时，之后降采样为每分钟的
+    运行次数/检查次数，所有数据保留 retention_days 天。
+    """
+
+    def __init__(self, path, batch_size=5000, flush_interval=1.0, queue_size=100000,
+                 raw_retention_hours=24, retention_days=30, maintenance_interval=600):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.raw_retention = raw_retention_hours * 3600
+        self.retention = retention_days * 86400
+        self.maintenance_interval = maintenance_interval
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._series_ids = {}  # {(monitor, process): series_id}，只在写线程中使用
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ---------- 写入（监控线程调用，不阻塞） ----------
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 10000 == 1:
+                logger.warning(f"历史记录队列已满，已丢弃 {self.dropped} 条记录")
+
+    def record_poll(self, monitor, process, running, ts=None):
+        """记录一次检查结果"""
+        self._put(("poll", monitor, process, int(ts or time.time()), _to_db(running)))
+
+    def record_transition(self, monitor, process, running, ts=None):
+        """记录一次状态变化"""
+        self._put(("transition", monitor, process, ts or time.time(), _to_db(running)))
+
+    # ---------- 后台写线程 ----------
+
+    def _series_id(self, conn, monitor, process):
+        key = (monitor, process)
+        series_id = self._series_ids.get(key)
+        if series_id is None:
+            conn.execute("INSERT OR IGNORE INTO series (monitor, process) VALUES (?, ?)", key)
+            series_id = conn.execute(
+                "SELECT id FROM series WHERE monitor = ? AND process = ?", key
+            ).fetchone()[0]
+            self._series_ids[key] = series_id
+        return series_id
+
+    def _write_batch(self, conn, batch):
+        polls = []
+        transitions = []
+        with conn:
+            for kind, monitor, process, ts, running in batch:
+                row = (self._series_id(conn, monitor, process), ts, running)
+                if kind == "poll":
+                    polls.append(row)
+                else:
+                    transitions.append(row)
+            if polls:
+                conn.executemany("INSERT INTO polls (series_id, ts, running) VALUES (?, ?, ?)", polls)
+            if transitions:
+                conn.executemany("INSERT INTO transitions (series_id, ts, running) VALUES (?, ?, ?)", transitions)
+        self.written += len(batch)
+
+    def _maintain(self, conn):
+        """降采样过期的原始记录（Agent全程离线的分钟没有有效检查，不生成统计），删除超过保留期的数据"""
+        now = int(time.time())
+        raw_cutoff = (now - self.raw_retention) // 60 * 60  # 按整分钟切分，避免同一分钟被拆成两次聚合
+        cutoff = now - self.retention
+
+        with conn:
+            conn.execute("""
+                INSERT INTO poll_minutes (series_id, minute, up, total)
+                SELECT series_id, ts / 60 * 60, COALESCE(SUM(running = 1), 0), COUNT(running)
+                FROM polls WHERE ts < ?
+                GROUP BY series_id, ts / 60
+                HAVING COUNT(running) > 0
+                ON CONFLICT (series_id, minute) DO UPDATE SET
+                    up = up + excluded.up,
+                    total = total + excluded.total
+            """, (raw_cutoff,))
+            conn.execute("DELETE FROM polls WHERE ts < ?", (raw_cutoff,))
+            conn.execute("DELETE FROM poll_minutes WHERE minute < ?", (cutoff,))
+            conn.execute("DELETE FROM transitions WHERE ts < ?", (cutoff,))
+
+    def run(self):
+        """写入循环（在独立线程中运行）"""
+        conn = self._connect()
+        last_maintenance = time.monotonic()
+        try:
+            while not (self._stop_event.is_set() and self._queue.empty()):
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                try:
+                    if batch:
+                        self._write_batch(conn, batch)
+                    if time.monotonic() - last_maintenance >= self.maintenance_interval:
+                        self._maintain(conn)
+                        last_maintenance = time.monotonic()
+                except sqlite3.Error as e:
+                    logger.error(f"写入历史记录失败: {e}")
+        finally:
+            conn.close()
+
+    def start(self):
+        """启动写线程"""
+        self._thread = threading.Thread(target=self.run, name="StateHistoryWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """停止写线程（先写完队列中的记录）"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    # ---------- 查询（任意线程） ----------
+
+    def _query(self, sql, params):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def query_polls(self, monitor, process, start, end, limit=10000):
+        """
+        查询时间范围内的原始检查记录
+
+        Returns:
+            list: [(ts, running)]，running 为 None 表示Agent离线
+        """
+        rows = self._query("""
+            SELECT p.ts, p.running FROM polls p JOIN series s ON s.id = p.series_id
+            WHERE s.monitor = ? AND s.process = ? AND p.ts >= ? AND p.ts < ?
+            ORDER BY p.ts LIMIT ?
+        """, (monitor, process, int(start), int(end), limit))
+        return [(ts, _from_db(running)) for ts, running in rows]
+
+    def query_minutes(self, monitor, process, start, end):
+        """
+        查询时间范围内的每分钟统计（已降采样部分 + 尚未降采样的原始记录）
+
+        Returns:
+            list: [(minute_ts, up, total)]
+        """
+        return self._query("""
+            SELECT minute, SUM(up), SUM(total) FROM (
+                SELECT m.minute AS minute, m.up AS up, m.total AS total
+                FROM poll_minutes m JOIN series s ON s.id = m.series_id
+                WHERE s.monitor = ? AND s.process = ? AND m.minute >= ? AND m.minute < ?
+                UNION ALL
+                SELECT p.ts / 60 * 60, COALESCE(SUM(p.running = 1), 0), COUNT(p.running)
+                FROM polls p JOIN series s ON s.id = p.series_id
+                WHERE s.monitor = ? AND s.process = ? AND p.ts >= ? AND p.ts < ?
+                GROUP BY p.ts / 60
+                HAVING COUNT(p.running) > 0
+            ) GROUP BY minute ORDER BY minute
+        """, (monitor, process, int(start), int(end)) * 2)
+
+    def load_buckets(self, start, end, step=60):
+        """
+        导出所有进程在时间范围内按 step 秒聚合的统计（用于可用率预热）
+
+        Returns:
+            list: 按时间升序的 [(monitor, process, bucket_ts, up, total)]
+        """
+        step = max(60, int(step) // 60 * 60)
+        return self._query("""
+            SELECT s.monitor, s.process, t.minute / :step * :step AS bucket, SUM(t.up), SUM(t.total) FROM (
+                SELECT series_id, minute, up, total FROM poll_minutes
+                WHERE minute >= :start AND minute < :end
+                UNION ALL
+                SELECT series_id, ts / 60 * 60, COALESCE(SUM(running = 1), 0), COUNT(running)
+                FROM polls WHERE ts >= :start AND ts < :end GROUP BY series_id, ts / 60
+                HAVING COUNT(running) > 0
+            ) t JOIN series s ON s.id = t.series_id
+            GROUP BY t.series_id, bucket ORDER BY bucket
+        """, {"start": int(start), "end": int(end), "step": step})
+
+    def query_transitions(self, monitor, process, start, end, limit=10000):
+        """
+        查询时间范围内的状态变化
+
+        Returns:
+            list: [(ts, running)]
+        """
+        rows = self._query("""
+            SELECT t.ts, t.running FROM transitions t JOIN series s ON s.id = t.series_id
+            WHERE s.monitor = ? AND s.process = ? AND t.ts >= ? AND t.ts < ?
+            ORDER BY t.ts LIMIT ?
+        """, (monitor, process, start, end, limit))
+        return [(ts, _from_db(running)) for ts, running in rows]
+
+    def get_stats(self):
+        """写入统计"""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped
+        }
+
+
+def create_state_store(config):
+    """从配置创建状态历史存储（未启用时返回None）"""
+    history_config = config.get("history", {})
+    if not history_config.get("enabled", False):
+        return None
+
+    store = StateHistoryStore(
+        history_config.get("path", "data/history.db"),
+        batch_size=history_config.get("batch_size", 5000),
+        flush_interval=history_config.get("flush_interval", 1.0),
+        queue_size=history_config.get("queue_size", 100000),
+        raw_retention_hours=history_config.get("raw_retention_hours", 24),
+        retention_days=history_config.get("retention_days", 30)
+    )
+    store.start()
+    return store
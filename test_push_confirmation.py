@@ -0,0 +1,71 @@
+"""
+推送模式故障确认测试 - 推送的增量中进程消失后，应在 reprobe_delay 级别的时间内确认并告警，
+而不是等到下一次常规检查
+
+用法: python -m pytest test_push_confirmation.py  或  python test_push_confirmation.py
+"""
+import time
+import threading
+import unittest
+
+from remote_monitor import RemoteMonitor
+
+REPROBE_DELAY = 0.05
+
+
+class RecordingNotifier:
+    """记录发出的告警"""
+
+    def __init__(self):
+        self.alerts = []
+        self.sent = threading.Event()
+
+    def send_process_alert_remote(self, monitor_name, host, process_name, status):
+        self.alerts.append((monitor_name, process_name, status))
+        self.sent.set()
+        return True
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: True
+
+
+class PushConfirmationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.notifier = RecordingNotifier()
+        config = {
+            "check_interval": 30,
+            "monitors": [{"name": "web", "mode": "push", "agent_id": "web-01", "processes": ["nginx", "redis"]}],
+            "confirmation": {"confirm_count": 2, "confirm_window": 3, "reprobe_delay": REPROBE_DELAY}
+        }
+        self.monitor = RemoteMonitor(config, self.notifier)
+        self.monitor.ingest_push({"type": "full", "agent_id": "web-01", "epoch": "e1", "generation": 1,
+                                  "processes": ["nginx", "redis"]})
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def push_delta(self, since, added=(), removed=()):
+        self.monitor.ingest_push({"type": "delta", "agent_id": "web-01", "epoch": "e1", "since": since,
+                                  "generation": since + 1, "added": list(added), "removed": list(removed)})
+
+    def test_removed_process_alerts_after_reprobe(self):
+        started = time.monotonic()
+        self.push_delta(1, removed=["nginx"])
+
+        self.assertTrue(self.notifier.sent.wait(timeout=REPROBE_DELAY * 20), "推送模式疑似停止后未及时确认")
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(self.notifier.alerts, [("web", "nginx", "已停止")])
+        self.assertFalse(self.monitor.last_state["web:nginx"])
+        self.assertTrue(self.monitor.last_state["web:redis"])
+
+    def test_process_back_before_reprobe_does_not_alert(self):
+        self.push_delta(1, removed=["nginx"])
+        self.push_delta(2, added=["nginx"])
+
+        self.assertFalse(self.notifier.sent.wait(timeout=REPROBE_DELAY * 6))
+        self.assertTrue(self.monitor.last_state["web:nginx"])
+
+
+if __name__ == "__main__":
+    unittest.main()
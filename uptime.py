@@ -0,0 +1,134 @@
+"""
+可用率统计 - 增量维护的滑动窗口汇总
+每次检查结果到达时更新分钟/小时桶和窗口累计值，查询时无需扫描历史记录
+"""
+import time
+import threading
+from collections import deque
+
+# 窗口名 -> (窗口长度秒, 桶粒度秒)
+WINDOWS = {
+    "1h": (3600, 60),
+    "24h": (86400, 3600),
+    "30d": (30 * 86400, 3600)
+}
+
+
+class _SlidingWindow:
+    """单个窗口：按粒度分桶，同时维护窗口内的累计值"""
+
+    __slots__ = ("span", "step", "buckets", "up", "total")
+
+    def __init__(self, span, step):
+        self.span = span
+        self.step = step
+        self.buckets = deque()  # [(bucket_start, up, total)]
+        self.up = 0
+        self.total = 0
+
+    def add(self, ts, up, total):
+        start = int(ts) // self.step * self.step
+        if self.buckets and self.buckets[-1][0] >= start:
+            # 同一个桶（乱序到达的数据也并入最后一个桶）
+            last_start, bucket_up, bucket_total = self.buckets[-1]
+            self.buckets[-1] = (last_start, bucket_up + up, bucket_total + total)
+        else:
+            self.buckets.append((start, up, total))
+        self.up += up
+        self.total += total
+
+    def expire(self, now):
+        cutoff = int(now) - self.span
+        buckets = self.buckets
+        while buckets and buckets[0][0] + self.step <= cutoff:
+            _, up, total = buckets.popleft()
+            self.up -= up
+            self.total -= total
+
+    def ratio(self):
+        return self.up / self.total if self.total else None
+
+
+class UptimeRollup:
+    """
+    每个(监控目标, 进程)的可用率汇总
+
+    Agent离线时进程状态未知，不计入可用率分母。
+    """
+
+    def __init__(self, windows=None):
+        self.windows = windows or WINDOWS
+        self._series = {}  # {(monitor, process): {window_name: _SlidingWindow}}
+        self._lock = threading.Lock()
+
+    def _get_series(self, key):
+        series = self._series.get(key)
+        if series is None:
+            series = {name: _SlidingWindow(span, step) for name, (span, step) in self.windows.items()}
+            self._series[key] = series
+        return series
+
+    def record(self, monitor, process, running, ts=None):
+        """记录一次检查结果（running 为 None 时忽略）"""
+        if running is None:
+            return
+        ts = ts or time.time()
+        up = 1 if running else 0
+        with self._lock:
+            for window in self._get_series((monitor, process)).values():
+                window.add(ts, up, 1)
+                window.expire(ts)  # 不依赖查询触发过期，长时间无人查询时桶数也保持有界
+
+    def warm_up(self, rows):
+        """
+        从历史记录预热（服务重启后恢复窗口数据）
+
+        Args:
+            rows: 按时间升序的 [(monitor, process, minute_ts, up, total)]
+        """
+        now = time.time()
+        with self._lock:
+            for monitor, process, ts, up, total in rows:
+                for name, window in self._get_series((monitor, process)).items():
+                    if ts >= now - window.span:
+                        window.add(ts, up, total)
+                        window.expire(ts)
+
+    def _collect(self, key, series, now):
+        result = {"monitor": key[0], "process": key[1]}
+        for name, window in series.items():
+            window.expire(now)
+            ratio = window.ratio()
+            result[name] = round(ratio * 100, 3) if ratio is not None else None
+            result[f"{name}_checks"] = window.total
+        return result
+
+    def get(self, monitor, process):
+        """获取单个进程的可用率（百分比），没有数据时返回None"""
+        now = time.time()
+        with self._lock:
+            series = self._series.get((monitor, process))
+            if series is None:
+                return None
+            return self._collect((monitor, process), series, now)
+
+    def get_all(self, monitor=None):
+        """
+        获取所有（或指定监控目标的）进程可用率
+
+        Returns:
+            list: [{"monitor", "process", "1h", "24h", "30d", "1h_checks", ...}]
+        """
+        now = time.time()
+        results = []
+        with self._lock:
+            for key, series in list(self._series.items()):
+                if monitor is not None and key[0] != monitor:
+                    continue
+                item = self._collect(key, series, now)
+                if all(window.total == 0 for window in series.values()):
+                    # 整个窗口都已过期（目标已删除），释放内存
+                    del self._series[key]
+                    continue
+                results.append(item)
+        return results
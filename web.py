@@ -1,20 +1,44 @@
 """
 Web管理界面 - 支持多监控目标管理
 """
+import copy
 import json
 import os
+import time
 import logging
-from flask import Flask, render_template, request, jsonify
+import threading
+from flask import Flask, Response, render_template, request, jsonify
 from filelock import FileLock
 
+import metrics
+from remote_monitor import compile_thresholds
+
 logger = logging.getLogger(__name__)
 
 # 全局变量（由main.py注入）
 remote_monitor = None
 notifier = None
 heartbeat_monitor = None
+history_store = None
 CONFIG_FILE = "config.json"
 CONFIG_LOCK = CONFIG_FILE + ".lock"
+CONFIG_STAT_INTERVAL = 1.0  # 两次检查配置文件修改时间的最小间隔（秒）
+STREAM_KEEPALIVE = 15  # SSE 空闲时发送注释行的间隔（秒），用于及时发现已断开的客户端
+
+# 进程内配置缓存：按文件 mtime/size 判断是否需要重新读取，每次变化版本号加1
+_config_cache = {"signature": None, "config": {}, "version": 0, "checked_at": 0.0}
+_config_cache_lock = threading.Lock()
+_config_write_lock = threading.Lock()  # 串行化写入和应用；写文件和fsync期间不持有缓存锁，读取配置不被阻塞
+
+# 抓取 /metrics 时从各组件统计更新的仪表
+TARGETS = metrics.gauge("monitor_targets", "本实例调度的监控目标数")
+IN_FLIGHT = metrics.gauge("monitor_checks_in_flight", "正在进行的检查数")
+OPEN_CIRCUITS = metrics.gauge("monitor_agents_offline", "已熔断（判定离线）的Agent数")
+ALERT_QUEUE = metrics.gauge("monitor_alert_queue_depth", "告警发送队列中等待的告警数")
+
+
+class ConfigConflict(Exception):
+    """写入配置时版本不匹配（配置已被其他请求或外部编辑修改）"""
 
 
 def create_app():
@@ -30,18 +54,217 @@ def create_app():
 
     @app.route('/api/status')
     def api_status():
-        """获取所有监控目标状态"""
+        """
+        获取所有监控目标状态
+
+        返回监控循环维护的状态快照，支持 If-None-Match，
+        快照未变化时返回 304。快照版本号每次启动从1开始，ETag 带上本次启动的 epoch，
+        避免重启后版本号恰好相同而返回过期内容。
+        """
         status = get_status()
-        return jsonify(status)
+        response = jsonify(status)
+
+        if "version" in status:
+            response.set_etag(f"{remote_monitor.events.epoch}-{status['version']}", weak=True)
+            if status["checked_at"]:
+                response.headers["X-Snapshot-Age"] = str(int(time.time() - status["checked_at"]))
+            response.headers["Cache-Control"] = "no-cache"
+
+        return response.make_conditional(request)
+
+    @app.route('/api/stream')
+    def api_stream():
+        """
+        状态变化推送（Server-Sent Events）
+
+        连接后先发送 snapshot 事件（内容同 /api/status），之后每次快照变化发送 update 事件，
+        只包含变化的目标。断线重连时浏览器携带 Last-Event-ID，缓冲区中还有后续事件时只补发差异。
+        """
+        if remote_monitor is None:
+            return jsonify({"error": "监控器未初始化"}), 500
+
+        hub = remote_monitor.events
+        if not hub.connect():
+            return jsonify({"error": "实时连接数已达上限"}), 503
+
+        resume_seq = hub.parse_event_id(request.headers.get("Last-Event-ID"))
+
+        def snapshot_frame():
+            seq = hub.last_seq
+            return seq, hub.format("snapshot", get_status(), seq)
+
+        def generate():
+            try:
+                yield b"retry: 3000\n\n"
+                seq = resume_seq
+                if seq is None or hub.events_after(seq) is None:
+                    seq, frame = snapshot_frame()
+                    yield frame
+
+                while not hub.closed:
+                    events, last_seq = hub.wait(seq, STREAM_KEEPALIVE)
+                    if events is None:
+                        # 落后太多，缓冲区已覆盖：重新发送快照
+                        seq, frame = snapshot_frame()
+                        yield frame
+                    elif events:
+                        seq = last_seq
+                        yield b"".join(events)
+                    else:
+                        yield b": keepalive\n\n"
+            finally:
+                hub.disconnect()
+
+        response = Response(generate(), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"  # 经过nginx反向代理时不缓冲
+        return response
+
+    @app.route('/api/stats')
+    def api_stats():
+        """获取监控循环的运行统计（调度、连接复用）"""
+        if remote_monitor is None:
+            return jsonify({"error": "监控器未初始化"}), 500
+
+        return jsonify({
+            "scheduler": remote_monitor.get_scheduler_stats(),
+            "circuit_breaker": remote_monitor.breaker.get_stats(),
+            "cluster": remote_monitor.cluster.get_stats() if remote_monitor.cluster else {},
+            "http_client": remote_monitor.http_client.get_stats(),
+            "notifier": notifier.get_metrics() if notifier else {},
+            "history": history_store.get_stats() if history_store else {},
+            "stream": remote_monitor.events.get_stats()
+        })
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus/OpenMetrics 指标（Accept 含 application/openmetrics-text 时输出 OpenMetrics）"""
+        if remote_monitor is not None:
+            scheduler_stats = remote_monitor.get_scheduler_stats()
+            TARGETS.set(scheduler_stats["targets"])
+            IN_FLIGHT.set(scheduler_stats["in_flight"])
+            OPEN_CIRCUITS.set(remote_monitor.breaker.get_stats()["open"])
+        if notifier is not None:
+            ALERT_QUEUE.set(notifier.get_metrics().get("queue_depth", 0))
+
+        openmetrics, content_type = metrics.negotiate(request.headers.get("Accept"))
+        return Response(metrics.REGISTRY.render(openmetrics), content_type=content_type)
+
+    @app.route('/api/uptime')
+    def api_uptime():
+        """
+        获取进程可用率（最近1小时 / 24小时 / 30天，百分比）
+
+        参数: monitor (可选), process (可选，需同时提供 monitor)
+        """
+        if remote_monitor is None:
+            return jsonify({"success": False, "error": "监控器未初始化"}), 500
+
+        monitor_name = request.args.get('monitor')
+        process_name = request.args.get('process')
+        if process_name:
+            if not monitor_name:
+                return jsonify({"success": False, "error": "请同时提供 monitor 参数"}), 400
+            item = remote_monitor.uptime.get(monitor_name, process_name)
+            items = [item] if item else []
+        else:
+            items = remote_monitor.uptime.get_all(monitor_name)
+
+        return jsonify({"success": True, "uptime": items})
+
+    @app.route('/api/history')
+    def api_history():
+        """
+        查询进程状态历史
+
+        参数: monitor, process, start/end (Unix时间戳，默认最近1小时),
+        resolution=raw|minute (默认raw)
+        """
+        if history_store is None:
+            return jsonify({"success": False, "error": "未启用历史记录"}), 404
+
+        monitor_name = request.args.get('monitor')
+        process_name = request.args.get('process')
+        if not monitor_name or not process_name:
+            return jsonify({"success": False, "error": "请提供 monitor 和 process 参数"}), 400
+
+        try:
+            end = float(request.args.get('end', time.time()))
+            start = float(request.args.get('start', end - 3600))
+        except ValueError:
+            return jsonify({"success": False, "error": "start/end 必须是时间戳"}), 400
+
+        resolution = request.args.get('resolution', 'raw')
+        result = {
+            "success": True,
+            "monitor": monitor_name,
+            "process": process_name,
+            "start": start,
+            "end": end,
+            "transitions": history_store.query_transitions(monitor_name, process_name, start, end)
+        }
+        if resolution == 'minute':
+            result["minutes"] = history_store.query_minutes(monitor_name, process_name, start, end)
+        else:
+            result["polls"] = history_store.query_polls(monitor_name, process_name, start, end)
+        return jsonify(result)
+
+    @app.route('/api/ingest', methods=['POST'])
+    def ingest():
+        """
+        推送模式接入点
+
+        Agent 以分块传输(chunked)保持一个长连接，每行一条JSON消息
+        (full / delta / keepalive)，连接断开时绑定的目标立即视为离线。
+        """
+        if remote_monitor is None:
+            return jsonify({"success": False, "error": "监控器未初始化"}), 500
+
+        token = remote_monitor.config.get("push_token")
+        if token and request.headers.get("X-Agent-Token") != token:
+            return jsonify({"success": False, "error": "认证失败"}), 403
+
+        agent_id = None
+        try:
+            while True:
+                line = request.stream.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                agent_id = remote_monitor.ingest_push(json.loads(line))
+
+        except ValueError as e:
+            logger.warning(f"推送消息无效: {e}")
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        except OSError as e:
+            # Agent重启或网络中断导致分块流被截断
+            logger.warning(f"推送连接中断: {e}")
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        except Exception as e:
+            logger.error(f"推送连接异常: {e}", exc_info=True)
+            return jsonify({"success": False, "error": str(e)}), 500
+
+        finally:
+            if agent_id:
+                remote_monitor.push_disconnected(agent_id)
+
+        return jsonify({"success": True})
 
     @app.route('/api/monitors', methods=['GET'])
     def get_monitors():
-        """获取所有监控目标配置"""
-        config = load_config()
-        return jsonify({
+        """获取所有监控目标配置（附带配置版本号，修改时可通过 X-Config-Version 提交）"""
+        config, version = load_config_versioned()
+        response = jsonify({
             "success": True,
+            "version": version,
             "monitors": config.get("monitors", [])
         })
+        response.headers["X-Config-Version"] = str(version)
+        return response
 
     @app.route('/api/monitors', methods=['POST'])
     def add_monitor():
@@ -58,8 +281,15 @@ def create_app():
                         "error": f"缺少必填字段: {field}"
                     }), 400
 
+            threshold_errors = compile_thresholds(new_monitor.get('thresholds') or {})[1]
+            if threshold_errors:
+                return jsonify({
+                    "success": False,
+                    "error": f"资源阈值配置无效: {'; '.join(threshold_errors)}"
+                }), 400
+
             # 加载配置
-            config = load_config()
+            config, version = load_config_versioned()
             monitors = config.get("monitors", [])
 
             # 检查名称是否重复
@@ -77,14 +307,17 @@ def create_app():
             monitors.append(new_monitor)
             config['monitors'] = monitors
 
-            # 保存配置
-            write_config(config)
+            # 保存配置并立即生效
+            write_config(config, requested_version(version), apply=True)
 
             return jsonify({
                 "success": True,
-                "message": "监控目标已添加，重启服务后生效"
+                "message": "监控目标已添加并生效"
             })
 
+        except ConfigConflict as e:
+            return conflict_response(e)
+
         except Exception as e:
             logger.error(f"添加监控目标失败: {e}", exc_info=True)
             return jsonify({"success": False, "error": str(e)}), 500
@@ -95,7 +328,14 @@ def create_app():
         try:
             updated_monitor = request.json
 
-            config = load_config()
+            threshold_errors = compile_thresholds(updated_monitor.get('thresholds') or {})[1]
+            if threshold_errors:
+                return jsonify({
+                    "success": False,
+                    "error": f"资源阈值配置无效: {'; '.join(threshold_errors)}"
+                }), 400
+
+            config, version = load_config_versioned()
             monitors = config.get("monitors", [])
 
             if index < 0 or index >= len(monitors):
@@ -107,13 +347,16 @@ def create_app():
             # 更新配置
             monitors[index] = updated_monitor
             config['monitors'] = monitors
-            write_config(config)
+            write_config(config, requested_version(version), apply=True)
 
             return jsonify({
                 "success": True,
-                "message": "监控目标已更新，重启服务后生效"
+                "message": "监控目标已更新并生效"
             })
 
+        except ConfigConflict as e:
+            return conflict_response(e)
+
         except Exception as e:
             logger.error(f"更新监控目标失败: {e}", exc_info=True)
             return jsonify({"success": False, "error": str(e)}), 500
@@ -122,7 +365,7 @@ def create_app():
     def delete_monitor(index):
         """删除监控目标"""
         try:
-            config = load_config()
+            config, version = load_config_versioned()
             monitors = config.get("monitors", [])
 
             if index < 0 or index >= len(monitors):
@@ -134,13 +377,16 @@ def create_app():
             # 删除
             deleted = monitors.pop(index)
             config['monitors'] = monitors
-            write_config(config)
+            write_config(config, requested_version(version), apply=True)
 
             return jsonify({
                 "success": True,
                 "message": f"已删除监控目标: {deleted.get('name')}"
             })
 
+        except ConfigConflict as e:
+            return conflict_response(e)
+
         except Exception as e:
             logger.error(f"删除监控目标失败: {e}", exc_info=True)
             return jsonify({"success": False, "error": str(e)}), 500
@@ -148,12 +394,14 @@ def create_app():
     @app.route('/api/config', methods=['GET'])
     def get_config():
         """获取完整配置"""
-        config = load_config()
+        config, version = load_config_versioned()
         # 隐藏敏感信息
         if 'notification' in config:
             if 'dingtalk_secret' in config['notification']:
                 config['notification']['dingtalk_secret'] = '***'
-        return jsonify(config)
+        response = jsonify(config)
+        response.headers["X-Config-Version"] = str(version)
+        return response
 
     @app.route('/api/config', methods=['POST'])
     def save_config():
@@ -168,13 +416,16 @@ def create_app():
                     "error": "配置格式错误"
                 }), 400
 
-            write_config(new_config)
+            write_config(new_config, requested_version(), apply=True)
 
             return jsonify({
                 "success": True,
-                "message": "配置已保存，重启服务后生效"
+                "message": "配置已保存，监控目标立即生效（通知、心跳、Web端口、故障确认、熔断和Agent连接设置需重启服务）"
             })
 
+        except ConfigConflict as e:
+            return conflict_response(e)
+
         except Exception as e:
             logger.error(f"保存配置失败: {e}", exc_info=True)
             return jsonify({"success": False, "error": str(e)}), 500
@@ -242,42 +493,149 @@ def create_app():
     return app
 
 
-def load_config():
-    """加载配置（带文件锁）"""
-    lock = FileLock(CONFIG_LOCK)
+def requested_version(default=None):
+    """
+    请求头 X-Config-Version 中客户端读取时的配置版本；
+    未提供时使用 default（本次请求读取配置时的版本，防止并发修改互相覆盖）
+    """
+    value = request.headers.get("X-Config-Version")
+    if value is None:
+        return default
     try:
-        with lock.acquire(timeout=5):
-            if not os.path.exists(CONFIG_FILE):
-                return {}
+        return int(value)
+    except ValueError:
+        return default
+
+
+def conflict_response(error):
+    """配置版本冲突（409）"""
+    return jsonify({
+        "success": False,
+        "error": f"{error}，请刷新后重试"
+    }), 409
+
+
+def _config_signature():
+    try:
+        st = os.stat(CONFIG_FILE)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _refresh_config_cache(force=False):
+    """配置文件有变化时重新读取（调用方持有 _config_cache_lock）"""
+    now = time.monotonic()
+    if not force and now - _config_cache["checked_at"] < CONFIG_STAT_INTERVAL:
+        return
+    _config_cache["checked_at"] = now
+
+    signature = _config_signature()
+    if signature == _config_cache["signature"]:
+        return
+
+    config = {}
+    if signature is not None:
+        with FileLock(CONFIG_LOCK).acquire(timeout=5):
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"加载配置失败: {e}")
-        return {}
+                config = json.load(f)
+            signature = _config_signature()
+
+    _config_cache["signature"] = signature
+    _config_cache["config"] = config
+    _config_cache["version"] += 1
+
 
+def load_config_versioned():
+    """
+    加载配置（读取进程内缓存，最多每秒检查一次文件是否变化）
 
-def write_config(config):
-    """写入配置（带文件锁）"""
-    lock = FileLock(CONFIG_LOCK)
-    with lock.acquire(timeout=5):
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+    Returns:
+        tuple: (配置副本, 版本号)
+    """
+    with _config_cache_lock:
+        try:
+            _refresh_config_cache()
+        except Exception as e:
+            logger.error(f"加载配置失败: {e}")
+        return copy.deepcopy(_config_cache["config"]), _config_cache["version"]
+
+
+def load_config():
+    """加载配置（返回副本，调用方可以直接修改）"""
+    return load_config_versioned()[0]
+
+
+def write_config(config, expected_version=None, apply=False):
+    """
+    写入配置：先写临时文件再原子替换，写入中途崩溃不会损坏原文件
+
+    Args:
+        config: 新配置
+        expected_version: 期望的当前版本号，不匹配时抛出 ConfigConflict
+        apply: 写入后立即应用到运行中的监控器（在写锁内完成，并发保存按写入顺序生效）
+
+    Returns:
+        int: 写入后的版本号
+    """
+    data = json.dumps(config, indent=2, ensure_ascii=False)
+    tmp_path = f"{CONFIG_FILE}.tmp"
+
+    with _config_write_lock:
+        if expected_version is not None:
+            with _config_cache_lock:
+                _refresh_config_cache(force=True)
+                current_version = _config_cache["version"]
+            if expected_version != current_version:
+                raise ConfigConflict(f"配置已被修改 (当前版本 {current_version})")
+
+        with FileLock(CONFIG_LOCK).acquire(timeout=5):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, CONFIG_FILE)
+            signature = _config_signature()
+
+        with _config_cache_lock:
+            # 替换文件后可能已有读取方按新文件刷新了缓存，此时不再重复加版本号
+            if _config_cache["signature"] != signature:
+                _config_cache["signature"] = signature
+                _config_cache["config"] = copy.deepcopy(config)
+                _config_cache["version"] += 1
+            _config_cache["checked_at"] = time.monotonic()
+            version = _config_cache["version"]
+
+        if apply:
+            apply_config(config)
+        return version
+
+
+def apply_config(config):
+    """把写入的配置应用到运行中的监控器"""
+    if remote_monitor is not None:
+        remote_monitor.apply_config(config)
 
 
 def get_status():
-    """获取当前监控状态"""
+    """获取当前监控状态（读取状态快照，不访问Agent）"""
     if remote_monitor is None:
         return {"error": "监控器未初始化"}
 
+    snapshot = remote_monitor.get_status_snapshot()
     return {
-        "monitors": remote_monitor.get_all_status(),
+        "version": snapshot["version"],
+        "updated_at": snapshot["updated_at"],
+        "checked_at": snapshot["checked_at"],
+        "monitors": snapshot["monitors"],
         "heartbeat_enabled": heartbeat_monitor.enabled if heartbeat_monitor else False
     }
 
 
-def set_monitor_instances(rm, nf, hb):
+def set_monitor_instances(rm, nf, hb, hs=None):
     """设置监控器实例（由main.py调用）"""
-    global remote_monitor, notifier, heartbeat_monitor
+    global remote_monitor, notifier, heartbeat_monitor, history_store
     remote_monitor = rm
     notifier = nf
     heartbeat_monitor = hb
+    history_store = hs
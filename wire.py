@@ -0,0 +1,90 @@
+"""
+Agent通信编码 - 紧凑二进制格式
+进程名列表占响应的绝大部分，紧凑格式把每个列表以 NUL 分隔整体编码为一段UTF-8，
+编解码由 str.join / str.split 在C层完成，不再逐个元素解析JSON字符串；其余字段仍为JSON。
+服务器在 Accept 中声明支持，旧版Agent忽略该请求头并返回JSON，按 Content-Type 解码即可兼容。
+"""
+import json
+import struct
+
+COMPACT_TYPE = "application/x-monitor-compact"
+ACCEPT = f"{COMPACT_TYPE}, application/json;q=0.9"
+
+MAGIC = b"PMC1"
+LIST_KEYS = frozenset(("processes", "added", "removed"))  # 按整段编码的字符串列表字段
+_LENGTH = struct.Struct("<I")
+
+
+def encode_compact(payload):
+    """
+    编码为紧凑格式
+
+    格式: MAGIC | u32 头部长度 | 头部 | (u32 长度 | NUL分隔的字符串)*
+    头部为JSON [payload, [[路径, 元素数], ...]]，payload 中 LIST_KEYS 字段的字符串列表
+    替换为null，按路径顺序依次存放在头部之后。
+
+    Returns:
+        bytes
+    """
+    blobs = []
+    lists = []
+
+    def strip(value, path):
+        if not isinstance(value, dict):
+            return value
+        result = {}
+        for key, item in value.items():
+            if key in LIST_KEYS and isinstance(item, (list, tuple)):
+                lists.append([path + [key], len(item)])
+                blobs.append("\0".join(item).encode("utf-8"))
+                result[key] = None
+            else:
+                result[key] = strip(item, path + [key])
+        return result
+
+    header = json.dumps([strip(payload, []), lists], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    parts = [MAGIC, _LENGTH.pack(len(header)), header]
+    for blob in blobs:
+        parts.append(_LENGTH.pack(len(blob)))
+        parts.append(blob)
+    return b"".join(parts)
+
+
+def decode_compact(data):
+    """
+    解码紧凑格式
+
+    Raises:
+        ValueError: 数据格式错误
+    """
+    if data[:4] != MAGIC:
+        raise ValueError("不是紧凑格式的数据")
+    try:
+        (header_length,) = _LENGTH.unpack_from(data, 4)
+        offset = 8 + header_length
+        payload, lists = json.loads(data[8:offset])
+        for path, count in lists:
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += 4
+            blob = data[offset:offset + length]
+            offset += length
+
+            target = payload
+            for key in path[:-1]:
+                target = target[key]
+            target[path[-1]] = blob.decode("utf-8").split("\0") if count else []
+    except (struct.error, KeyError, IndexError, TypeError) as e:
+        raise ValueError(f"紧凑格式数据损坏: {e}") from e
+    return payload
+
+
+def decode_response(response):
+    """
+    按 Content-Type 解码Agent响应（压缩已由连接池按 Content-Encoding 解开）
+
+    Raises:
+        ValueError: 响应内容无法解码
+    """
+    if response.headers.get("Content-Type", "").startswith(COMPACT_TYPE):
+        return decode_compact(response.content)
+    return response.json()